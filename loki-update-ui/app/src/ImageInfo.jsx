@@ -1,4 +1,4 @@
-import React from "react";
+import React, { useMemo } from "react";
 import { useAdapterEndpoint, WithEndpoint } from "odin-react";
 import Button from "react-bootstrap/esm/Button";
 import Container from "react-bootstrap/esm/Container";
@@ -8,14 +8,27 @@ import Accordion from "react-bootstrap/esm/Accordion";
 import ImageInfoCard from "./ImageInfoCard";
 import RebootBoardModal from "./RebootBoardModal";
 import FileSyncWarning from "./FileSyncWarning";
+import useEventStream from "./useEventStream";
 
 const EndpointButton = WithEndpoint(Button);
 
 export default function ImageInfo() {
-    const endpoint = useAdapterEndpoint(
+    // Changes are pushed over the event stream served on the upload port, so the adapter is
+    // only read once for the subtrees the stream does not carry. Without an event stream
+    // URL the adapter is polled instead.
+    const eventsURL = import.meta.env.VITE_EVENTS_URL;
+    const adapterEndpoint = useAdapterEndpoint(
         "loki-update",
         import.meta.env.VITE_ENDPOINT_URL,
-        1000
+        eventsURL ? undefined : 1000
+    );
+    const events = useEventStream(eventsURL);
+    const endpoint = useMemo(
+        () => ({
+            ...adapterEndpoint,
+            data: { ...adapterEndpoint?.data, ...events },
+        }),
+        [adapterEndpoint, events]
     );
 
     const installedEmmcImage = endpoint?.data?.installed_images?.emmc;
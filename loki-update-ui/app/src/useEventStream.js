@@ -0,0 +1,51 @@
+import { useEffect, useState } from "react";
+
+// Apply a delta from the event stream to the tree, returning a new tree.
+// A null value means the key has been removed.
+function mergeDelta(tree, delta) {
+    const merged = { ...tree };
+
+    Object.entries(delta).forEach(([key, value]) => {
+        if (value === null) {
+            delete merged[key];
+        } else if (
+            typeof value === "object" &&
+            !Array.isArray(value) &&
+            typeof merged[key] === "object" &&
+            merged[key] !== null &&
+            !Array.isArray(merged[key])
+        ) {
+            merged[key] = mergeDelta(merged[key], value);
+        } else {
+            merged[key] = value;
+        }
+    });
+
+    return merged;
+}
+
+// Subscribe to the parameter tree event stream, returning the published subtrees.
+// The server pushes a snapshot when the stream opens, and again after a reconnection,
+// followed by deltas of only the values which have changed.
+export default function useEventStream(url) {
+    const [data, setData] = useState({});
+
+    useEffect(() => {
+        if (!url) {
+            return undefined;
+        }
+
+        const source = new EventSource(url);
+        source.addEventListener("snapshot", (event) =>
+            setData(JSON.parse(event.data))
+        );
+        source.addEventListener("delta", (event) => {
+            const delta = JSON.parse(event.data);
+            setData((tree) => mergeDelta(tree, delta));
+        });
+
+        return () => source.close();
+    }, [url]);
+
+    return data;
+}
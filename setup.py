@@ -12,8 +12,7 @@ setup(
     install_requires=[
         "odin_control @ git+https://git@github.com/odin-detector/odin-control.git@1.6.0",
         "tornado>=4.3",
-        "future",
-        "pyfdt"    
+        "future"
     ],
     python_requires=">=3.7",
 )
\ No newline at end of file
@@ -2,14 +2,19 @@ import logging
 import json
 
 from tornado.escape import json_decode
+from tornado.ioloop import IOLoop
+from tornado.locks import Lock
 
-from odin.adapters.adapter import ApiAdapter, ApiAdapterResponse, request_types, response_types
+from odin.adapters.adapter import ApiAdapterResponse, request_types, response_types
+from odin.adapters.async_adapter import AsyncApiAdapter
 from odin.adapters.parameter_tree import ParameterTreeError
 
-from loki_update.controller import LokiUpdateController, LokiUpdateError
+from loki_update.controller import LokiUpdateController, LokiUpdateError, GITHUB_REPO_API_URL
+from loki_update.upload import make_upload_app
+from loki_update.events import EventPublisher
 
 
-class LokiUpdateAdapter(ApiAdapter):
+class LokiUpdateAdapter(AsyncApiAdapter):
     def __init__(self, **kwargs):
         """Initialise the LokiUpdateAdapter object.
 
@@ -27,23 +32,96 @@ class LokiUpdateAdapter(ApiAdapter):
         allow_only_emmc_upload = eval(self.options.get("allow_only_emmc_upload"))
         allow_images_from_repo = eval(self.options.get("allow_images_from_repo", False))
         available_repos = json.loads(self.options.get("available_repos", "[{}]"))
+        system_root = str(self.options.get("system_root", ""))
+        # Caches that must survive a reboot are kept on persistent storage, not the tmpfs /tmp
+        state_dir = str(self.options.get("state_dir", system_root + "/var/lib/loki-update/"))
+        metadata_cache_path = self.options.get("metadata_cache_path", state_dir + "metadata.json") or None
+        metadata_cache_size = int(self.options.get("metadata_cache_size", 32))
+        metadata_cache_verify = eval(self.options.get("metadata_cache_verify", "False"))
+        max_workers = int(self.options.get("max_workers", 4))
+        checksum_cache_path = self.options.get("checksum_cache_path", state_dir + "checksums.json") or None
+        artifact_cache_dir = self.options.get("artifact_cache_dir", state_dir + "artifacts/") or None
+        artifact_cache_size = int(self.options.get("artifact_cache_size", 256)) * 1024 * 1024
+        catalogue_snapshot_path = self.options.get("catalogue_snapshot_path", state_dir + "catalogue.json") or None
+        catalogue_refresh_interval = float(self.options.get("catalogue_refresh_interval", 3600))
+        probe_on_startup = eval(self.options.get("probe_on_startup", "True"))
+        sync_sample_interval = float(self.options.get("sync_sample_interval", 0.5))
+        github_api_url = str(self.options.get("github_api_url", GITHUB_REPO_API_URL))
+        artifact_seed = eval(self.options.get("artifact_seed", "False"))
+        artifact_peers = json.loads(self.options.get("artifact_peers", "[]"))
         
-        self.controller = LokiUpdateController(emmc_base_path, sd_base_path, backup_base_path, allow_reboot, allow_only_emmc_upload, allow_images_from_repo, available_repos)
+        self.controller = LokiUpdateController(emmc_base_path, sd_base_path, backup_base_path, allow_reboot, allow_only_emmc_upload, allow_images_from_repo, available_repos,
+                                               metadata_cache_path=metadata_cache_path,
+                                               metadata_cache_size=metadata_cache_size,
+                                               metadata_cache_verify=metadata_cache_verify,
+                                               max_workers=max_workers,
+                                               checksum_cache_path=checksum_cache_path,
+                                               artifact_cache_dir=artifact_cache_dir,
+                                               artifact_cache_size=artifact_cache_size,
+                                               catalogue_snapshot_path=catalogue_snapshot_path,
+                                               catalogue_refresh_interval=catalogue_refresh_interval,
+                                               probe_on_startup=probe_on_startup,
+                                               sync_sample_interval=sync_sample_interval,
+                                               system_root=system_root,
+                                               github_api_url=github_api_url,
+                                               artifact_seed=artifact_seed,
+                                               artifact_peers=artifact_peers)
+        
+        # Setters run on executor threads, and are run one at a time in the order the requests
+        # arrived, so a request depending on an earlier one, such as a release following its
+        # copy target, sees its change
+        self.set_lock = Lock()
+        
+        # Optionally serve the streaming upload, event stream and peer artifact endpoints, which odin-control routes cannot provide
+        self.upload_server = None
+        self.events = None
+        upload_port = int(self.options.get("upload_port", 0))
+        if upload_port:
+            upload_enable_cors = eval(self.options.get("upload_enable_cors", "True"))
+            self.events = EventPublisher(self.controller)
+            self.upload_server = make_upload_app(self.controller, upload_enable_cors, self.events).listen(upload_port)
+            logging.debug(f"Streaming upload endpoint listening on port {upload_port}")
         
         logging.debug("LokiUpdateAdapter loaded")
         
-    @response_types('application/json', default='application/json')
-    def get(self, path, request):
+    async def run_blocking(self, function, *args):
+        """Run a blocking controller call on an executor thread, leaving the IOLoop free.
+
+        :param function: controller method to call
+        :param args: arguments passed to the method
+        """
+        return await IOLoop.current().run_in_executor(None, function, *args)
+
+    def accepts_only_text(self, request):
+        accepted = [item.split(";")[0].strip() for item in request.headers.get("Accept", "").split(",")]
+        return "text/plain" in accepted and "application/json" not in accepted
+
+    @response_types('application/json', 'text/plain', default='application/json')
+    async def get(self, path, request):
         """Handle an HTTP GET request.
 
-        This method handles an HTTP GET request, returning a JSON response.
+        This method handles an HTTP GET request, returning a JSON response. Parameter tree
+        getters only return values already held in memory, so they are called directly.
+        A request for the metrics accepting plain text but not JSON, as a Prometheus scraper
+        makes, is answered with the metrics in the Prometheus text format.
+
+        The response is the JSON serialised by the controller, reused from the snapshot of a
+        versioned subtree until the subtree is bumped. odin-control gives adapters no way to
+        set response headers, so the ETag is the hash Tornado calculates over the body, not the
+        snapshot version. A request whose If-None-Match matches is answered with 304 Not
+        Modified and no body, but the body is still assembled and hashed to find that out;
+        only the serialisation of unchanged versioned subtrees is saved.
 
         :param path: URI path of request
         :param request: HTTP request object
         :return: an ApiAdapterResponse object containing the appropriate response
         """
+        if path.strip("/") == "metrics" and self.accepts_only_text(request):
+            return ApiAdapterResponse(self.controller.metrics.to_prometheus(),
+                                      content_type="text/plain; version=0.0.4", status_code=200)
+
         try:
-            response = self.controller.get(path)
+            response = self.controller.get_json(path)
             status_code = 200
         except ParameterTreeError as e:
             response = {'error': str(e)}
@@ -56,10 +134,11 @@ class LokiUpdateAdapter(ApiAdapter):
 
     @request_types('application/json')
     @response_types('application/json', default='application/json')
-    def put(self, path, request):
+    async def put(self, path, request):
         """Handle an HTTP PUT request.
 
-        This method handles an HTTP PUT request, returning a JSON response.
+        This method handles an HTTP PUT request, returning a JSON response. Setters may read
+        images or start operations, so they are run on an executor thread, one at a time.
 
         :param path: URI path of request
         :param request: HTTP request object
@@ -70,8 +149,9 @@ class LokiUpdateAdapter(ApiAdapter):
 
         try:
             data = json_decode(request.body)
-            self.controller.set(path, data)
-            response = self.controller.get(path)
+            async with self.set_lock:
+                await self.run_blocking(self.controller.set, path, data)
+                response = self.controller.get(path)
             status_code = 200
         except LokiUpdateError as e:
             response = {'error': str(e)}
@@ -85,10 +165,11 @@ class LokiUpdateAdapter(ApiAdapter):
         return ApiAdapterResponse(response, content_type=content_type,
                                   status_code=status_code)
         
-    def post(self, path, request):
+    async def post(self, path, request):
         """Handle an HTTP POST request.
 
-        This method handles an HTTP POST request, returning a JSON response.
+        This method handles an HTTP POST request, returning a JSON response. The uploaded
+        files are hashed and written on an executor thread.
 
         :return: ApiAdapterResponse object containing the appropriate response
         """
@@ -96,7 +177,7 @@ class LokiUpdateAdapter(ApiAdapter):
         content_type = "application/json"
         
         try:
-            self.controller.upload_file(request.files["file"])
+            await self.run_blocking(self.controller.upload_file, request.files["file"])
             
             response = {"ok": "Files uploaded"}
             status_code = 200
@@ -111,7 +192,7 @@ class LokiUpdateAdapter(ApiAdapter):
         
         return ApiAdapterResponse(response, content_type=content_type, status_code=status_code)
 
-    def delete(self, path, request):
+    async def delete(self, path, request):
         """Handle an HTTP DELETE request.
 
         This method handles an HTTP DELETE request, returning a JSON response.
@@ -127,10 +208,14 @@ class LokiUpdateAdapter(ApiAdapter):
 
         return ApiAdapterResponse(response, status_code=status_code)
     
-    def cleanup(self):
+    async def cleanup(self):
         """Clean up adapter state at shutdown.
 
         This method cleans up the adapter state when called by the server at e.g. shutdown.
         It simplied calls the cleanup function of the controller instance.
         """
+        if self.upload_server:
+            self.upload_server.stop()
+            self.events.stop()
+        
         self.controller.cleanup()
\ No newline at end of file
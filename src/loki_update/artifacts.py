@@ -0,0 +1,274 @@
+import os
+import json
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+
+from loki_update.copier import FileCopier
+
+# Index of the cached release assets, kept in the cache directory
+INDEX_NAME = "index.json"
+
+class ArtifactCache():
+    """
+    On-disk, content-addressed cache of release assets.
+
+    Each asset is stored once under its SHA-256, however many releases it appears in, and
+    indexed by owner/repo/tag/asset name. The least recently used releases are evicted once
+    the stored assets exceed the size cap. The cache can be pre-seeded from a local
+    directory, so that releases can be installed on boards without network access.
+    """
+
+    def __init__(self, cache_dir, max_size=256 * 1024 * 1024):
+        """Initialise the ArtifactCache object.
+
+        :param cache_dir: directory the assets and index are stored in
+        :param max_size: maximum total size in bytes of the stored assets
+        """
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # Incremented whenever assets are added or removed
+        self.version = 0
+        # SHA-256 of each chunk of the stored assets, calculated when first requested by a peer
+        self.chunk_hashes = {}
+        self.lock = threading.Lock()
+
+        # The cache is disabled, rather than failing the adapter, if its directory cannot be
+        # created, such as when /var/lib is read-only
+        try:
+            os.makedirs(os.path.join(self.cache_dir, "objects"), exist_ok=True)
+            self.enabled = True
+        except OSError as error:
+            logging.error(f"Unable to create artifact cache in {self.cache_dir}, caching is disabled: {error}")
+            self.enabled = False
+            return
+
+        self.load()
+
+    def release_key(self, owner, repo, tag, name):
+        return f"{owner}/{repo}/{tag}/{name}"
+
+    def object_path(self, sha256):
+        return os.path.join(self.cache_dir, "objects", sha256[:2], sha256)
+
+    def get(self, owner, repo, tag, name):
+        """Get a cached release asset.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param name: asset name
+        :return: tuple of the path of the stored asset and its SHA-256, or None on a miss
+        """
+        key = self.release_key(owner, repo, tag, name)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+
+        path = self.object_path(entry["sha256"])
+        if not os.path.exists(path) or os.path.getsize(path) != entry["size"]:
+            logging.error(f"Cached asset {key} is missing or damaged, removing it from the cache")
+            self.remove(key)
+            return None
+
+        return path, entry["sha256"]
+
+    def put(self, owner, repo, tag, name, src_path, sha256=None):
+        """Add a release asset to the cache.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param name: asset name
+        :param src_path: path of the asset to store
+        :param sha256: SHA-256 hex digest of the asset, calculated if not given
+        :return: SHA-256 hex digest of the asset
+        """
+        if sha256 is None:
+            sha256 = self.content_hash(src_path)
+
+        path = self.object_path(sha256)
+        size = os.path.getsize(src_path)
+
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # The asset is copied, not hardlinked, so rewriting the source later cannot
+            # truncate or change the cached object
+            temp_path = path + ".tmp"
+            FileCopier().copy_file(src_path, temp_path, fsync=True)
+            os.replace(temp_path, path)
+
+        with self.lock:
+            self.entries[self.release_key(owner, repo, tag, name)] = {"sha256": sha256, "size": size}
+            self.version += 1
+
+        self.evict()
+        self.save()
+
+        return sha256
+
+    def remove(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                return
+            self.version += 1
+            still_used = any(item["sha256"] == entry["sha256"] for item in self.entries.values())
+
+        if not still_used:
+            self.chunk_hashes = {key: hashes for key, hashes in self.chunk_hashes.items() if key[0] != entry["sha256"]}
+            if os.path.exists(self.object_path(entry["sha256"])):
+                os.remove(self.object_path(entry["sha256"]))
+
+        self.save()
+
+    def total_size(self):
+        with self.lock:
+            return sum({entry["sha256"]: entry["size"] for entry in self.entries.values()}.values())
+
+    def evict(self):
+        """Remove the least recently used assets until the cache is within its size cap."""
+        while self.total_size() > self.max_size and len(self.entries) > 1:
+            with self.lock:
+                key = next(iter(self.entries))
+
+            logging.debug(f"Evicting {key} from the artifact cache")
+            self.remove(key)
+
+    def get_tags(self, owner, repo, names):
+        """Get the release tags of a repository for which every named asset is cached.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param names: asset names a release must include
+        """
+        prefix = f"{owner}/{repo}/"
+        cached = {}
+
+        with self.lock:
+            for key in self.entries:
+                if key.startswith(prefix):
+                    tag, _, name = key[len(prefix):].rpartition("/")
+                    cached.setdefault(tag, set()).add(name)
+
+        return sorted(tag for tag, cached_names in cached.items() if cached_names.issuperset(names))
+
+    def get_release(self, owner, repo, tag):
+        """Get the cached assets of a release.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :return: dictionary of the size and SHA-256 of each cached asset, by name
+        """
+        prefix = f"{owner}/{repo}/{tag}/"
+
+        with self.lock:
+            return {key[len(prefix):]: dict(entry) for key, entry in self.entries.items() if key.startswith(prefix)}
+
+    def get_chunk_hashes(self, sha256, chunk_size):
+        """Get the SHA-256 of each chunk of a stored asset, so a peer can check chunks as it fetches them.
+
+        The stored asset is checked against its SHA-256 as the chunks are hashed, so a damaged
+        asset is never offered to peers.
+
+        :param sha256: SHA-256 of the asset
+        :param chunk_size: size of each chunk
+        :return: list of the SHA-256 hex digest of each chunk, or None if the stored asset is damaged
+        """
+        key = (sha256, chunk_size)
+        hashes = self.chunk_hashes.get(key)
+
+        if hashes is None:
+            hash = hashlib.new("sha256")
+            hashes = []
+            with open(self.object_path(sha256), "rb") as in_file:
+                for chunk in iter(lambda: in_file.read(chunk_size), b""):
+                    hash.update(chunk)
+                    hashes.append(hashlib.sha256(chunk).hexdigest())
+
+            if hash.hexdigest() != sha256:
+                logging.error(f"Cached asset {sha256} is damaged, not offering it to peers")
+                return None
+
+            self.chunk_hashes[key] = hashes
+
+        return hashes
+
+    def seed_from_directory(self, owner, repo, seed_dir):
+        """Add the releases held in a local directory to the cache.
+
+        The directory holds one subdirectory per release tag, containing the release assets.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param seed_dir: directory to seed the cache from
+        :return: number of assets added
+        """
+        added = 0
+
+        for tag in sorted(os.listdir(seed_dir)):
+            tag_dir = os.path.join(seed_dir, tag)
+            if not os.path.isdir(tag_dir):
+                continue
+
+            for name in sorted(os.listdir(tag_dir)):
+                src_path = os.path.join(tag_dir, name)
+                if not os.path.isfile(src_path):
+                    continue
+
+                cached = self.get(owner, repo, tag, name)
+                if cached and os.path.getsize(cached[0]) == os.path.getsize(src_path):
+                    continue
+
+                self.put(owner, repo, tag, name, src_path)
+                added += 1
+
+        logging.debug(f"Seeded {added} assets of {owner}/{repo} from {seed_dir}")
+        return added
+
+    def content_hash(self, path):
+        hash = hashlib.new("sha256")
+        with open(path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(1024 * 1024), b""):
+                hash.update(chunk)
+
+        return hash.hexdigest()
+
+    def load(self):
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+
+        if not os.path.exists(index_path):
+            return
+
+        try:
+            with open(index_path, "r") as index_file:
+                stored = json.load(index_file)
+
+            for item in stored:
+                self.entries[item["key"]] = {"sha256": item["sha256"], "size": item["size"]}
+
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.error(f"Unable to load artifact cache index from {index_path}: {error}")
+            self.entries.clear()
+
+    def save(self):
+        index_path = os.path.join(self.cache_dir, INDEX_NAME)
+
+        with self.lock:
+            stored = [{"key": key, **entry} for key, entry in self.entries.items()]
+
+        temp_path = index_path + ".tmp"
+
+        try:
+            with open(temp_path, "w") as index_file:
+                json.dump(stored, index_file)
+            os.replace(temp_path, index_path)
+
+        except OSError as error:
+            logging.error(f"Unable to save artifact cache index to {index_path}: {error}")
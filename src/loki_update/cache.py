@@ -0,0 +1,131 @@
+import os
+import json
+import logging
+import hashlib
+import threading
+from collections import OrderedDict
+
+class MetadataCache():
+    """
+    Persistent LRU cache of image metadata, keyed on the identity of the image file.
+
+    Entries are keyed on (path, st_dev, st_ino, st_size, st_mtime_ns), so a lookup for an
+    unchanged image costs a single stat call. The cache is saved to a small JSON file so it
+    survives adapter restarts.
+    """
+
+    def __init__(self, store_path=None, max_entries=32, verify=False):
+        """Initialise the MetadataCache object.
+
+        :param store_path: path of the on-disk store, or None to keep the cache in memory only
+        :param max_entries: maximum number of entries held before the least recently used is evicted
+        :param verify: if True, also check a SHA-256 of the image content on every lookup
+        """
+        self.store_path = store_path
+        self.max_entries = max_entries
+        self.verify = verify
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.load()
+
+    def file_key(self, path):
+        stat = os.stat(path)
+        return (path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+    def content_hash(self, path):
+        hash = hashlib.new("sha256")
+        with open(path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(1024 * 1024), b""):
+                hash.update(chunk)
+
+        return hash.hexdigest()
+
+    def get(self, path):
+        """Get the cached metadata for an image, if the image has not changed.
+
+        :param path: path of the image file
+        :return: the cached metadata, or None on a miss
+        """
+        key = self.file_key(path)
+
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries.move_to_end(key)
+
+        if self.verify and entry.get("hash") != self.content_hash(path):
+            self.invalidate(path)
+            return None
+
+        return dict(entry["metadata"])
+
+    def put(self, path, metadata):
+        """Store the metadata for an image, replacing any older entries for the same path.
+
+        :param path: path of the image file
+        :param metadata: dictionary of metadata read from the image
+        """
+        key = self.file_key(path)
+        entry = {"metadata": dict(metadata)}
+
+        if self.verify:
+            entry["hash"] = self.content_hash(path)
+
+        with self.lock:
+            for stale_key in [item for item in self.entries if item[0] == path]:
+                del self.entries[stale_key]
+
+            self.entries[key] = entry
+
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+        self.save()
+
+    def invalidate(self, path):
+        """Remove all entries for an image path.
+
+        :param path: path of the image file that has been, or is about to be, rewritten
+        """
+        with self.lock:
+            stale_keys = [item for item in self.entries if item[0] == path]
+            for stale_key in stale_keys:
+                del self.entries[stale_key]
+
+        if stale_keys:
+            self.save()
+
+    def load(self):
+        if not self.store_path or not os.path.exists(self.store_path):
+            return
+
+        try:
+            with open(self.store_path, "r") as store_file:
+                stored = json.load(store_file)
+
+            for item in stored[-self.max_entries:]:
+                self.entries[tuple(item["key"])] = item["entry"]
+
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.error(f"Unable to load metadata cache from {self.store_path}: {error}")
+            self.entries.clear()
+
+    def save(self):
+        if not self.store_path:
+            return
+
+        with self.lock:
+            stored = [{"key": list(key), "entry": entry} for key, entry in self.entries.items()]
+
+        temp_path = self.store_path + ".tmp"
+
+        try:
+            os.makedirs(os.path.dirname(self.store_path) or ".", exist_ok=True)
+            with open(temp_path, "w") as store_file:
+                json.dump(stored, store_file)
+            os.replace(temp_path, self.store_path)
+
+        except OSError as error:
+            logging.error(f"Unable to save metadata cache to {self.store_path}: {error}")
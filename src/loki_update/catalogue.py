@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import logging
+import threading
+
+import requests
+
+# Number of releases requested per page of the GitHub API
+RELEASES_PER_PAGE = 100
+
+class ReleaseCatalogue():
+    """
+    Catalogue of the release tags available from each repository, refreshed in the background.
+
+    The catalogue is loaded from a snapshot at startup, so no network access is needed to
+    start, and refreshed on a background thread. Each page of releases is requested with the
+    ETag of the previous response, so pages which have not changed return 304 Not Modified,
+    which does not count against the GitHub API rate limit.
+    """
+
+    def __init__(self, session, api_url, repos, required_assets, snapshot_path=None):
+        """Initialise the ReleaseCatalogue object and load the snapshot.
+
+        :param session: requests session the API requests are made with
+        :param api_url: base URL of the GitHub repository API
+        :param repos: list of dictionaries giving the owner and name of each repository
+        :param required_assets: asset names a release must include to be listed
+        :param snapshot_path: path of the persisted catalogue, or None to keep it in memory only
+        """
+        self.session = session
+        self.repos = repos
+        self.required_assets = set(required_assets)
+        self.snapshot_path = snapshot_path
+        self.api_url = api_url
+        self.pages = {}
+        self.last_updated = None
+        self.error_message = ""
+        # Incremented whenever the listed tags or refresh state change
+        self.version = 0
+        # Function called after each refresh, from the refreshing thread
+        self.on_change = None
+        self.lock = threading.Lock()
+        self.refresh_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+        self.load()
+
+    def release_tags(self, releases):
+        tags = []
+        for release in releases:
+            assets_available = {asset.get("name") for asset in release.get("assets") or []}
+            if self.required_assets.issubset(assets_available):
+                tags.append(release.get("tag_name"))
+
+        return tags
+
+    def fetch_page(self, url):
+        """Fetch one page of releases, conditionally on the ETag of the cached copy.
+
+        :param url: URL of the page
+        :return: the page, as a dictionary of its ETag, listed tags and the URL of the next page
+        """
+        with self.lock:
+            cached = self.pages.get(url)
+
+        headers = {"If-None-Match": cached["etag"]} if cached and cached.get("etag") else {}
+        response = self.session.get(url, headers=headers, timeout=30)
+
+        if response.status_code == 304 and cached:
+            return cached
+
+        if response.status_code != 200:
+            raise requests.HTTPError(f"Unable to fetch releases from {url} (HTTP {response.status_code})")
+
+        page = {
+            "etag": response.headers.get("ETag"),
+            "tags": self.release_tags(response.json()),
+            "next": response.links.get("next", {}).get("url")
+        }
+
+        with self.lock:
+            if self.pages.get(url) != page:
+                self.pages[url] = page
+                self.version += 1
+
+        return page
+
+    def refresh(self):
+        """Refresh the catalogue of every repository, following pagination.
+
+        A repository which cannot be reached keeps the tags it had before.
+
+        :return: True if every repository was refreshed
+        """
+        with self.refresh_lock:
+            errors = []
+
+            for repo in self.repos:
+                url = f"{self.api_url}/{repo.get('owner')}/{repo.get('name')}/releases?per_page={RELEASES_PER_PAGE}"
+                try:
+                    while url:
+                        url = self.fetch_page(url)["next"]
+
+                except (requests.RequestException, ValueError) as error:
+                    errors.append(f"{repo.get('name')}: {error}")
+                    logging.error(f"Unable to refresh releases of {repo.get('name')}: {error}")
+
+            self.error_message = "; ".join(errors)
+            if not errors:
+                self.last_updated = time.time()
+            self.version += 1
+
+            self.save()
+
+        if self.on_change:
+            self.on_change()
+
+        return not errors
+
+    def get_tags(self, owner, repo):
+        """Get the listed release tags of a repository from the catalogue.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        """
+        tags = []
+        url = f"{self.api_url}/{owner}/{repo}/releases?per_page={RELEASES_PER_PAGE}"
+
+        with self.lock:
+            while url in self.pages:
+                tags.extend(self.pages[url]["tags"])
+                url = self.pages[url]["next"]
+
+        return tags
+
+    def start(self, interval):
+        """Start refreshing the catalogue in the background.
+
+        :param interval: time in seconds between refreshes
+        """
+        self.thread = threading.Thread(target=self.run, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def run(self, interval):
+        while not self.stopped.is_set():
+            self.refresh()
+            self.wake.wait(interval)
+            self.wake.clear()
+
+    def request_refresh(self):
+        """Wake the background thread to refresh the catalogue now."""
+        self.wake.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wake.set()
+
+    def load(self):
+        if not self.snapshot_path or not os.path.exists(self.snapshot_path):
+            return
+
+        try:
+            with open(self.snapshot_path, "r") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+
+            self.pages = snapshot["pages"]
+            self.last_updated = snapshot["last_updated"]
+
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            logging.error(f"Unable to load release catalogue from {self.snapshot_path}: {error}")
+            self.pages = {}
+
+    def save(self):
+        if not self.snapshot_path:
+            return
+
+        with self.lock:
+            snapshot = {"pages": dict(self.pages), "last_updated": self.last_updated}
+
+        temp_path = self.snapshot_path + ".tmp"
+
+        try:
+            os.makedirs(os.path.dirname(self.snapshot_path) or ".", exist_ok=True)
+            with open(temp_path, "w") as snapshot_file:
+                json.dump(snapshot, snapshot_file)
+            os.replace(temp_path, self.snapshot_path)
+
+        except OSError as error:
+            logging.error(f"Unable to save release catalogue to {self.snapshot_path}: {error}")
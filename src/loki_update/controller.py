@@ -2,22 +2,38 @@ import time
 import subprocess
 import os
 import logging
-import pathlib
-from concurrent import futures
-import tempfile
 import shutil
 import hashlib
+import threading
 import requests
-import json
-
-from pyfdt.pyfdt import *
-
-from tornado.concurrent import run_on_executor
 
 from odin.adapters.parameter_tree import ParameterTree, ParameterTreeError
 
+from loki_update.fdt import FdtError, LIVE_DEVICETREE_PATH, LiveDeviceTree, read_image_metadata, read_device_metadata, read_runtime_metadata
+from loki_update.cache import MetadataCache
+from loki_update.copier import FileCopier
+from loki_update.deploy import DeploymentTransaction, recover_deployment
+from loki_update.jobs import JobScheduler
+from loki_update.delta import DeltaError, block_signatures, apply_delta
+from loki_update.mtd import MtdError, MtdRegistry, MtdWriter, PROC_MTD_PATH, SYS_CLASS_MTD_PATH
+from loki_update.download import DownloadError, AssetDownloader, PeerDownloader, make_session
+from loki_update.artifacts import ArtifactCache
+from loki_update.catalogue import ReleaseCatalogue
+from loki_update.sync import SyncMonitor, SYS_BLOCK_PATH, MEMINFO_PATH
+from loki_update.metrics import Metrics
+from loki_update.snapshots import TreeSnapshots
+
 GITHUB_REPO_API_URL = "https://api.github.com/repos"
 
+# Release assets which make up an image
+RELEASE_ASSETS = ["image.ub", "BOOT.BIN", "boot.scr"]
+
+# Devices whose installed image details are reported in the parameter tree
+IMAGE_DEVICES = ["emmc", "sd", "backup", "flash", "runtime"]
+
+# Devices written by deploy and flash jobs, which must be idle before it is safe to reboot
+DEPLOY_DEVICES = ["emmc", "sd", "backup", "flash"]
+
 class LokiUpdateError(Exception):
     """
     Simple exception class to wrap lower-level exceptions
@@ -27,10 +43,12 @@ class LokiUpdateError(Exception):
 
 class LokiUpdateController():
     
-    # Thread executor for background tasks
-    executor = futures.ThreadPoolExecutor(max_workers=1)
-    
-    def __init__(self, emmc_base_path, sd_base_path, backup_base_path, allow_reboot, allow_only_emmc_upload, allow_images_from_repo, available_repos):
+    def __init__(self, emmc_base_path, sd_base_path, backup_base_path, allow_reboot, allow_only_emmc_upload, allow_images_from_repo, available_repos,
+                 metadata_cache_path=None, metadata_cache_size=32, metadata_cache_verify=False, max_workers=4,
+                 checksum_cache_path=None, artifact_cache_dir=None, artifact_cache_size=256 * 1024 * 1024,
+                 catalogue_snapshot_path=None, catalogue_refresh_interval=3600, probe_on_startup=True,
+                 sync_sample_interval=0.5, system_root="", github_api_url=GITHUB_REPO_API_URL, artifact_seed=False,
+                 artifact_peers=None):
         # Save arguments
         self.emmc_base_path = emmc_base_path
         self.sd_base_path = sd_base_path
@@ -40,19 +58,57 @@ class LokiUpdateController():
         self.allow_images_from_repo = allow_images_from_repo
         self.available_repos = available_repos
         
-        # Set up paths for temporary files
-        self.emmc_dtb_path = "/tmp/emmc.dtb"
-        self.sd_dtb_path = "/tmp/sd.dtb"
-        self.backup_dtb_path = "/tmp/backup.dtb"
+        # Root directory that /sys, /proc and /dev are found under, set to run on a simulated board
+        self.system_root = system_root.rstrip("/")
+        self.github_api_url = github_api_url
         
         # Set up paths for u-boot images
         self.emmc_u_boot_path = self.emmc_base_path + "image.ub"
         self.sd_u_boot_path = self.sd_base_path + "image.ub"
         self.backup_u_boot_path = self.backup_base_path + "image.ub"
         
+        # Cache of image metadata, so refreshes of unchanged images don't re-parse them
+        self.metadata_cache = MetadataCache(metadata_cache_path, metadata_cache_size, metadata_cache_verify)
+        
+        # Cache of file SHA-256s, so unchanged files can be skipped without re-hashing them
+        self.checksum_cache = MetadataCache(checksum_cache_path, metadata_cache_size)
+        
+        # Cache of downloaded release assets, so a release is only downloaded once
+        artifact_cache = ArtifactCache(artifact_cache_dir, artifact_cache_size) if artifact_cache_dir else None
+        self.artifact_cache = artifact_cache if artifact_cache and artifact_cache.enabled else None
+        
+        # Boards the release assets are fetched from before going upstream, and whether this
+        # board serves its own cached assets to them
+        self.artifact_seed = artifact_seed
+        self.artifact_peers = artifact_peers or []
+        
         # Store initialisation time
         self.init_time = time.time()
         
+        # Timings, counters and bytes moved by each operation
+        self.metrics = Metrics()
+        
+        # Scheduler for background tasks, serialising tasks which use the same device
+        self.scheduler = JobScheduler(max_workers, metrics=self.metrics)
+        
+        # Sampler of the MMC write state, so sync checks never wait on sysfs
+        self.sync_monitor = SyncMonitor(interval=sync_sample_interval,
+                                        sys_block_path=self.system_root + SYS_BLOCK_PATH,
+                                        meminfo_path=self.system_root + MEMINFO_PATH)
+        self.sync_monitor.start()
+        self.sync_now = False
+        
+        # Table of MTD partitions, read on first use and re-read only when the devices change
+        self.mtd_registry = MtdRegistry(self.system_root + PROC_MTD_PATH,
+                                        self.system_root + SYS_CLASS_MTD_PATH,
+                                        self.system_root + "/dev/")
+        self.rescan_mtd = False
+        
+        # Complete or undo any deployment interrupted by a crash or power cut
+        for base_path in [self.emmc_base_path, self.sd_base_path, self.backup_base_path]:
+            if os.path.isdir(base_path):
+                recover_deployment(base_path)
+        
         self.refresh_all_image_info = False
         self.refresh_emmc_image_info = False
         self.refresh_sd_image_info = False
@@ -69,15 +125,24 @@ class LokiUpdateController():
         self.flash_time_created = 0
         self.flash_error_occurred = False
         self.flash_error_message = ""
+        self.flash_bytes_read = 0
         self.copying_to_flash = False
         self.flash_copy_stage = ""
         self.flash_copy_file_num = 0
         
-        self.get_flash_image_metadata_from_dtb()
-        self.emmc_installed_image = self.get_installed_image("emmc")
-        self.sd_installed_image = self.get_installed_image("sd")
-        self.backup_installed_image = self.get_installed_image("backup")
-        self.runtime_installed_image = self.get_installed_image("runtime")
+        # Devicetree of the running image, read once as it cannot change until the next boot
+        self.live_devicetree = LiveDeviceTree(self.system_root + LIVE_DEVICETREE_PATH)
+        self.runtime_metadata_node = {}
+        
+        # Installed images are probed in the background, or on first access, so that startup
+        # does not wait on reading every device
+        self.emmc_installed_image = self.get_loading_image_info()
+        self.sd_installed_image = self.get_loading_image_info()
+        self.backup_installed_image = self.get_loading_image_info()
+        self.runtime_installed_image = self.get_loading_image_info()
+        self.device_probed = {device: False for device in IMAGE_DEVICES}
+        self.device_loading = {device: True for device in IMAGE_DEVICES}
+        self.probe_lock = threading.Lock()
         
         self.emmc_backup = False
         self.restore_emmc = False
@@ -85,10 +150,12 @@ class LokiUpdateController():
         self.copying = False
         self.file_name_copying = ""
         self.copy_progress = 0
+        self.copy_throughput = 0
         self.copy_error = False
         self.copy_error_message = ""
         self.copy_target = ""
         self.checksums = []
+        self.uploaded_files = set()
         self.copy_success = False
         self.backup_success = False
         self.restore_success = False
@@ -96,23 +163,41 @@ class LokiUpdateController():
         self.reboot = False
         self.is_rebooting = False
         
-        # Only get repo info once at startup, as GitHub API is rate limited
-        self.repo_info = self.get_repo_info()
+        # Session shared by every GitHub request, so connections are reused
+        self.http_session = make_session()
+        
+        # Release tags are loaded from the last snapshot and refreshed in the background, using
+        # conditional requests which do not count against the GitHub API rate limit
+        self.catalogue = ReleaseCatalogue(self.http_session, self.github_api_url, self.available_repos, RELEASE_ASSETS, catalogue_snapshot_path)
+        if self.available_repos:
+            self.catalogue.start(catalogue_refresh_interval)
+        self.refresh_catalogue = False
+        self.seed_artifact_cache()
         self.downloading = False
+        self.download_progress = 0
+        self.download_bytes = 0
+        self.download_total = 0
+        self.download_rate = 0
+        self.download_eta = None
+        self.download_error = False
+        self.download_error_message = ""
         
         self.installed_images_tree = ParameterTree({
             "emmc": {
                 "info": (lambda: self.emmc_installed_image, None),
+                "loading": (lambda: self.device_loading["emmc"], None),
                 "refresh": (self.get_refresh_emmc_image_info, self.set_refresh_emmc_image_info),
                 "backup": (self.get_emmc_backup, self.set_emmc_backup),
                 "restore": (self.get_restore_emmc, self.set_restore_emmc)
                 },
             "sd": {
                 "info": (lambda: self.sd_installed_image, None),
+                "loading": (lambda: self.device_loading["sd"], None),
                 "refresh": (self.get_refresh_sd_image_info, self.set_refresh_sd_image_info)
                 },
             "backup": {
                 "info": (lambda: self.backup_installed_image, None),
+                "loading": (lambda: self.device_loading["backup"], None),
                 "refresh": (self.get_refresh_backup_image_info, self.set_refresh_backup_image_info)
                 },
             "flash": {
@@ -124,6 +209,7 @@ class LokiUpdateController():
                     "time": (lambda: self.flash_time_created, None),
                     "error_occurred": (lambda: self.flash_error_occurred, None),
                     "error_message": (lambda: self.flash_error_message, None),
+                    "bytes_read": (lambda: self.flash_bytes_read, None),
                     "last_refresh": time.time()
                 },
                 "refresh": (self.get_refresh_flash_image_info, self.set_refresh_flash_image_info),
@@ -131,18 +217,22 @@ class LokiUpdateController():
             },
             "runtime": {
                 "info": (lambda: self.runtime_installed_image, None),
+                "metadata": (lambda: self.runtime_metadata_node, None),
+                "loading": (lambda: self.device_loading["runtime"], None),
                 "refresh": (self.get_refresh_runtime_image_info, self.set_refresh_runtime_image_info)
                 },
+            "ready": (self.get_devices_ready, None),
             "refresh_all_image_info": (self.get_refresh_all_image_info, self.set_refresh_all_image_info)
         })
         
-        self.param_tree = ParameterTree({
+        tree = {
             "server_uptime": (self.get_server_uptime, None),
             "installed_images": self.installed_images_tree,
             "copy_progress": {
                 "copying": (lambda: self.copying, None),
                 "file_name": (lambda: self.file_name_copying, None),
                 "progress": (lambda: self.copy_progress, None),
+                "throughput": (lambda: self.copy_throughput, None),
                 "copy_error": (lambda: self.copy_error, None),
                 "copy_error_message": (lambda: self.copy_error_message, None),
                 "flash_copy_stage": (lambda: self.flash_copy_stage, None),
@@ -153,7 +243,18 @@ class LokiUpdateController():
                 "success": (lambda: self.copy_success, None),
                 "backup_success": (lambda: self.backup_success, None),
                 "restore_success": (lambda: self.restore_success, None),
+                "durable": (self.get_durable, None),
                 "mmc_synced": (self.get_mmc_synced, None),
+                "sync": {
+                    "status": (self.sync_monitor.get_status, None),
+                    "sync_now": (lambda: self.sync_now, self.set_sync_now)
+                },
+            },
+            "jobs": (lambda: self.scheduler.get_jobs(), None),
+            "metrics": (self.metrics.to_dict, None),
+            "mtd": {
+                "partitions": (lambda: self.mtd_registry.get_partitions(), None),
+                "rescan": (lambda: self.rescan_mtd, self.set_rescan_mtd)
             },
             "reboot_board": {
                 "reboot": (None, self.set_reboot),
@@ -165,34 +266,79 @@ class LokiUpdateController():
                 "allow_images_from_repo": (lambda: self.allow_images_from_repo, None)
             },
             "github_repos": {
-                "repo_info": (lambda: self.repo_info, None),
+                "repo_info": (self.get_repo_info, None),
+                "last_updated": (lambda: self.catalogue.last_updated, None),
+                "refresh": (lambda: self.refresh_catalogue, self.set_refresh_catalogue),
+                "refresh_error": (lambda: self.catalogue.error_message, None),
                 "release_to_retrieve": (None, self.set_release_to_retrieve),
                 "downloading": (lambda: self.downloading, None),
+                "download_progress": {
+                    "progress": (lambda: self.download_progress, None),
+                    "bytes_downloaded": (lambda: self.download_bytes, None),
+                    "total_bytes": (lambda: self.download_total, None),
+                    "bytes_per_second": (lambda: self.download_rate, None),
+                    "eta": (lambda: self.download_eta, None),
+                    "error": (lambda: self.download_error, None),
+                    "error_message": (lambda: self.download_error_message, None)
+                }
             }
+        }
+        self.param_tree = ParameterTree(tree)
+        
+        # Serialised JSON of the unchanged subtrees is reused, so repeated polls do not
+        # evaluate every getter. Sets through the tree bump the subtree they change, and
+        # background work bumps the subtree it updates when it changes any of its values.
+        # The release tags also change with the catalogue and cache.
+        self.snapshots = TreeSnapshots(self.param_tree, list(tree), {
+            "installed_images": None,
+            "reboot_board": None,
+            "restrictions": None,
+            "github_repos": lambda: (self.catalogue.version, self.artifact_cache.version if self.artifact_cache else 0)
         })
-
+        
+        # Background work bumps the subtrees it changes too, so the event stream can push them
+        self.scheduler.on_change = self.job_changed
+        self.catalogue.on_change = lambda: self.snapshots.bump("github_repos")
+        self.sync_monitor.on_change = lambda: self.snapshots.bump("copy_progress")
+        
+        if probe_on_startup:
+            for device in IMAGE_DEVICES:
+                self.probe_device(device)
+    
     def get_mmc_synced(self):
         """Check if the MMC filesystems have synced, and it is safe to reboot.
 
-        This method returns True if filessystems for eMMC and SD are synchronised.
+        This method returns True if filessystems for eMMC and SD are synchronised, from the
+        state last sampled by the sync monitor, which samples again whenever a write finishes.
         """
-        for mmc_blockdev in [
-            'mmcblk0',
-            'mmcblk1',
-        ]:
-            try:
-                inflight = [int(x) for x in  subprocess.run(["cat",f"/sys/block/{mmc_blockdev}/inflight"], capture_output=True, text=True, check=True).stdout.split(' ') if x != '']
-                inflight_read = inflight[0]
-                inflight_write = inflight[1]
-                if inflight_write:
-                    logging.debug('Block device {} is still syncing: {}'.format(mmc_blockdev, inflight_write))
-                    return False
-            except subprocess.CalledProcessError as e:
-                logging.error('Error reading mmc sync state for {}: {}'.format(mmc_blockdev, e))
-                # This means the device does not exist, hence we are not worried about sync
-                continue
+        return self.sync_monitor.is_synced()
+    
+    def set_sync_now(self, sync):
+        self.sync_now = bool(sync)
+        
+        if self.sync_now:
+            self.scheduler.submit("sync", ["sync"], self.sync_filesystems)
+    
+    def sync_filesystems(self, job):
+        """Flush the eMMC and SD filesystems to disk, so that it is safe to reboot."""
+        try:
+            self.sync_monitor.sync_now([self.emmc_base_path, self.sd_base_path])
+        finally:
+            self.sync_now = False
+        
+        return self.sync_monitor.get_status()
+
+    def job_changed(self, job):
+        """Bump the subtrees reporting a job, called by the scheduler when it is submitted, starts or finishes.
 
-        return True
+        The sync state is sampled again as soon as a job writing to a device finishes, so that
+        mmc_synced does not report the state from before the write until the next sample.
+        """
+        if job.finished and job.writes:
+            self.sync_monitor.sample()
+
+        self.snapshots.bump("jobs")
+        self.snapshots.bump("copy_progress")
 
     def get_server_uptime(self):
         """Get the uptime for the ODIN server.
@@ -208,7 +354,19 @@ class LokiUpdateController():
 
         :param path: path to retrieve from tree
         """
+        self.probe_devices_in_path(path)
         return self.param_tree.get(path)
+    
+    def get_json(self, path):
+        """Get the parameter tree as JSON.
+
+        Subtrees which have not changed since they were last requested are served from their
+        serialised snapshot, so polling an unchanged tree does not evaluate the getters.
+
+        :param path: path to retrieve from tree
+        """
+        self.probe_devices_in_path(path)
+        return self.snapshots.serialise(path)
 
     def set(self, path, data):
         """Set parameters in the parameter tree.
@@ -223,15 +381,77 @@ class LokiUpdateController():
             self.param_tree.set(path, data)
         except ParameterTreeError as e:
             raise LokiUpdateError(e)
+        finally:
+            self.snapshots.bump_path(path)
     
     def cleanup(self):
         """Clean up the LokiUpdateController instance.
         
-        This method removes all temporary files used in this controller.
+        This method stops the background task scheduler, catalogue refresh and sync sampler.
+        Image metadata is parsed in-process, so there are no temporary files to remove.
+        """
+        self.catalogue.stop()
+        self.sync_monitor.stop()
+        self.scheduler.shutdown()
+    
+    def probe_devices_in_path(self, path):
+        """Start probing any device under a parameter tree path which has not been probed yet.
+
+        :param path: path being retrieved from the tree
+        """
+        parts = path.strip("/").split("/")
+        
+        if parts[0] not in ("", "installed_images"):
+            return
+        
+        if len(parts) > 1 and parts[1] in IMAGE_DEVICES:
+            devices = [parts[1]]
+        else:
+            devices = IMAGE_DEVICES
+        
+        for device in devices:
+            if not self.device_probed[device]:
+                self.probe_device(device)
+    
+    def probe_device(self, device):
+        """Read the installed image details of a device in the background, unless already requested.
+
+        :param device: device to probe
         """
-        os.remove(self.emmc_dtb_path)
-        os.remove(self.sd_dtb_path)
-        os.remove(self.backup_dtb_path)
+        with self.probe_lock:
+            if self.device_probed[device]:
+                return
+            self.device_probed[device] = True
+            self.snapshots.bump("installed_images")
+        
+        if device == "flash":
+            self.refresh_flash_image_metadata()
+        else:
+            self.scheduler.submit(f"probe_{device}", [device], lambda job: self.load_installed_image(device), writes=[])
+    
+    def load_installed_image(self, device):
+        self.device_probed[device] = True
+        self.device_loading[device] = True
+        self.snapshots.bump("installed_images")
+        setattr(self, f"{device}_installed_image", self.get_installed_image(device))
+        self.device_loading[device] = False
+        self.snapshots.bump("installed_images")
+    
+    def get_devices_ready(self):
+        loading = dict(self.device_loading, flash=self.flash_loading)
+        return {device: self.device_probed[device] and not loading[device] for device in IMAGE_DEVICES}
+    
+    def get_loading_image_info(self):
+        return {
+            "app_name": "",
+            "app_version": "",
+            "loki_version": "",
+            "platform": "",
+            "time": "",
+            "error_occurred": False,
+            "error_message": "",
+            "last_refresh": None
+        }
     
     def get_installed_image(self, device):
         if device == "runtime":
@@ -257,12 +477,13 @@ class LokiUpdateController():
         self.refresh_all_image_info = bool(refresh)
         
         if self.refresh_all_image_info:
-            self.get_flash_image_metadata_from_dtb()
-            self.emmc_installed_image = self.get_installed_image("emmc")
-            self.sd_installed_image = self.get_installed_image("sd")
-            self.backup_installed_image = self.get_installed_image("backup")
-            self.runtime_installed_image = self.get_installed_image("runtime")
+            self.refresh_flash_image_metadata()
+            self.load_installed_image("emmc")
+            self.load_installed_image("sd")
+            self.load_installed_image("backup")
+            self.load_installed_image("runtime")
             self.refresh_image_all_info = False
+            self.snapshots.bump("installed_images")
             
     def get_refresh_emmc_image_info(self):
         return self.refresh_emmc_image_info
@@ -271,8 +492,9 @@ class LokiUpdateController():
         self.refresh_emmc_image_info = bool(refresh)
         
         if self.refresh_emmc_image_info:
-            self.emmc_installed_image = self.get_installed_image("emmc")
+            self.load_installed_image("emmc")
             self.refresh_emmc_image_info = False
+            self.snapshots.bump("installed_images")
     
     def get_refresh_sd_image_info(self):
         return self.refresh_sd_image_info
@@ -281,8 +503,9 @@ class LokiUpdateController():
         self.refresh_sd_image_info = bool(refresh)
         
         if self.refresh_sd_image_info:
-            self.sd_installed_image = self.get_installed_image("sd")
+            self.load_installed_image("sd")
             self.refresh_sd_image_info = False
+            self.snapshots.bump("installed_images")
             
     def get_refresh_backup_image_info(self):
         return self.refresh_backup_image_info
@@ -291,8 +514,9 @@ class LokiUpdateController():
         self.refresh_backup_image_info = bool(refresh)
         
         if self.refresh_backup_image_info:
-            self.backup_installed_image = self.get_installed_image("backup")
+            self.load_installed_image("backup")
             self.refresh_backup_image_info = False
+            self.snapshots.bump("installed_images")
             
     def get_refresh_flash_image_info(self):
         return self.refresh_flash_image_info
@@ -301,8 +525,9 @@ class LokiUpdateController():
         self.refresh_flash_image_info = bool(refresh)
         
         if self.refresh_flash_image_info:
-            self.get_flash_image_metadata_from_dtb()
+            self.refresh_flash_image_metadata()
             self.refresh_flash_image_info = False
+            self.snapshots.bump("installed_images")
             
     def get_refresh_runtime_image_info(self):
         return self.refresh_runtime_image_info
@@ -311,8 +536,9 @@ class LokiUpdateController():
         self.refresh_runtime_image_info = bool(refresh)
         
         if self.refresh_runtime_image_info:
-            self.runtime_installed_image = self.get_installed_image("runtime")
+            self.load_installed_image("runtime")
             self.refresh_runtime_image_info = False
+            self.snapshots.bump("installed_images")
     
     def check_empty_info(self, info):
         if info == "":
@@ -329,51 +555,38 @@ class LokiUpdateController():
         error_occurred = False
         error_message = ""
         u_boot_path = ""
-        dtb_path = ""
         
         if device == "emmc":
             u_boot_path = self.emmc_u_boot_path
-            dtb_path = self.emmc_dtb_path
         elif device == "sd":
             u_boot_path = self.sd_u_boot_path
-            dtb_path = self.sd_dtb_path
         elif device == "backup":
             u_boot_path = self.backup_u_boot_path
-            dtb_path = self.backup_dtb_path
         
         try:
-            # Check if metadata is at the top level
-            metadata_output = subprocess.run(["fdtget", "-t", "s", u_boot_path, "/loki-metadata", "loki-version"], capture_output=True)
-
-            if metadata_output.returncode == 0:
-                name = subprocess.run(["fdtget", "-t", "s", u_boot_path, "/loki-metadata", "application-name"], capture_output=True, text=True, check=True).stdout.strip()
-                app_version = subprocess.run(["fdtget", "-t", "s", u_boot_path, "/loki-metadata", "application-version"], capture_output=True, text=True, check=True).stdout.strip()
-                loki_version = subprocess.run(["fdtget", "-t", "s", u_boot_path, "/loki-metadata", "loki-version"], capture_output=True, text=True, check=True).stdout.strip()
-                platform = subprocess.run(["fdtget", "-t", "s", u_boot_path, "/loki-metadata", "platform"], capture_output=True, text=True, check=True).stdout.strip()
-            else:
-                subprocess.run(["dumpimage", "-T", "flat_dt", "-p", "1", u_boot_path, "-o", dtb_path], capture_output=True, text=True, check=True)
+            metadata = self.metadata_cache.get(u_boot_path)
             
-                with open(dtb_path, "rb") as fdt_file:
-                    fdt = FdtBlobParse(fdt_file)
-                
-                json_fdt = json.loads(fdt.to_fdt().to_json())
-  
-                name = json_fdt["loki-metadata"]["application-name"][1]
-                app_version = json_fdt["loki-metadata"]["application-version"][1]
-                loki_version = json_fdt["loki-metadata"]["loki-version"][1]
-                platform = json_fdt["loki-metadata"]["platform"][1]
-
-            timestamp_output = subprocess.run(["fdtget", "-t", "i", u_boot_path, "/", "timestamp"], capture_output=True, text=True)
-            timestamp = timestamp_output.stdout.strip()
+            if metadata is None:
+                # Metadata is read from the top level, or from the embedded DTB, in a single pass
+                start_time = time.perf_counter()
+                metadata = read_image_metadata(u_boot_path)
+                self.metrics.observe("read_image_metadata", time.perf_counter() - start_time)
+                self.metadata_cache.put(u_boot_path, metadata)
+            
+            name = metadata["application-name"]
+            app_version = metadata["application-version"]
+            loki_version = metadata["loki-version"]
+            platform = metadata["platform"]
+            timestamp = metadata["timestamp"]
         
-        except subprocess.CalledProcessError as error:
+        except FdtError as error:
             error_occurred = True
-            error_message = str(error.stderr)
-            logging.error(f"{str(error.cmd)}: {self.flash_error_message}")
+            error_message = f"Unable to read image metadata: {error}"
+            logging.error(error_message)
         
-        except FileNotFoundError as error:
+        except FileNotFoundError:
             error_occurred = True
-            error_message = "Unable to create flattened device tree, .dtb file was not found"
+            error_message = "Unable to read image metadata, image.ub file was not found"
             logging.error(error_message)
         
         except Exception as error:
@@ -384,59 +597,49 @@ class LokiUpdateController():
         finally:
             return name, app_version, loki_version, platform, timestamp, error_occurred, error_message
     
-    @run_on_executor
+    def refresh_flash_image_metadata(self):
+        self.device_probed["flash"] = True
+        self.flash_loading = True
+        self.snapshots.bump("installed_images")
+        self.scheduler.submit("refresh_flash", ["flash"], lambda job: self.get_flash_image_metadata_from_dtb(), writes=[])
+    
     def get_flash_image_metadata_from_dtb(self):
         self.flash_loading = True
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                kernel_mtddev = self.mtd_label_to_device("kernel")
-
-                # Check for metadata at the top level first
-                metadata_output = subprocess.run(["fdtget", "-t", "s", kernel_mtddev, "/loki-metadata", "loki-version"], capture_output=True)
-                if metadata_output.returncode == 0:
-                    self.flash_app_name = subprocess.run(["fdtget", "-t", "s", kernel_mtddev, "/loki-metadata", "application-name"], capture_output=True, text=True, check=True).stdout.strip()
-                    self.flash_app_version = subprocess.run(["fdtget", "-t", "s", kernel_mtddev, "/loki-metadata", "application-version"], capture_output=True, text=True, check=True).stdout.strip()
-                    self.flash_loki_version = subprocess.run(["fdtget", "-t", "s", kernel_mtddev, "/loki-metadata", "loki-version"], capture_output=True, text=True, check=True).stdout.strip()
-                    self.flash_platform = subprocess.run(["fdtget", "-t", "s", kernel_mtddev, "/loki-metadata", "platform"], capture_output=True, text=True, check=True).stdout.strip()
-                    timestamp_output = subprocess.run(["fdtget", "-t", "i", kernel_mtddev, "/", "timestamp"], capture_output=True, text=True, check=True)
-                    self.flash_time_created = timestamp_output.stdout.strip()
-                else:                    
-                    u_boot_path = temp_dir + "/image.ub"
-                    dtb_path = temp_dir + "/system.dtb"
-                
-                    os.system(f"cat {kernel_mtddev} > {u_boot_path}")
-
-                    subprocess.run(["dumpimage", "-T", "flat_dt", "-p", "1", u_boot_path, "-o", dtb_path], capture_output=True, text=True, check=True)
-                
-                    with open(dtb_path, "rb") as fdt_file:
-                        fdt = FdtBlobParse(fdt_file)
-                    
-                    json_fdt = json.loads(fdt.to_fdt().to_json())
-    
-                    self.flash_app_name = json_fdt["loki-metadata"]["application-name"][1]
-                    self.flash_app_version = json_fdt["loki-metadata"]["application-version"][1]
-                    self.flash_loki_version = json_fdt["loki-metadata"]["loki-version"][1]
-                    self.flash_platform = json_fdt["loki-metadata"]["platform"][1]
-                    timestamp_output = subprocess.run(["fdtget", "-t", "i", u_boot_path, "/", "timestamp"], capture_output=True, text=True, check=True)
-                    self.flash_time_created = timestamp_output.stdout.strip()
-            
-            except subprocess.CalledProcessError as error:
-                self.flash_error_occurred = True
-                self.flash_error_message = str(error.stderr)
-                logging.error(f"{str(error.cmd)}: {self.flash_error_message}")
+        self.snapshots.bump("installed_images")
+        try:
+            kernel_mtddev = self.mtd_label_to_device("kernel")
             
-            except FileNotFoundError as error:
-                self.flash_error_occurred = True
-                self.flash_error_message = "Unable to create flattened device tree, .dtb file was not found"
-                logging.error(self.flash_error_message)
+            # MTD character devices cannot be memory-mapped, so read only the metadata blocks
+            start_time = time.perf_counter()
+            metadata, self.flash_bytes_read = read_device_metadata(kernel_mtddev)
+            self.metrics.observe("read_flash_metadata", time.perf_counter() - start_time)
+            self.metrics.record_transfer("flash", self.flash_bytes_read, time.perf_counter() - start_time)
+            logging.debug(f"Read {self.flash_bytes_read} bytes from {kernel_mtddev} for flash metadata")
             
-            except Exception as error:
-                self.flash_error_occurred = True
-                self.flash_error_message = str(error)
-                logging.error(str(error))
-            
-            finally:
-                self.flash_loading = False
+            self.flash_app_name = metadata["application-name"]
+            self.flash_app_version = metadata["application-version"]
+            self.flash_loki_version = metadata["loki-version"]
+            self.flash_platform = metadata["platform"]
+            self.flash_time_created = metadata["timestamp"]
+        
+        except FdtError as error:
+            self.flash_error_occurred = True
+            self.flash_error_message = f"Unable to read image metadata: {error}"
+            logging.error(self.flash_error_message)
+        
+        except FileNotFoundError:
+            self.flash_error_occurred = True
+            self.flash_error_message = "Unable to read image metadata, kernel partition was not found"
+            logging.error(self.flash_error_message)
+        
+        except Exception as error:
+            self.flash_error_occurred = True
+            self.flash_error_message = str(error)
+            logging.error(str(error))
+        
+        finally:
+            self.flash_loading = False
+            self.snapshots.bump("installed_images")
     
     def get_runtime_image_metadata(self):
         name = ""
@@ -448,23 +651,16 @@ class LokiUpdateController():
         error_message = ""
             
         try:
-            with open("/sys/firmware/devicetree/base/loki-metadata/application-name", "r") as file:
-                name = file.read()
-                file.close()
-                
-            with open("/sys/firmware/devicetree/base/loki-metadata/application-version", "r") as file:
-                app_version = file.read()
-                file.close()
+            # The live devicetree is read once per boot, every later call is served from memory
+            metadata, self.runtime_metadata_node = read_runtime_metadata(self.live_devicetree)
             
-            with open("/sys/firmware/devicetree/base/loki-metadata/loki-version", "r") as file:
-                loki_version = file.read()
-                file.close()
-            
-            with open("/sys/firmware/devicetree/base/loki-metadata/platform", "r") as file:
-                platform = file.read()
-                file.close()
+            name = metadata["application-name"]
+            app_version = metadata["application-version"]
+            loki_version = metadata["loki-version"]
+            platform = metadata["platform"]
+            timestamp = metadata["timestamp"]
         
-        except FileNotFoundError as error:
+        except FileNotFoundError:
             error_occurred = True
             error_message = "Runtime image details file could not be found"
             logging.error(error_message)
@@ -477,150 +673,364 @@ class LokiUpdateController():
         finally:
             return name, app_version, loki_version, platform, timestamp, error_occurred, error_message
 
-    def check_for_error(self, process):
-        if process.returncode != 0:
-            raise Exception(process.stderr.strip())
-    
     def mtd_label_to_device(self, label):
-        try:
-            device_list_output = subprocess.run(["lsmtd", "-r"], capture_output=True, text=True, check=True)
-            
-        except subprocess.CalledProcessError as error:
-            logging.error(f"An error occurred while running: {error.cmd}")
-            
-        device_list = device_list_output.stdout.splitlines()
+        return self.mtd_registry.label_to_device(label)
+    
+    def set_rescan_mtd(self, rescan):
+        self.rescan_mtd = bool(rescan)
         
-        for line in device_list:
-            if label in line:
-                label = line.split()[0]
-                break
+        if self.rescan_mtd:
+            self.mtd_registry.scan()
+            self.rescan_mtd = False
+    
+    def get_staging_dir(self, target):
+        """Get the staging directory for files being uploaded to a target, creating it if needed.
+
+        :param target: copy target the files are destined for
+        """
+        temp_dir = f"{self.system_root}/tmp/{target}/"
         
-        return "/dev/" + label
+        if not os.path.exists(temp_dir):
+            os.makedirs(temp_dir)
+        
+        return temp_dir
     
-    def upload_file(self, files):
-        target = self.get_copy_target()
-        if target == "emmc":
-            base_path = self.emmc_base_path
+    def get_upload_session_dir(self):
+        """Get the directory holding the chunk index of each resumable upload session, creating it if needed."""
+        session_dir = f"{self.system_root}/tmp/loki-update-sessions/"
+        
+        if not os.path.exists(session_dir):
+            os.makedirs(session_dir)
+        
+        return session_dir
+    
+    def verify_checksum(self, file_name, digest):
+        """Check the SHA-256 of an uploaded file against the checksums provided by the client.
+
+        :param file_name: name of the uploaded file
+        :param digest: SHA-256 hex digest of the file as received
+        """
+        checksum = next((item for item in self.checksums if item["fileName"] == file_name), {}).get("checksum")
+        
+        if str(digest) != str(checksum):
+            self.copy_error = True
+            self.snapshots.bump("copy_progress")
+            raise LokiUpdateError(f"Checksum failed for {file_name}")
+    
+    def start_copy(self, temp_dir, file_names, target=None):
+        """Submit the job deploying staged files to a target.
+
+        :param temp_dir: staging directory holding the files
+        :param file_names: names of the files to deploy
+        :param target: target to deploy to, the current copy target if not given
+        """
+        target = target or self.get_copy_target()
+        
+        if target == "flash":
+            return self.scheduler.submit("copy_to_flash", ["flash"], self.copy_to_flash, temp_dir, file_names)
+        elif target == "emmc":
+            return self.scheduler.submit("copy_to_emmc", ["emmc"], self.copy_all_files, temp_dir, self.emmc_base_path, file_names, target)
         elif target == "sd":
-            base_path = self.sd_base_path
+            return self.scheduler.submit("copy_to_sd", ["sd"], self.copy_all_files, temp_dir, self.sd_base_path, file_names, target)
+        else:
+            raise LokiUpdateError(f"Invalid copy target: {target}")
+    
+    def get_device_base_path(self, device):
+        if device == "emmc":
+            return self.emmc_base_path
+        elif device == "sd":
+            return self.sd_base_path
+        elif device == "backup":
+            return self.backup_base_path
         
-        temp_dir = f"/tmp/{target}"
+        raise LokiUpdateError(f"Invalid device: {device}")
+    
+    def get_block_signatures(self, device, file_name, block_size):
+        """Get the block checksums of a file installed on a device, for a client to compute a delta.
+
+        :param device: device holding the basis file (emmc, sd or backup)
+        :param file_name: name of the installed file
+        :param block_size: size of each block
+        """
+        basis_path = self.get_device_base_path(device) + os.path.basename(file_name)
         
-        if not os.path.exists(temp_dir):
-            os.mkdir(temp_dir)
+        try:
+            return block_signatures(basis_path, block_size)
+        except FileNotFoundError:
+            raise LokiUpdateError(f"{file_name} is not installed on {device}")
+    
+    def complete_delta_upload(self, device, file_name, delta_path, block_size):
+        """Reconstruct an uploaded file from a delta against the copy installed on a device.
+
+        The reconstructed file is written to the staging directory and verified against the
+        checksums like any other upload.
+
+        :param device: device holding the basis file the delta was computed against
+        :param file_name: name of the file
+        :param delta_path: path of the received delta
+        :param block_size: block size the delta was computed with
+        """
+        basis_path = self.get_device_base_path(device) + file_name
+        out_path = self.get_staging_dir(self.get_copy_target()) + file_name
         
-        file_names = []
         try:
-            for file in files:
-                file_names.append(file["filename"])
+            digest = apply_delta(basis_path, delta_path, out_path, block_size)
+        except (DeltaError, OSError) as error:
+            raise LokiUpdateError(f"Unable to apply delta to {file_name}: {error}")
+        finally:
+            if os.path.exists(delta_path):
+                os.remove(delta_path)
+        
+        self.complete_upload(file_name, digest)
+    
+    def upload_file(self, files):
+        temp_dir = self.get_staging_dir(self.get_copy_target())
+        
+        file_names = []
+        for file in files:
+            start_time = time.perf_counter()
+            
+            # Hash the body already held in memory rather than reading the written file back
+            hash = hashlib.new("sha256")
+            hash.update(file["body"])
+            self.verify_checksum(file["filename"], hash.hexdigest())
+            
+            try:
                 with open(temp_dir + file["filename"], "wb") as out_file:
                     out_file.write(file["body"])
-                    
-        except FileNotFoundError as error:
-            logging.error("Temporary file location not found")
-            
-        except Exception as error:
-            logging.error(str(error))
-        
-        for file in file_names:
-            with open(temp_dir + file, "rb") as in_file:
-                hash = hashlib.new("sha256")
-                hash.update(in_file.read())
+                self.metrics.observe("upload_file", time.perf_counter() - start_time)
+                self.metrics.record_transfer("staging", len(file["body"]), time.perf_counter() - start_time)
+                self.record_checksum(temp_dir + file["filename"], hash.hexdigest())
+                file_names.append(file["filename"])
             
-            checksum = next(item for item in self.checksums if item["fileName"] == file)["checksum"]
+            except FileNotFoundError:
+                logging.error("Temporary file location not found")
             
-            if str(hash.hexdigest()) != str(checksum):
-                self.copy_error = True
-                raise LokiUpdateError("Checksum failed")
+            except Exception as error:
+                logging.error(str(error))
         
-        if target == "flash":
-            self.copy_to_flash(temp_dir, file_names)
-        else:
-            self.copy_all_files(temp_dir, base_path, file_names)
+        self.start_copy(temp_dir, file_names)
+    
+    def begin_upload(self, file_name):
+        """Prepare to receive a streamed upload into the staging directory.
+
+        :param file_name: name of the file being uploaded
+        :return: path of the staging file the request body should be written to
+        """
+        if not any(item["fileName"] == file_name for item in self.checksums):
+            raise LokiUpdateError(f"No checksum provided for {file_name}")
+        
+        self.copy_error = False
+        self.uploaded_files.discard(file_name)
+        
+        return self.get_staging_dir(self.get_copy_target()) + file_name
+    
+    def complete_upload(self, file_name, digest):
+        """Verify a streamed upload, starting the copy once every expected file has arrived.
+
+        :param file_name: name of the uploaded file
+        :param digest: SHA-256 hex digest calculated as the file was received
+        """
+        self.verify_checksum(file_name, digest)
+        self.record_checksum(self.get_staging_dir(self.get_copy_target()) + file_name, digest)
+        self.uploaded_files.add(file_name)
+        
+        expected_files = [item["fileName"] for item in self.checksums]
+        
+        if self.uploaded_files.issuperset(expected_files):
+            self.uploaded_files = set()
+            self.start_copy(self.get_staging_dir(self.get_copy_target()), expected_files)
         
-    @run_on_executor
-    def copy_all_files(self, temp_dir, base_path, file_names):
+    def copy_all_files(self, job, temp_dir, base_path, file_names, target):
         self.copy_success = False
+        self.copy_error = False
+        self.copy_error_message = ""
         self.copying = True
         try:
-            for file in file_names:
-                self.file_name_copying = file
-                source = temp_dir + file
-                destination = base_path + file
-                self.copy_file(source, destination)
-            
+            self.deploy_files(job, temp_dir, base_path, file_names, target)
             shutil.rmtree(temp_dir)
+            self.copy_success = True
+        
         except Exception as error:
             self.copy_error = True
             self.copy_error_message = str(error)
-            
-        self.copying = False
-        self.copy_success = True
+            raise
         
-        target = self.get_copy_target()
-        
-        if target == "emmc":
-            self.set_refresh_emmc_image_info(True)
+        finally:
+            self.copying = False
             
-        elif target == "sd":
-            self.set_refresh_sd_image_info(True)
+            if target == "emmc":
+                self.set_refresh_emmc_image_info(True)
+                
+            elif target == "sd":
+                self.set_refresh_sd_image_info(True)
     
-    def copy_file(self, src, dest):
-        src_path = pathlib.Path(src)
-        dest_path = pathlib.Path(dest)
+    def deploy_files(self, job, src_dir, dest_dir, file_names, device):
+        """Atomically and durably replace a set of files in a directory.
+
+        The deployment holds its device in the JobScheduler until every file has been flushed
+        and renamed into place, so the board does not report it is safe to reboot before then.
+
+        :param job: Job the deployment is running in, which receives its progress
+        :param src_dir: directory containing the new files
+        :param dest_dir: directory the files are deployed to
+        :param file_names: names of the files to deploy
+        :param device: name of the device the files are deployed to, for the metrics
+        """
+        # Files whose destination already holds identical content are not rewritten
+        changed_files = []
+        skipped_files = []
+        for file in file_names:
+            if self.is_file_unchanged(src_dir + file, dest_dir + file):
+                logging.debug(f"Skipping {file}, {dest_dir} already holds identical content")
+                skipped_files.append(file)
+            else:
+                changed_files.append(file)
         
-        buffer_size = 64 * 1024
+        job.result = {"written": changed_files, "skipped": skipped_files}
         
-        size = os.stat(src).st_size
-        with open(src_path, "rb") as src_file:
-            with open(dest_path, "wb") as dest_file:
-                self.copy_file_object(src_file, dest_file, buffer_size=buffer_size, total=size)
+        if changed_files:
+            copier = FileCopier(lambda copied, total, throughput: self.update_copy_progress(job, copied, total, throughput))
+            transaction = DeploymentTransaction(dest_dir, changed_files, copier)
+            
+            try:
+                for file in changed_files:
+                    self.file_name_copying = file
+                    job.file_name = file
+                    self.metadata_cache.invalidate(dest_dir + file)
+                    start_time = time.perf_counter()
+                    transaction.stage(src_dir + file, file)
+                    self.metrics.observe("copy_file", time.perf_counter() - start_time)
+                    self.metrics.record_transfer(device, copier.copied, time.perf_counter() - start_time)
+                
+                transaction.commit()
+            
+            except Exception:
+                transaction.abort()
+                raise
+            
+            for file in changed_files:
+                self.record_checksum(dest_dir + file, self.file_checksum(src_dir + file))
+    
+    def get_durable(self):
+        """Get whether it is safe to reboot, which is when no job writing to a device is queued or running."""
+        return not any(self.scheduler.is_writing(device) for device in DEPLOY_DEVICES)
+    
+    def file_checksum(self, path):
+        """Get the SHA-256 of a file, from the checksum cache if the file is unchanged.
+
+        :param path: path of the file
+        """
+        cached = self.checksum_cache.get(path)
+        if cached is not None:
+            return cached["sha256"]
+        
+        start_time = time.perf_counter()
+        digest = self.checksum_cache.content_hash(path)
+        self.metrics.observe("hash_file", time.perf_counter() - start_time)
+        self.record_checksum(path, digest)
+        return digest
+    
+    def record_checksum(self, path, digest):
+        self.checksum_cache.put(path, {"sha256": digest})
+    
+    def is_file_unchanged(self, src_path, dest_path):
+        """Check whether a destination file already holds the same content as a source file.
+
+        :param src_path: path of the new file
+        :param dest_path: path of the file it would replace
+        """
+        if not os.path.exists(dest_path) or os.path.getsize(src_path) != os.path.getsize(dest_path):
+            return False
         
-        shutil.copymode(str(src_path), str(dest_path))
+        return self.file_checksum(src_path) == self.file_checksum(dest_path)
     
-    def copy_file_object(self, src, dest, buffer_size, total):
-        total_copied = 0
-        while True:
-            buf = src.read(buffer_size)
-            if not buf:
-                break
-            dest.write(buf)
-            total_copied += len(buf)
-            self.copy_progress = round((total_copied / total) * 100, 1)
+    def update_copy_progress(self, job, copied, total, throughput):
+        """Update the copy progress, called by the file copier at throttled intervals.
+
+        The progress of the job is updated, along with the shared copy progress fields which
+        report the most recently updated copy.
+
+        :param job: Job the copy is running in
+        :param copied: number of bytes copied so far
+        :param total: total number of bytes to copy
+        :param throughput: copy throughput in MB/s
+        """
+        job.progress = round((copied / total) * 100, 1) if total else 100
+        job.throughput = throughput
+        self.copy_progress = job.progress
+        self.copy_throughput = throughput
+        self.snapshots.bump("copy_progress")
+        self.snapshots.bump("jobs")
     
-    @run_on_executor
-    def copy_to_flash(self, temp_dir, file_names):
+    def update_flash_progress(self, job, stage, done, total, throughput):
+        """Update the flash copy progress, called by the MTD writer at throttled intervals.
+
+        :param job: Job the flash copy is running in
+        :param stage: name of the current stage (erase, write or verify)
+        :param done: number of bytes processed in this stage
+        :param total: total number of bytes to process in this stage
+        :param throughput: throughput of this stage in MB/s
+        """
+        self.flash_copy_stage = stage
+        self.copy_progress = round((done / total) * 100) if total else 100
+        self.copy_throughput = throughput
+        job.stage = stage
+        job.progress = self.copy_progress
+        job.throughput = throughput
+        self.snapshots.bump("copy_progress")
+        self.snapshots.bump("jobs")
+    
+    def copy_to_flash(self, job, temp_dir, file_names):
         self.copying_to_flash = True
         self.flash_copy_file_num = 1
         self.copy_success = False
+        self.copy_error = False
+        self.copy_error_message = ""
         
-        for file in file_names:
-            file_extension = file.partition(".")[2]
-            src_path = temp_dir + file
-            
-            try:
+        writer = MtdWriter(lambda stage, done, total, throughput: self.update_flash_progress(job, stage, done, total, throughput))
+        job.result = {"written": [], "skipped": [], "blocks": {}}
+        
+        try:
+            for file in file_names:
+                file_extension = file.partition(".")[2]
+                src_path = temp_dir + file
+                
                 if file_extension == "ub":
-                    process = subprocess.Popen(["flashcp", "-v", src_path, self.mtd_label_to_device("kernel")], stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
+                    mtd_device = self.mtd_label_to_device("kernel")
                 elif file_extension == "BIN" or file_extension == "bin":
-                    process = subprocess.Popen(["flashcp", "-v", src_path, self.mtd_label_to_device("boot")], stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
+                    mtd_device = self.mtd_label_to_device("boot")
                 elif file_extension == "scr":
-                    process = subprocess.Popen(["flashcp", "-v", src_path, self.mtd_label_to_device("bootscr")], stdout=subprocess.PIPE, bufsize=1, universal_newlines=True)
+                    mtd_device = self.mtd_label_to_device("bootscr")
+                else:
+                    raise LokiUpdateError(f"No flash partition for {file}")
+                
+                job.file_name = file
+                start_time = time.perf_counter()
+                blocks = writer.write_image(src_path, mtd_device)
+                self.metrics.observe("flash_write_image", time.perf_counter() - start_time)
+                self.metrics.record_transfer("flash", os.path.getsize(src_path), time.perf_counter() - start_time)
+                job.result["blocks"][file] = blocks
+                
+                if blocks["written"]:
+                    job.result["written"].append(file)
+                else:
+                    logging.debug(f"Skipping {file}, {mtd_device} already holds identical content")
+                    job.result["skipped"].append(file)
                 
-                for line in process.stdout:
-                    self.flash_copy_stage = line.split(": ")[0]
-                    self.copy_progress = int(line.split("(")[1].replace("%)", ""))
-            
                 self.flash_copy_file_num += 1
-        
-            except subprocess.CalledProcessError as error:
-                logging.error(error.stderr)
             
-            except Exception as error:
-                logging.error(error)
-                
-        self.copying_to_flash = False
-        self.copy_success = True
-        self.set_refresh_flash_image_info(True)
+            shutil.rmtree(temp_dir)
+            self.copy_success = True
+        
+        except (MtdError, LokiUpdateError, OSError) as error:
+            self.copy_error = True
+            self.copy_error_message = str(error)
+            raise
+        
+        finally:
+            self.copying_to_flash = False
+            self.set_refresh_flash_image_info(True)
     
     def get_copy_target(self):
         return self.copy_target
@@ -633,6 +1043,7 @@ class LokiUpdateController():
     
     def set_checksums(self, checksums):
         self.checksums = checksums
+        self.uploaded_files = set()
     
     def get_emmc_backup(self):
         return self.emmc_backup
@@ -641,21 +1052,17 @@ class LokiUpdateController():
         self.emmc_backup = bool(backup)
         
         if self.emmc_backup:
-            self.copy_from_emmc_to_backup()
+            self.scheduler.submit("backup_emmc", ["emmc", "backup"], self.copy_from_emmc_to_backup, writes=["backup"])
     
-    @run_on_executor
-    def copy_from_emmc_to_backup(self):
+    def copy_from_emmc_to_backup(self, job):
         files_to_copy = ["BOOT.BIN", "boot.scr", "image.ub"]
         self.backup_success = False
         
-        for file in files_to_copy:
-            self.file_name_copying = file
-            src_path = self.emmc_base_path + file
-            dest_path = self.backup_base_path + file
-            self.copy_file(src_path, dest_path)
+        self.deploy_files(job, self.emmc_base_path, self.backup_base_path, files_to_copy, "backup")
         
         self.emmc_backup = False
         self.backup_success = True
+        self.snapshots.bump("installed_images")
         self.set_refresh_backup_image_info(True)
     
     def get_restore_emmc(self):
@@ -665,21 +1072,17 @@ class LokiUpdateController():
         self.restore_emmc = bool(restore)
         
         if self.restore_emmc:
-            self.copy_from_backup_to_emmc()
+            self.scheduler.submit("restore_emmc", ["emmc", "backup"], self.copy_from_backup_to_emmc, writes=["emmc"])
     
-    @run_on_executor
-    def copy_from_backup_to_emmc(self):
+    def copy_from_backup_to_emmc(self, job):
         files_to_copy = ["BOOT.BIN", "boot.scr", "image.ub"]
         self.restore_success = False
         
-        for file in files_to_copy:
-            self.file_name_copying = file
-            src_path = self.backup_base_path + file
-            dest_path = self.emmc_base_path + file
-            self.copy_file(src_path, dest_path)
+        self.deploy_files(job, self.backup_base_path, self.emmc_base_path, files_to_copy, "emmc")
         
         self.restore_emmc = False
         self.restore_success = True
+        self.snapshots.bump("installed_images")
         self.set_refresh_emmc_image_info(True)
     
     def set_reboot(self, reboot):
@@ -690,88 +1093,276 @@ class LokiUpdateController():
     
     def reboot_board(self):
         self.is_rebooting = True
+        self.snapshots.bump("reboot_board")
+        self.metrics.increment("subprocess_reboot")
         subprocess.run(["reboot"])
     
     def get_repo_info(self):
         repo_info = []
         
         for repo in self.available_repos:
-            tags = self.get_release_tags_from_repo(repo.get("owner"), repo.get("name"))
+            tags = self.catalogue.get_tags(repo.get("owner"), repo.get("name"))
             repo_info.append({"name": repo.get("name"), "tags": tags})
         
+        self.add_cached_tags(repo_info)
         return repo_info
     
-    def get_release_tags_from_repo(self, owner, repo):
-        release_response = requests.get(f"{GITHUB_REPO_API_URL}/{owner}/{repo}/releases")
+    def set_refresh_catalogue(self, refresh):
+        self.refresh_catalogue = bool(refresh)
         
-        tags = []
-        assets_required = {"image.ub", "BOOT.BIN", "boot.scr"}
+        if self.refresh_catalogue:
+            self.catalogue.request_refresh()
+            self.refresh_catalogue = False
+            self.snapshots.bump("github_repos")
+    
+    def add_cached_tags(self, repo_info):
+        """Add releases held in the artifact cache to the repository info, so they can be installed offline.
+
+        :param repo_info: list of the name and release tags of each repository, updated in place
+        """
+        if not self.artifact_cache:
+            return
+        
+        for repo, info in zip(self.available_repos, repo_info):
+            for tag in self.artifact_cache.get_tags(repo.get("owner"), repo.get("name"), RELEASE_ASSETS):
+                if tag not in info["tags"]:
+                    info["tags"].append(tag)
+    
+    def seed_artifact_cache(self):
+        """Pre-seed the artifact cache from the local directories configured in available_repos."""
+        repos_to_seed = [repo for repo in self.available_repos if repo.get("seed_dir")]
         
-        if release_response.status_code != 200:
-            raise LokiUpdateError("Unable to fetch releases from repository")
+        if self.artifact_cache and repos_to_seed:
+            self.scheduler.submit("seed_artifacts", ["artifacts"], self.seed_from_directories, repos_to_seed)
+    
+    def seed_from_directories(self, job, repos):
+        added = {}
         
-        for release in release_response.json():
-            if release.get("assets"):
-                assets_available = {asset.get("name") for asset in release.get("assets")}
-                if assets_required.issubset(assets_available):
-                    tags.append(release.get("tag_name"))
+        for repo in repos:
+            try:
+                added[repo.get("name")] = self.artifact_cache.seed_from_directory(repo.get("owner"), repo.get("name"), repo.get("seed_dir"))
+            except OSError as error:
+                logging.error(f"Unable to seed artifact cache from {repo.get('seed_dir')}: {error}")
         
-        return tags
+        self.snapshots.bump("github_repos")
+        return added
     
     def set_release_to_retrieve(self, release):
         repo = release.get("repo")
         tag = release.get("tag")
-        owner = next((item for item in self.available_repos if item.get("name") == repo)).get("owner")
+        repo_config = next((item for item in self.available_repos if item.get("name") == repo), None)
+        if repo_config is None:
+            raise LokiUpdateError(f"Unknown repository: {repo}")
+        owner = repo_config.get("owner")
         
-        self.download_release_assets(owner, repo, tag)
-    
-    def download_release_assets(self, owner, repo, tag):
+        # Assets are downloaded in the background, so the request returns straight away. The
+        # target is read now, so a later change of target does not redirect this release
         self.downloading = True
-        target = self.get_copy_target()
-        if target == "emmc":
-            base_path = self.emmc_base_path
-        elif target == "sd":
-            base_path = self.sd_base_path
-        
-        temp_dir = f"/tmp/{target}"
-        
-        if not os.path.exists(temp_dir):
-            os.mkdir(temp_dir)
-            
-        tag_response = requests.get(f"{GITHUB_REPO_API_URL}/{owner}/{repo}/releases/tags/{tag}")
+        self.snapshots.bump("github_repos")
+        self.scheduler.submit("download_release", ["download"], self.download_release_assets, owner, repo, tag,
+                              repo_config.get("mirror"), self.get_copy_target())
+    
+    def get_release_assets(self, owner, repo, tag, mirror=None):
+        """Get the name, URL, size and SHA-256 of each asset making up a release.
+
+        The sizes and digests always come from the release on GitHub, so that assets fetched
+        from a mirror are verified against them, and a mirror is only used for assets with a
+        listed digest.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param mirror: base URL of a mirror holding the assets as <mirror>/<tag>/<asset name>, used instead of GitHub
+        """
+        tag_response = self.http_session.get(f"{self.github_api_url}/{owner}/{repo}/releases/tags/{tag}")
         
         if tag_response.status_code != 200:
             raise LokiUpdateError("Unable to fetch release assets from repository")
         
-        assets = tag_response.json().get("assets")
+        assets = [
+            {
+                "name": asset.get("name"),
+                "url": asset.get("browser_download_url"),
+                "size": asset.get("size"),
+                # GitHub reports the digest of each asset as "sha256:<hex digest>"
+                "sha256": (asset.get("digest") or "").partition("sha256:")[2] or None
+            }
+            for asset in tag_response.json().get("assets") or []
+            if asset.get("name") in RELEASE_ASSETS
+        ]
         
-        if not assets:
-            raise LokiUpdateError("No assets found for this release")
+        if mirror:
+            for asset in assets:
+                if not asset["sha256"]:
+                    raise LokiUpdateError(f"Release {tag} lists no SHA-256 for {asset['name']}, so it cannot be verified from the mirror")
+                asset["url"] = f"{mirror.rstrip('/')}/{tag}/{asset['name']}"
         
-        temp_dir = f"/tmp/{target}/"
-        file_name_list = []
+        return assets
+    
+    def stage_cached_assets(self, owner, repo, tag, temp_dir):
+        """Copy the assets of a release held in the artifact cache to the staging directory.
+
+        :return: names of the assets staged from the cache
+        """
+        staged = []
+        
+        if not self.artifact_cache:
+            return staged
+        
+        copier = FileCopier()
+        for file_name in RELEASE_ASSETS:
+            cached = self.artifact_cache.get(owner, repo, tag, file_name)
+            if cached:
+                cached_path, digest = cached
+                copier.copy_file(cached_path, temp_dir + file_name)
+                self.record_checksum(temp_dir + file_name, digest)
+                staged.append(file_name)
+        
+        return staged
+    
+    def download_release_assets(self, job, owner, repo, tag, mirror=None, target=None):
+        target = target or self.get_copy_target()
+        self.downloading = True
+        self.download_error = False
+        self.download_error_message = ""
+        self.download_progress = 0
+        self.download_eta = None
+        self.snapshots.bump("github_repos")
         
-        for asset in assets:
-            download_url = asset.get("browser_download_url")
-            file_name = asset.get("name")
+        try:
+            temp_dir = self.get_staging_dir(target)
             
-            if file_name not in ["image.ub", "BOOT.BIN", "boot.scr"]:
-                continue
+            # Assets already in the artifact cache are copied rather than downloaded, and those
+            # held by peers are fetched from them, so only the rest are downloaded from upstream
+            cached_files = self.stage_cached_assets(owner, repo, tag, temp_dir)
+            peer_files = []
+            downloaded_files = []
             
-            file_name_list.append(file_name)
+            if len(cached_files) < len(RELEASE_ASSETS):
+                assets = [asset for asset in self.get_release_assets(owner, repo, tag, mirror) if asset["name"] not in cached_files]
+                
+                if not assets and not cached_files:
+                    raise LokiUpdateError("No assets found for this release")
+                
+                # Peers are only trusted with assets whose digest the release lists upstream
+                peer_files = self.fetch_from_peers(job, owner, repo, tag, temp_dir,
+                                                   {asset["name"]: asset["sha256"] for asset in assets if asset.get("sha256")})
+                assets = [asset for asset in assets if asset["name"] not in peer_files]
+                
+                if assets:
+                    downloader = AssetDownloader(self.http_session,
+                                                 lambda downloaded, total, rate, eta: self.update_download_progress(job, downloaded, total, rate, eta))
+                    start_time = time.perf_counter()
+                    digests = downloader.download_assets(assets, temp_dir)
+                    self.metrics.record_transfer("download", downloader.downloaded - downloader.resumed, time.perf_counter() - start_time)
+                    
+                    for file_name, digest in digests.items():
+                        self.record_checksum(temp_dir + file_name, digest)
+                        if self.artifact_cache:
+                            self.artifact_cache.put(owner, repo, tag, file_name, temp_dir + file_name, digest)
+                        downloaded_files.append(file_name)
             
-            response = requests.get(download_url, allow_redirects=True)
+            self.download_progress = 100
+            job.result = {"cached": cached_files, "peers": peer_files, "downloaded": downloaded_files}
+        
+        except (DownloadError, LokiUpdateError, requests.RequestException, OSError) as error:
+            self.download_error = True
+            self.download_error_message = str(error)
+            raise
+        
+        finally:
+            self.downloading = False
+            self.snapshots.bump("github_repos")
+        
+        self.start_copy(temp_dir, cached_files + peer_files + downloaded_files, target)
+    
+    def fetch_from_peers(self, job, owner, repo, tag, temp_dir, expected):
+        """Fetch release assets from the configured peers, adding them to the artifact cache.
+
+        Each asset fetched is checked against the digest listed for it in the upstream release,
+        so that a peer holding a bad copy cannot spread it to other boards.
+
+        :param job: Job the download is running in
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param temp_dir: staging directory the assets are written to
+        :param expected: dictionary of the upstream SHA-256 of each asset wanted, by name
+        :return: names of the assets fetched, any others are left to download from upstream
+        """
+        if not self.artifact_peers or not expected:
+            return []
+        
+        downloader = PeerDownloader(self.http_session, self.artifact_peers,
+                                    lambda downloaded, total, rate, eta: self.update_download_progress(job, downloaded, total, rate, eta))
+        assets = downloader.find_assets(owner, repo, tag, expected)
+        if not assets:
+            return []
+        
+        start_time = time.perf_counter()
+        digests = downloader.download_assets(assets, temp_dir)
+        self.metrics.record_transfer("peers", downloader.downloaded, time.perf_counter() - start_time)
+        
+        fetched = []
+        for file_name, digest in digests.items():
+            if digest != expected[file_name]:
+                logging.error(f"{file_name} fetched from peers does not match the release, downloading it from upstream")
+                os.remove(temp_dir + file_name)
+                continue
             
-            if response.status_code == 200:
-                with open(temp_dir + file_name, "wb") as file:
-                    file.write(response.content)
-            else:
-                raise LokiUpdateError("Unable to download release asset: " + file_name)
+            self.record_checksum(temp_dir + file_name, digest)
+            if self.artifact_cache:
+                self.artifact_cache.put(owner, repo, tag, file_name, temp_dir + file_name, digest)
+            fetched.append(file_name)
         
-        self.downloading = False
+        logging.debug(f"Fetched {fetched} of {owner}/{repo} {tag} from peers")
+        return fetched
+    
+    def get_seed_assets(self, owner, repo, tag, chunk_size):
+        """Get the cached assets of a release this board can serve to peers.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param chunk_size: size of the chunks the peer will fetch, which the chunk hashes are calculated for
+        :return: dictionary of the size, SHA-256, chunk size and chunk hashes of each asset, by name
+        """
+        if not self.artifact_seed or not self.artifact_cache:
+            raise LokiUpdateError("This board does not serve release assets to peers")
         
-        if target == "flash":
-            self.copy_to_flash(temp_dir, file_name_list)
-        else:
-            self.copy_all_files(temp_dir, base_path, file_name_list)
+        assets = {}
+        for name, asset in self.artifact_cache.get_release(owner, repo, tag).items():
+            chunks = self.artifact_cache.get_chunk_hashes(asset["sha256"], chunk_size)
+            if chunks is not None:
+                assets[name] = dict(asset, chunk_size=chunk_size, chunks=chunks)
+        
+        return assets
+    
+    def get_seed_asset(self, owner, repo, tag, name):
+        """Get the path of a cached release asset to serve to a peer.
+
+        :return: tuple of the path of the stored asset and its SHA-256, or None if it is not cached
+        """
+        if not self.artifact_seed or not self.artifact_cache:
+            raise LokiUpdateError("This board does not serve release assets to peers")
         
+        return self.artifact_cache.get(owner, repo, tag, name)
+    
+    def update_download_progress(self, job, downloaded, total, rate, eta):
+        """Update the download progress, called by the asset downloader at throttled intervals.
+
+        :param job: Job the download is running in
+        :param downloaded: number of bytes downloaded so far, across every asset
+        :param total: total size of the assets in bytes
+        :param rate: download rate in bytes per second
+        :param eta: estimated time in seconds until the download completes, or None if unknown
+        """
+        self.download_progress = round((downloaded / total) * 100, 1) if total else 0
+        self.download_bytes = downloaded
+        self.download_total = total
+        self.download_rate = rate
+        self.download_eta = eta
+        self.snapshots.bump("github_repos")
+        job.progress = self.download_progress
+        job.throughput = round(rate / (1024 * 1024), 1)
+        self.snapshots.bump("jobs")
@@ -0,0 +1,143 @@
+import os
+import time
+import errno
+import shutil
+
+# Errors from the zero-copy system calls which mean the next method should be tried instead
+FALLBACK_ERRNOS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF}
+
+class CopyError(Exception):
+    """
+    Simple exception class for copies which did not copy the expected number of bytes
+    """
+
+    pass
+
+class FileCopier():
+    """
+    File copy engine which avoids moving data through Python where the kernel allows it.
+
+    os.copy_file_range is tried first, then os.sendfile, before falling back to readinto
+    calls on a single reused buffer. Each method resumes from the offset the previous one
+    reached. Progress is reported through a callback, throttled to a time or byte threshold.
+    """
+
+    def __init__(self, progress_callback=None, buffer_size=1024 * 1024, call_size=8 * 1024 * 1024,
+                 progress_interval=0.25, progress_bytes=4 * 1024 * 1024):
+        """Initialise the FileCopier object.
+
+        :param progress_callback: function called with (bytes copied, total bytes, throughput in MB/s)
+        :param buffer_size: size of the buffer used by the fallback copy
+        :param call_size: maximum number of bytes moved by each zero-copy system call
+        :param progress_interval: minimum time in seconds between progress reports
+        :param progress_bytes: number of bytes copied after which progress is always reported
+        """
+        self.progress_callback = progress_callback
+        self.buffer = bytearray(buffer_size)
+        self.call_size = call_size
+        self.progress_interval = progress_interval
+        self.progress_bytes = progress_bytes
+        self.throughput = 0
+
+    def copy_file(self, src, dest, fsync=False):
+        """Copy a file, including its permission bits.
+
+        :param src: path of the file to copy
+        :param dest: path to copy the file to
+        :param fsync: if True, flush the copy to disk before returning
+        :return: number of bytes copied
+        """
+        total = os.stat(src).st_size
+
+        with open(src, "rb") as src_file:
+            with open(dest, "wb") as dest_file:
+                copied = self.copy_file_object(src_file, dest_file, total)
+                if fsync:
+                    dest_file.flush()
+                    os.fsync(dest_file.fileno())
+
+        shutil.copymode(src, dest)
+        return copied
+
+    def copy_file_object(self, src_file, dest_file, total):
+        """Copy the contents of one open file to another.
+
+        :param src_file: open binary file to copy from
+        :param dest_file: open binary file to copy to
+        :param total: number of bytes to copy
+        :return: number of bytes copied
+        """
+        self.start_time = time.monotonic()
+        self.last_report_time = self.start_time
+        self.last_report_copied = 0
+        self.copied = 0
+        self.total = total
+
+        # A method which stops short, such as copy_file_range returning 0 on a filesystem that
+        # does not support it, is followed by the next from where it stopped
+        for method in (self.copy_range, self.send_file):
+            try:
+                method(src_file.fileno(), dest_file.fileno())
+                if self.copied >= self.total:
+                    break
+            except (AttributeError, OSError) as error:
+                if isinstance(error, OSError) and error.errno not in FALLBACK_ERRNOS:
+                    raise
+        else:
+            self.copy_buffered(src_file, dest_file)
+
+        self.report_progress(force=True)
+
+        if self.copied != self.total:
+            raise CopyError(f"Copied {self.copied} bytes of {src_file.name}, expected {self.total}")
+
+        return self.copied
+
+    def copy_range(self, in_fd, out_fd):
+        while self.copied < self.total:
+            count = os.copy_file_range(in_fd, out_fd, min(self.call_size, self.total - self.copied),
+                                       self.copied, self.copied)
+            if count == 0:
+                break
+            self.advance(count)
+
+    def send_file(self, in_fd, out_fd):
+        os.lseek(out_fd, self.copied, os.SEEK_SET)
+        while self.copied < self.total:
+            count = os.sendfile(out_fd, in_fd, self.copied, min(self.call_size, self.total - self.copied))
+            if count == 0:
+                break
+            self.advance(count)
+
+    def copy_buffered(self, src_file, dest_file):
+        src_file.seek(self.copied)
+        dest_file.seek(self.copied)
+        view = memoryview(self.buffer)
+
+        while True:
+            count = src_file.readinto(self.buffer)
+            if not count:
+                break
+            dest_file.write(view[:count])
+            self.advance(count)
+
+    def advance(self, count):
+        self.copied += count
+        self.report_progress()
+
+    def report_progress(self, force=False):
+        now = time.monotonic()
+
+        if not force and now - self.last_report_time < self.progress_interval \
+                and self.copied - self.last_report_copied < self.progress_bytes:
+            return
+
+        elapsed = now - self.start_time
+        if elapsed > 0:
+            self.throughput = round(self.copied / elapsed / (1024 * 1024), 1)
+
+        self.last_report_time = now
+        self.last_report_copied = self.copied
+
+        if self.progress_callback:
+            self.progress_callback(self.copied, self.total, self.throughput)
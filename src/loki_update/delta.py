@@ -0,0 +1,166 @@
+import zlib
+import struct
+import hashlib
+
+DEFAULT_BLOCK_SIZE = 64 * 1024
+
+# Delta instructions: copy a block of the basis file, or insert literal data
+OP_COPY = b"C"
+OP_DATA = b"D"
+
+# Modulus of the Adler-32 sums, used to roll the weak checksum
+ADLER_MOD = 65521
+
+# Largest literal data record written by compute_delta
+MAX_LITERAL_SIZE = 1024 * 1024
+
+class DeltaError(Exception):
+    """
+    Simple exception class for errors raised while applying a delta
+    """
+
+    pass
+
+def weak_checksum(data):
+    """Calculate the Adler-32 checksum of a block, used to find candidate matches cheaply."""
+    return zlib.adler32(data)
+
+def strong_checksum(data):
+    return hashlib.sha256(data).hexdigest()
+
+def block_signatures(path, block_size=DEFAULT_BLOCK_SIZE):
+    """Calculate the weak and strong checksums of each block of a file.
+
+    :param path: path of the basis file
+    :param block_size: size of each block
+    :return: dictionary of the block size, file size and [weak, strong] checksum of each block
+    """
+    blocks = []
+    size = 0
+
+    with open(path, "rb") as basis_file:
+        for block in iter(lambda: basis_file.read(block_size), b""):
+            blocks.append([weak_checksum(block), strong_checksum(block)])
+            size += len(block)
+
+    return {"block_size": block_size, "size": size, "blocks": blocks}
+
+def compute_delta(signatures, new_path, delta_file):
+    """Write the delta that turns the basis file described by its signatures into a new file.
+
+    Runs on the client, rolling the weak checksum one byte at a time over the new file until
+    it finds a candidate block, which is confirmed with the strong checksum before jumping a
+    whole block ahead. Content which has moved within the file, such as after an insertion,
+    is still matched.
+
+    :param signatures: block signatures of the basis file, from block_signatures
+    :param new_path: path of the new file
+    :param delta_file: open binary file the delta is written to
+    :return: number of literal bytes in the delta
+    """
+    block_size = signatures["block_size"]
+    weak_index = {}
+    for index, (weak, strong) in enumerate(signatures["blocks"]):
+        weak_index.setdefault(weak, []).append((strong, index))
+
+    with open(new_path, "rb") as new_file:
+        data = new_file.read()
+
+    literal_start = 0
+    literal_bytes = 0
+
+    def write_literal(start, end):
+        for offset in range(start, end, MAX_LITERAL_SIZE):
+            chunk = data[offset:min(offset + MAX_LITERAL_SIZE, end)]
+            delta_file.write(OP_DATA + struct.pack(">I", len(chunk)) + chunk)
+        return end - start
+
+    def find_block(block, candidates):
+        strong_block = strong_checksum(block)
+        for strong, index in candidates:
+            if strong == strong_block:
+                return index
+        return None
+
+    position = 0
+    weak = None
+    last_start = len(data) - block_size
+
+    while position <= last_start:
+        if weak is None:
+            weak = weak_checksum(data[position:position + block_size])
+            a = weak & 0xffff
+            b = weak >> 16
+
+        candidates = weak_index.get(weak)
+        match = find_block(data[position:position + block_size], candidates) if candidates else None
+
+        if match is not None:
+            literal_bytes += write_literal(literal_start, position)
+            delta_file.write(OP_COPY + struct.pack(">I", match))
+            position += block_size
+            literal_start = position
+            weak = None
+            continue
+
+        # Roll the Adler-32 checksum forward by one byte
+        if position < last_start:
+            out_byte = data[position]
+            a = (a - out_byte + data[position + block_size]) % ADLER_MOD
+            b = (b - block_size * out_byte + a - 1) % ADLER_MOD
+            weak = (b << 16) | a
+        position += 1
+
+    # Only the final, partial block of the basis can match the end of the new file
+    tail_size = signatures["size"] % block_size
+    tail_start = len(data) - tail_size
+    if tail_size and tail_start >= literal_start and strong_checksum(data[tail_start:]) == signatures["blocks"][-1][1]:
+        literal_bytes += write_literal(literal_start, tail_start)
+        delta_file.write(OP_COPY + struct.pack(">I", len(signatures["blocks"]) - 1))
+    else:
+        literal_bytes += write_literal(literal_start, len(data))
+
+    return literal_bytes
+
+def read_exact(delta_file, size):
+    data = delta_file.read(size)
+    if len(data) != size:
+        raise DeltaError("Delta is truncated")
+
+    return data
+
+def apply_delta(basis_path, delta_path, out_path, block_size):
+    """Reconstruct a new file from a basis file and a delta.
+
+    :param basis_path: path of the basis file the delta was computed against
+    :param delta_path: path of the delta
+    :param out_path: path the reconstructed file is written to
+    :param block_size: block size the basis signatures were calculated with
+    :return: SHA-256 hex digest of the reconstructed file
+    """
+    hash = hashlib.new("sha256")
+
+    with open(basis_path, "rb") as basis_file, open(delta_path, "rb") as delta_file, open(out_path, "wb") as out_file:
+        while True:
+            op = delta_file.read(1)
+            if not op:
+                break
+
+            if op == OP_COPY:
+                index, = struct.unpack(">I", read_exact(delta_file, 4))
+                basis_file.seek(index * block_size)
+                chunk = basis_file.read(block_size)
+                if not chunk:
+                    raise DeltaError(f"Delta refers to block {index} beyond the end of the basis file")
+
+            elif op == OP_DATA:
+                length, = struct.unpack(">I", read_exact(delta_file, 4))
+                chunk = read_exact(delta_file, length)
+
+            else:
+                raise DeltaError(f"Invalid delta instruction {op!r}")
+
+            out_file.write(chunk)
+            hash.update(chunk)
+
+    return hash.hexdigest()
@@ -0,0 +1,141 @@
+import os
+import json
+import logging
+
+# Journal recording the state of a deployment, kept in the directory being deployed to
+JOURNAL_NAME = ".loki-update-journal"
+
+# Suffix of the sibling files new images are written to before being renamed into place
+TEMP_SUFFIX = ".loki-update-new"
+
+# Journal states: files are being written to temporary names, or are being renamed into place
+STATE_STAGING = "staging"
+STATE_COMMITTING = "committing"
+
+def fsync_directory(path):
+    """Flush a directory entry to disk, so that renames within it are durable.
+
+    Some filesystems do not support fsync on a directory, in which case this is a no-op.
+
+    :param path: path of the directory
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    except OSError as error:
+        logging.debug(f"Unable to fsync directory {path}: {error}")
+    finally:
+        os.close(fd)
+
+def write_journal(dest_dir, state, file_names):
+    journal_path = os.path.join(dest_dir, JOURNAL_NAME)
+    temp_path = journal_path + TEMP_SUFFIX
+
+    with open(temp_path, "w") as journal_file:
+        json.dump({"state": state, "files": file_names}, journal_file)
+        journal_file.flush()
+        os.fsync(journal_file.fileno())
+
+    os.replace(temp_path, journal_path)
+    fsync_directory(dest_dir)
+
+def remove_journal(dest_dir):
+    journal_path = os.path.join(dest_dir, JOURNAL_NAME)
+
+    if os.path.exists(journal_path):
+        os.remove(journal_path)
+        fsync_directory(dest_dir)
+
+def rename_into_place(dest_dir, file_names):
+    for file_name in file_names:
+        temp_path = os.path.join(dest_dir, file_name + TEMP_SUFFIX)
+        if os.path.exists(temp_path):
+            os.replace(temp_path, os.path.join(dest_dir, file_name))
+
+    fsync_directory(dest_dir)
+
+def remove_temp_files(dest_dir, file_names):
+    for file_name in file_names:
+        temp_path = os.path.join(dest_dir, file_name + TEMP_SUFFIX)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def recover_deployment(dest_dir):
+    """Complete or undo a deployment interrupted by a crash or power cut.
+
+    A deployment interrupted while its files were being written is rolled back, leaving the
+    previous image in place. One interrupted after every file was written and flushed is
+    rolled forward, renaming the remaining files into place.
+
+    :param dest_dir: directory the deployment was writing to
+    :return: "rolled_back", "rolled_forward", or None if there was nothing to recover
+    """
+    journal_path = os.path.join(dest_dir, JOURNAL_NAME)
+
+    if not os.path.exists(journal_path):
+        return None
+
+    try:
+        with open(journal_path, "r") as journal_file:
+            journal = json.load(journal_file)
+        state = journal["state"]
+        file_names = journal["files"]
+
+    except (OSError, ValueError, KeyError) as error:
+        logging.error(f"Unable to read deployment journal in {dest_dir}: {error}")
+        return None
+
+    if state == STATE_COMMITTING:
+        rename_into_place(dest_dir, file_names)
+        action = "rolled_forward"
+    else:
+        remove_temp_files(dest_dir, file_names)
+        action = "rolled_back"
+
+    remove_journal(dest_dir)
+    logging.info(f"Interrupted deployment of {file_names} to {dest_dir} {action.replace('_', ' ')}")
+
+    return action
+
+class DeploymentTransaction():
+    """
+    Atomic, durable replacement of a set of files in one directory.
+
+    Each file is written to a sibling temporary name and flushed to disk. Once every file
+    has been written the journal is moved to the committing state and the files are renamed
+    into place, so a power cut leaves either the complete old or the complete new set.
+    """
+
+    def __init__(self, dest_dir, file_names, copier):
+        """Initialise the DeploymentTransaction object and record it in the journal.
+
+        :param dest_dir: directory the files are deployed to
+        :param file_names: names of the files making up the deployment
+        :param copier: FileCopier used to write the files
+        """
+        self.dest_dir = dest_dir
+        self.file_names = list(file_names)
+        self.copier = copier
+
+        write_journal(self.dest_dir, STATE_STAGING, self.file_names)
+
+    def stage(self, src_path, file_name):
+        """Write a file to its temporary name and flush it to disk.
+
+        :param src_path: path of the file to deploy
+        :param file_name: name of the file within the deployment directory
+        """
+        temp_path = os.path.join(self.dest_dir, file_name + TEMP_SUFFIX)
+        self.copier.copy_file(src_path, temp_path, fsync=True)
+
+    def commit(self):
+        """Rename every staged file into place, durably."""
+        fsync_directory(self.dest_dir)
+        write_journal(self.dest_dir, STATE_COMMITTING, self.file_names)
+        rename_into_place(self.dest_dir, self.file_names)
+        remove_journal(self.dest_dir)
+
+    def abort(self):
+        """Remove any staged files, leaving the existing files untouched."""
+        remove_temp_files(self.dest_dir, self.file_names)
+        remove_journal(self.dest_dir)
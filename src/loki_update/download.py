@@ -0,0 +1,337 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent import futures
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Suffix of partially downloaded files, kept so an interrupted download can be resumed
+PARTIAL_SUFFIX = ".part"
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+# Size of the chunks assets are split into when fetched from peers, each checked by its own hash
+DEFAULT_PEER_CHUNK_SIZE = 4 * 1024 * 1024
+
+class DownloadError(Exception):
+    """
+    Simple exception class for errors raised while downloading release assets
+    """
+
+    pass
+
+def make_session(pool_size=4):
+    """Create an HTTP session whose connections are reused across requests.
+
+    :param pool_size: number of connections kept open to each host
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def content_range_size(response):
+    """Get the complete size of a resource from the Content-Range header of a response.
+
+    :param response: response to a Range request, such as a 416 giving "bytes */<size>"
+    :return: the size in bytes, or None if the header does not give it
+    """
+    size = response.headers.get("Content-Range", "").rpartition("/")[2]
+    return int(size) if size.isdigit() else None
+
+class AssetDownloader():
+    """
+    Concurrent downloader of release assets, streaming each one to disk.
+
+    Assets are downloaded in parallel over a shared, pooled session and written in chunks
+    while their SHA-256 is calculated. Each is written to a partial file first, so that an
+    interrupted download resumes with an HTTP Range request rather than starting again.
+    """
+
+    def __init__(self, session, progress_callback=None, chunk_size=DEFAULT_CHUNK_SIZE,
+                 max_workers=3, progress_interval=0.25, timeout=30):
+        """Initialise the AssetDownloader object.
+
+        :param session: requests session the downloads are made with
+        :param progress_callback: function called with (bytes downloaded, total bytes, bytes per second, ETA in seconds)
+        :param chunk_size: size of each chunk written to disk
+        :param max_workers: number of assets downloaded at once
+        :param progress_interval: minimum time in seconds between progress reports
+        :param timeout: connection and read timeout in seconds
+        """
+        self.session = session
+        self.progress_callback = progress_callback
+        self.chunk_size = chunk_size
+        self.max_workers = max_workers
+        self.progress_interval = progress_interval
+        self.timeout = timeout
+        self.lock = threading.Lock()
+
+    def download_assets(self, assets, dest_dir):
+        """Download a set of assets into a directory.
+
+        :param assets: list of dictionaries giving the name, url, and optionally the size and
+            sha256, of each asset
+        :param dest_dir: directory the assets are written to
+        :return: dictionary of the SHA-256 hex digest of each downloaded asset
+        """
+        self.downloaded = 0
+        self.resumed = 0
+        self.total = sum(asset.get("size") or 0 for asset in assets)
+        self.start_time = time.monotonic()
+        self.last_report_time = 0
+
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self.download_asset, asset, dest_dir): asset["name"] for asset in assets}
+            digests = {}
+            for future in futures.as_completed(pending):
+                digests[pending[future]] = future.result()
+
+        self.report_progress(force=True)
+        return digests
+
+    def download_asset(self, asset, dest_dir):
+        """Download a single asset, resuming a partial download if there is one.
+
+        :param asset: dictionary giving the name, url, and optionally the size and sha256
+        :param dest_dir: directory the asset is written to
+        :return: SHA-256 hex digest of the asset
+        """
+        path = os.path.join(dest_dir, asset["name"])
+        partial_path = path + PARTIAL_SUFFIX
+        hash = hashlib.new("sha256")
+
+        offset = os.path.getsize(partial_path) if os.path.exists(partial_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+        try:
+            with self.session.get(asset["url"], headers=headers, stream=True, timeout=self.timeout) as response:
+                if offset and response.status_code == 206:
+                    # Resuming, so the part already on disk must be included in the hash
+                    self.hash_partial(partial_path, hash)
+                    self.advance(offset, resumed=True)
+                    mode = "ab"
+                elif response.status_code == 200:
+                    # Not resuming, or the server ignored the range, so start from the beginning
+                    mode = "wb"
+                elif offset and response.status_code == 416 and offset == (asset.get("size") or content_range_size(response)):
+                    # The partial file is already the full size of the asset, so there is nothing
+                    # left to fetch. It is hashed, and checked below like any other download
+                    self.hash_partial(partial_path, hash)
+                    self.advance(offset, resumed=True)
+                    mode = None
+                elif offset and response.status_code == 416:
+                    # The partial file does not match the asset, so discard it for the next attempt
+                    os.remove(partial_path)
+                    raise DownloadError(f"Partial download of {asset['name']} is not valid, please retry")
+                else:
+                    raise DownloadError(f"Unable to download release asset: {asset['name']} (HTTP {response.status_code})")
+
+                if mode:
+                    with open(partial_path, mode) as out_file:
+                        for chunk in response.iter_content(self.chunk_size):
+                            out_file.write(chunk)
+                            hash.update(chunk)
+                            self.advance(len(chunk))
+
+        except requests.RequestException as error:
+            raise DownloadError(f"Unable to download release asset: {asset['name']}: {error}")
+
+        digest = hash.hexdigest()
+        expected = asset.get("sha256")
+
+        if expected and digest != expected:
+            os.remove(partial_path)
+            raise DownloadError(f"Checksum failed for release asset {asset['name']}")
+
+        os.replace(partial_path, path)
+        logging.debug(f"Downloaded {asset['name']} ({digest})")
+
+        return digest
+
+    def hash_partial(self, partial_path, hash):
+        with open(partial_path, "rb") as partial_file:
+            for chunk in iter(lambda: partial_file.read(self.chunk_size), b""):
+                hash.update(chunk)
+
+    def advance(self, count, resumed=False):
+        with self.lock:
+            self.downloaded += count
+            if resumed:
+                self.resumed += count
+        self.report_progress()
+
+    def report_progress(self, force=False):
+        with self.lock:
+            now = time.monotonic()
+            if not force and now - self.last_report_time < self.progress_interval:
+                return
+            self.last_report_time = now
+
+            # Bytes resumed from disk are not counted towards the download rate
+            elapsed = now - self.start_time
+            bytes_per_second = round((self.downloaded - self.resumed) / elapsed) if elapsed > 0 else 0
+            remaining = max(self.total - self.downloaded, 0)
+            eta = round(remaining / bytes_per_second, 1) if bytes_per_second else None
+
+        if self.progress_callback:
+            self.progress_callback(self.downloaded, self.total, bytes_per_second, eta)
+
+class PeerDownloader(AssetDownloader):
+    """
+    Downloader of release assets from peer boards, which serve the assets in their artifact caches.
+
+    Each asset is split into chunks, which are fetched in parallel with HTTP Range requests
+    spread across every peer holding the asset. Each chunk is checked against the SHA-256 the
+    peers list for it, and fetched from another peer if it does not match, then the complete
+    asset is checked against its own SHA-256.
+    """
+
+    def __init__(self, session, peers, progress_callback=None, chunk_size=DEFAULT_PEER_CHUNK_SIZE,
+                 max_workers=4, progress_interval=0.25, timeout=30):
+        """Initialise the PeerDownloader object.
+
+        :param session: requests session the downloads are made with
+        :param peers: base URLs of the peers' artifact endpoints, e.g. http://loki2:8890
+        :param progress_callback: function called with (bytes downloaded, total bytes, bytes per second, ETA in seconds)
+        :param chunk_size: size of each chunk fetched
+        :param max_workers: number of chunks fetched at once
+        :param progress_interval: minimum time in seconds between progress reports
+        :param timeout: connection and read timeout in seconds
+        """
+        super(PeerDownloader, self).__init__(session, progress_callback, chunk_size, max_workers, progress_interval, timeout)
+        self.peers = [peer.rstrip("/") for peer in peers]
+
+    def find_assets(self, owner, repo, tag, expected):
+        """Ask each peer which assets of a release it holds.
+
+        Peers listing an asset with a different SHA-256 to the one expected are not used for it.
+
+        :param owner: owner of the repository
+        :param repo: name of the repository
+        :param tag: release tag
+        :param expected: dictionary of the SHA-256 of each asset wanted, by name
+        :return: list of dictionaries giving the name, size, sha256, chunk hashes and peer URLs
+            of each asset held by at least one peer
+        """
+        found = {}
+
+        for peer in self.peers:
+            try:
+                response = self.session.get(f"{peer}/artifacts/{owner}/{repo}/{tag}", params={"chunk_size": self.chunk_size},
+                                            timeout=self.timeout)
+                if response.status_code != 200:
+                    continue
+                listing = response.json()
+            except (requests.RequestException, ValueError) as error:
+                logging.debug(f"Unable to list release assets held by {peer}: {error}")
+                continue
+
+            for name, sha256 in expected.items():
+                item = listing.get(name)
+                if item and item.get("sha256") != sha256:
+                    logging.error(f"{peer} holds a copy of {name} which does not match the release")
+                elif item and item.get("chunk_size") == self.chunk_size:
+                    version = (item["sha256"], tuple(item["chunks"]))
+                    asset = found.setdefault(name, {}).setdefault(version, dict(item, name=name, urls=[]))
+                    asset["urls"].append(f"{peer}/artifacts/{owner}/{repo}/{tag}/{name}")
+
+        # Where peers list different contents under the same name, those listed by the most peers are used
+        return [max(versions.values(), key=lambda asset: len(asset["urls"])) for versions in found.values()]
+
+    def download_assets(self, assets, dest_dir):
+        """Download a set of assets from peers into a directory.
+
+        An asset which cannot be fetched from any peer is left out of the result, so it can be
+        downloaded from upstream instead.
+
+        :param assets: list of assets, as returned by find_assets
+        :param dest_dir: directory the assets are written to
+        :return: dictionary of the SHA-256 hex digest of each downloaded asset
+        """
+        self.downloaded = 0
+        self.resumed = 0
+        self.total = sum(asset["size"] for asset in assets)
+        self.start_time = time.monotonic()
+        self.last_report_time = 0
+
+        for asset in assets:
+            with open(os.path.join(dest_dir, asset["name"]) + PARTIAL_SUFFIX, "wb") as partial_file:
+                partial_file.truncate(asset["size"])
+
+        # Chunks of every asset share one pool, so small assets do not leave workers idle
+        with futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = {executor.submit(self.fetch_chunk, asset, index, dest_dir): asset["name"]
+                       for asset in assets for index in range(len(asset["chunks"]))}
+            failed = set()
+            for future in futures.as_completed(pending):
+                try:
+                    future.result()
+                except DownloadError as error:
+                    logging.error(str(error))
+                    failed.add(pending[future])
+
+        digests = {}
+        for asset in assets:
+            partial_path = os.path.join(dest_dir, asset["name"]) + PARTIAL_SUFFIX
+
+            if asset["name"] not in failed:
+                digest = self.file_hash(partial_path)
+                if digest == asset["sha256"]:
+                    os.replace(partial_path, os.path.join(dest_dir, asset["name"]))
+                    digests[asset["name"]] = digest
+                    logging.debug(f"Fetched {asset['name']} ({digest}) from peers")
+                    continue
+
+                logging.error(f"Checksum failed for release asset {asset['name']} fetched from peers")
+
+            os.remove(partial_path)
+
+        self.report_progress(force=True)
+        return digests
+
+    def fetch_chunk(self, asset, index, dest_dir):
+        """Fetch one chunk of an asset, trying each peer holding it in turn until one matches its hash.
+
+        :param asset: asset, as returned by find_assets
+        :param index: index of the chunk
+        :param dest_dir: directory the asset is written to
+        """
+        start = index * self.chunk_size
+        end = min(start + self.chunk_size, asset["size"]) - 1
+
+        # Chunks start on different peers, spreading the load across them
+        first = index % len(asset["urls"])
+        for url in asset["urls"][first:] + asset["urls"][:first]:
+            try:
+                response = self.session.get(url, headers={"Range": f"bytes={start}-{end}"}, timeout=self.timeout)
+            except requests.RequestException as error:
+                logging.debug(f"Unable to fetch chunk {index} of {asset['name']} from {url}: {error}")
+                continue
+
+            if response.status_code != 206 or hashlib.sha256(response.content).hexdigest() != asset["chunks"][index]:
+                logging.error(f"Chunk {index} of {asset['name']} from {url} is not valid (HTTP {response.status_code})")
+                continue
+
+            fd = os.open(os.path.join(dest_dir, asset["name"]) + PARTIAL_SUFFIX, os.O_WRONLY)
+            try:
+                os.pwrite(fd, response.content, start)
+            finally:
+                os.close(fd)
+
+            self.advance(len(response.content))
+            return
+
+        raise DownloadError(f"Unable to fetch chunk {index} of {asset['name']} from any peer")
+
+    def file_hash(self, path):
+        hash = hashlib.new("sha256")
+        with open(path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(DEFAULT_CHUNK_SIZE), b""):
+                hash.update(chunk)
+
+        return hash.hexdigest()
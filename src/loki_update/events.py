@@ -0,0 +1,242 @@
+import time
+import json
+import logging
+import threading
+
+import tornado.gen
+import tornado.web
+import tornado.locks
+import tornado.ioloop
+import tornado.iostream
+
+# Parameter tree subtrees published on the event stream. The server uptime is left out, as
+# it changes continuously
+PUBLISHED_PATHS = ["copy_progress", "installed_images", "jobs", "github_repos", "reboot_board"]
+
+# Shortest interval in seconds between updates sent to a single client
+DEFAULT_CLIENT_INTERVAL = 0.25
+
+def tree_delta(old, new):
+    """Get the parts of a parameter tree which have changed.
+
+    :param old: previous state of the tree
+    :param new: current state of the tree
+    :return: nested dictionary of the changed values, with None for removed keys
+    """
+    delta = {}
+
+    for key, value in new.items():
+        if key not in old:
+            delta[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            changes = tree_delta(old[key], value)
+            if changes:
+                delta[key] = changes
+        elif value != old[key]:
+            delta[key] = value
+
+    for key in old:
+        if key not in new:
+            delta[key] = None
+
+    return delta
+
+def merge_delta(pending, delta):
+    """Merge a delta into one not yet sent, so a client receives only the latest values.
+
+    :param pending: delta waiting to be sent, updated in place
+    :param delta: newer delta
+    """
+    for key, value in delta.items():
+        if isinstance(value, dict) and isinstance(pending.get(key), dict):
+            merge_delta(pending[key], value)
+        else:
+            pending[key] = value
+
+class EventClient():
+    """
+    Subscriber to the event stream, holding the changes not yet sent to it
+    """
+
+    def __init__(self, min_interval):
+        self.min_interval = min_interval
+        self.pending = {}
+        self.changed = tornado.locks.Event()
+        self.last_sent = 0
+
+    def add_delta(self, delta):
+        merge_delta(self.pending, delta)
+        self.changed.set()
+
+    async def next_delta(self):
+        """Wait for the next update, coalescing changes made within the client interval.
+
+        :return: merged delta of every change since the previous update
+        """
+        await self.changed.wait()
+
+        wait_time = self.last_sent + self.min_interval - time.monotonic()
+        if wait_time > 0:
+            await tornado.gen.sleep(wait_time)
+
+        delta = self.pending
+        self.pending = {}
+        self.changed.clear()
+        self.last_sent = time.monotonic()
+
+        return delta
+
+class EventPublisher():
+    """
+    Single change feed of the parameter tree, shared by every event stream client.
+
+    Nothing is polled. The controller bumps the snapshot of each subtree as it changes it,
+    and the publisher re-reads only the bumped subtrees on the IOLoop, passing the values
+    which have changed on to the clients. Changes made while there are no clients are ignored.
+    """
+
+    def __init__(self, controller, paths=PUBLISHED_PATHS):
+        """Initialise the EventPublisher object and listen for changes to the tree.
+
+        :param controller: LokiUpdateController whose parameter tree is published
+        :param paths: parameter tree subtrees to publish
+        """
+        self.controller = controller
+        self.paths = paths
+        self.clients = set()
+        self.state = {}
+        self.version = 0
+        self.io_loop = None
+        self.changed_paths = set()
+        self.lock = threading.Lock()
+
+        controller.snapshots.add_listener(self.notify)
+
+    def get_state(self, paths):
+        state = {}
+        for path in paths:
+            state.update(self.controller.get(path))
+
+        return state
+
+    def notify(self, subtree):
+        """Schedule a subtree to be published, called from any thread when it changes.
+
+        :param subtree: name of the top-level subtree which has changed
+        """
+        if subtree not in self.paths:
+            return
+
+        with self.lock:
+            if not self.io_loop:
+                return
+            scheduled = bool(self.changed_paths)
+            self.changed_paths.add(subtree)
+
+        # Changes made before the IOLoop gets to the callback are published together
+        if not scheduled:
+            self.io_loop.add_callback(self.publish)
+
+    def publish(self):
+        with self.lock:
+            changed = self.changed_paths
+            self.changed_paths = set()
+
+        if not self.clients:
+            return
+
+        try:
+            state = dict(self.state, **self.get_state([path for path in self.paths if path in changed]))
+        except Exception as error:
+            logging.error(f"Unable to read parameter tree for event stream: {error}")
+            return
+
+        delta = tree_delta(self.state, state)
+        self.state = state
+
+        if delta:
+            self.version += 1
+            for client in self.clients:
+                client.add_delta(delta)
+
+    def subscribe(self, min_interval=DEFAULT_CLIENT_INTERVAL):
+        """Add a client to the feed, called on the IOLoop.
+
+        :param min_interval: shortest interval in seconds between updates sent to the client
+        :return: the new EventClient
+        """
+        if not self.clients:
+            with self.lock:
+                self.io_loop = tornado.ioloop.IOLoop.current()
+            self.state = self.get_state(self.paths)
+
+        client = EventClient(min_interval)
+        self.clients.add(client)
+
+        return client
+
+    def unsubscribe(self, client):
+        self.clients.discard(client)
+
+        if not self.clients:
+            self.stop()
+
+    def stop(self):
+        self.clients.clear()
+        with self.lock:
+            self.io_loop = None
+            self.changed_paths = set()
+
+class EventStreamHandler(tornado.web.RequestHandler):
+    """
+    Request handler streaming parameter tree changes to a client as Server-Sent Events.
+
+    A "snapshot" event carrying the published subtrees is sent first, followed by "delta"
+    events carrying only the values which have changed. The interval query argument sets
+    the shortest time in seconds between updates, which cannot be below the default.
+    """
+
+    client = None
+    closed = False
+
+    def initialize(self, events, enable_cors=False):
+        self.events = events
+        self.enable_cors = enable_cors
+
+    async def send_event(self, event, data):
+        self.write(f"event: {event}\nid: {self.events.version}\ndata: {json.dumps(data)}\n\n")
+        await self.flush()
+
+    async def get(self):
+        if self.enable_cors:
+            self.set_header("Access-Control-Allow-Origin", "*")
+        self.set_header("Content-Type", "text/event-stream")
+        self.set_header("Cache-Control", "no-cache")
+
+        try:
+            min_interval = max(float(self.get_query_argument("interval", DEFAULT_CLIENT_INTERVAL)), DEFAULT_CLIENT_INTERVAL)
+        except ValueError:
+            min_interval = DEFAULT_CLIENT_INTERVAL
+
+        self.client = self.events.subscribe(min_interval)
+
+        try:
+            await self.send_event("snapshot", self.events.state)
+
+            while not self.closed:
+                delta = await self.client.next_delta()
+                if delta and not self.closed:
+                    await self.send_event("delta", delta)
+
+        except tornado.iostream.StreamClosedError:
+            pass
+
+        finally:
+            logging.debug("Event stream client disconnected")
+            self.events.unsubscribe(self.client)
+
+    def on_connection_close(self):
+        # Wake the stream so that it notices the connection has gone
+        self.closed = True
+        if self.client:
+            self.client.changed.set()
@@ -0,0 +1,376 @@
+import os
+import mmap
+import struct
+
+FDT_MAGIC = 0xd00dfeed
+FDT_HEADER_SIZE = 40
+
+FDT_BEGIN_NODE = 0x1
+FDT_END_NODE = 0x2
+FDT_PROP = 0x3
+FDT_NOP = 0x4
+FDT_END = 0x9
+
+LOKI_METADATA_NODE = "/loki-metadata"
+LOKI_METADATA_PROPERTIES = ["application-name", "application-version", "loki-version", "platform"]
+
+# Devicetree the running kernel was booted with, one directory per node and one file per property
+LIVE_DEVICETREE_PATH = "/sys/firmware/devicetree/base"
+
+class FdtError(Exception):
+    """
+    Simple exception class for errors raised while parsing flattened device trees
+    """
+
+    pass
+
+class BufferSource():
+    """
+    Byte source backed by an in-memory buffer, such as bytes or a memory-mapped file
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+
+    def read(self, offset, size):
+        if offset < 0 or offset + size > len(self.buffer):
+            raise FdtError(f"Read of {size} bytes at offset {offset} is outside the image")
+
+        return self.buffer[offset:offset + size]
+
+class FileSource():
+    """
+    Byte source that reads a file or device in bounded, block-aligned chunks.
+
+    Only the blocks touched by the parser are read, and each is read at most once, so the
+    cost of reading metadata from a device such as an MTD partition is proportional to the
+    size of the metadata rather than the size of the partition.
+    """
+
+    def __init__(self, file, block_size=4096):
+        """Initialise the FileSource object.
+
+        :param file: open binary file object to read from
+        :param block_size: size of each read from the file
+        """
+        self.fd = file.fileno()
+        self.block_size = block_size
+        self.blocks = {}
+        self.bytes_read = 0
+
+    def read(self, offset, size):
+        if size == 0:
+            return b""
+
+        first_block = offset // self.block_size
+        last_block = (offset + size - 1) // self.block_size
+        data = b"".join(self.read_block(index) for index in range(first_block, last_block + 1))
+
+        start = offset - first_block * self.block_size
+        result = data[start:start + size]
+
+        if offset < 0 or len(result) != size:
+            raise FdtError(f"Read of {size} bytes at offset {offset} is outside the image")
+
+        return result
+
+    def read_block(self, index):
+        if index not in self.blocks:
+            block = os.pread(self.fd, self.block_size, index * self.block_size)
+            self.bytes_read += len(block)
+            self.blocks[index] = block
+
+        return self.blocks[index]
+
+class FlatDeviceTree():
+    """
+    Reader for a flattened device tree blob.
+
+    The structure block is walked once on construction, recording the location of every
+    property value rather than the value itself, so large embedded properties (such as the
+    kernel data in a FIT image) are never read unless they are asked for.
+    """
+
+    def __init__(self, source, base=0):
+        """Parse the header and structure block of a flattened device tree.
+
+        :param source: byte source providing read(offset, size)
+        :param base: offset of the start of the device tree within the source
+        """
+        self.source = source
+        self.base = base
+
+        (magic, self.total_size, self.struct_offset, self.strings_offset, _, self.version,
+         _, _, self.strings_size, self.struct_size) = struct.unpack(">10I", source.read(base, FDT_HEADER_SIZE))
+
+        if magic != FDT_MAGIC:
+            raise FdtError(f"Bad device tree magic number: {magic:#x}")
+
+        self.strings = bytes(source.read(base + self.strings_offset, self.strings_size))
+        self.nodes = {}
+        self.walk()
+
+    def walk(self):
+        """Walk the structure block, recording the properties of every node.
+
+        Nodes are stored in the order they appear, keyed on their full path, with each
+        property mapped to the absolute offset and length of its value.
+        """
+        offset = self.base + self.struct_offset
+        end = offset + self.struct_size
+        path = []
+
+        while offset < end:
+            token, = struct.unpack(">I", self.source.read(offset, 4))
+            offset += 4
+
+            if token == FDT_BEGIN_NODE:
+                name = self.read_node_name(offset)
+                offset += (len(name) + 4) & ~3
+                path.append(name.decode("ascii"))
+                self.nodes[self.node_path(path)] = {}
+
+            elif token == FDT_END_NODE:
+                if not path:
+                    raise FdtError("Unbalanced end of node in device tree")
+                path.pop()
+
+            elif token == FDT_PROP:
+                length, name_offset = struct.unpack(">II", self.source.read(offset, 8))
+                offset += 8
+                self.nodes[self.node_path(path)][self.read_string(name_offset)] = (offset, length)
+                offset += (length + 3) & ~3
+
+            elif token == FDT_NOP:
+                continue
+
+            elif token == FDT_END:
+                return
+
+            else:
+                raise FdtError(f"Unknown device tree token {token:#x} at offset {offset - 4}")
+
+        raise FdtError("Device tree structure block is not terminated")
+
+    def node_path(self, path):
+        return "/" + "/".join(path[1:])
+
+    def read_node_name(self, offset):
+        name = b""
+        while True:
+            chunk = bytes(self.source.read(offset + len(name), 4))
+            terminator = chunk.find(b"\0")
+            if terminator != -1:
+                return name + chunk[:terminator]
+            name += chunk
+
+    def read_string(self, offset):
+        end = self.strings.find(b"\0", offset)
+        if end == -1:
+            raise FdtError(f"Unterminated property name at strings offset {offset}")
+
+        return self.strings[offset:end].decode("ascii")
+
+    def has_node(self, path):
+        return path in self.nodes
+
+    def children(self, path):
+        """Get the paths of the direct children of a node, in the order they appear.
+
+        :param path: full path of the parent node
+        """
+        prefix = path.rstrip("/") + "/"
+        return [node for node in self.nodes if node.startswith(prefix) and node[len(prefix):] and "/" not in node[len(prefix):]]
+
+    def get_property_location(self, path, name):
+        return self.nodes.get(path, {}).get(name)
+
+    def get_property(self, path, name):
+        location = self.get_property_location(path, name)
+        if location is None:
+            return None
+
+        offset, length = location
+        return bytes(self.source.read(offset, length))
+
+    def get_string(self, path, name):
+        value = self.get_property(path, name)
+        if value is None:
+            return None
+
+        return value.split(b"\0")[0].decode("utf-8", errors="replace").strip()
+
+    def get_u32(self, path, name):
+        value = self.get_property(path, name)
+        if value is None or len(value) < 4:
+            return None
+
+        return struct.unpack(">I", value[:4])[0]
+
+def find_embedded_dtb(fit):
+    """Find the location of the device tree sub-image within a FIT image.
+
+    The first image with a type of flat_dt is used, falling back to the image at position 1
+    (the image dumpimage -p 1 would have extracted). Both embedded data and external data
+    (data-offset/data-position) are supported.
+
+    :param fit: FlatDeviceTree of the FIT image
+    :return: absolute offset of the device tree sub-image within the source
+    """
+    images = fit.children("/images")
+
+    candidates = [image for image in images if fit.get_string(image, "type") == "flat_dt"]
+    if not candidates and len(images) > 1:
+        candidates = [images[1]]
+
+    if not candidates:
+        raise FdtError("No device tree image found in FIT image")
+
+    image = candidates[0]
+
+    location = fit.get_property_location(image, "data")
+    if location is not None:
+        return location[0]
+
+    position = fit.get_u32(image, "data-position")
+    if position is not None:
+        return fit.base + position
+
+    data_offset = fit.get_u32(image, "data-offset")
+    if data_offset is not None:
+        return fit.base + ((fit.total_size + 3) & ~3) + data_offset
+
+    raise FdtError(f"Device tree image {image} has no data")
+
+def read_loki_metadata(source):
+    """Read the LOKI metadata and build timestamp from a FIT image.
+
+    The metadata is taken from the top level of the image if present, otherwise from the
+    device tree sub-image embedded within it.
+
+    :param source: byte source containing the FIT image
+    :return: dictionary of the metadata properties, plus the root timestamp
+    """
+    fit = FlatDeviceTree(source)
+
+    if fit.has_node(LOKI_METADATA_NODE):
+        metadata_fdt = fit
+    else:
+        metadata_fdt = FlatDeviceTree(source, find_embedded_dtb(fit))
+        if not metadata_fdt.has_node(LOKI_METADATA_NODE):
+            raise FdtError(f"No {LOKI_METADATA_NODE} node found in image")
+
+    metadata = {name: metadata_fdt.get_string(LOKI_METADATA_NODE, name) or "" for name in LOKI_METADATA_PROPERTIES}
+
+    timestamp = fit.get_u32("/", "timestamp")
+    metadata["timestamp"] = "" if timestamp is None else str(timestamp)
+
+    return metadata
+
+def read_image_metadata(path):
+    """Read the LOKI metadata from a FIT image file.
+
+    The file is memory-mapped so only the pages holding the device tree structure and the
+    metadata are read from disk.
+
+    :param path: path of the FIT image file
+    """
+    with open(path, "rb") as image_file:
+        with mmap.mmap(image_file.fileno(), 0, access=mmap.ACCESS_READ) as image_map:
+            return read_loki_metadata(BufferSource(image_map))
+
+def read_device_metadata(path):
+    """Read the LOKI metadata from a FIT image stored on a device that cannot be mapped.
+
+    Only the device tree header, structure and strings blocks, and the embedded device tree
+    sub-image are read, using bounded reads at their offsets.
+
+    :param path: path of the device, such as an MTD character device
+    :return: tuple of the metadata dictionary and the number of bytes read from the device
+    """
+    with open(path, "rb", buffering=0) as device_file:
+        source = FileSource(device_file)
+        return read_loki_metadata(source), source.bytes_read
+
+def decode_property(data):
+    """Decode a raw devicetree property value, as dtc does when decompiling.
+
+    Values made up of printable, NUL-terminated strings are decoded as a string, or a list of
+    strings. Otherwise a 4-byte value is decoded as a u32, an 8-byte value as a u64, and any
+    other multiple of 4 bytes as a list of u32 cells. Empty properties are flags, decoded as
+    True, and anything else is returned as a hex string.
+
+    :param data: raw property value
+    """
+    if not data:
+        return True
+
+    if data.endswith(b"\0"):
+        strings = data[:-1].split(b"\0")
+        if all(string and string.isascii() and string.decode().isprintable() for string in strings):
+            decoded = [string.decode() for string in strings]
+            return decoded[0] if len(decoded) == 1 else decoded
+
+    if len(data) == 4:
+        return struct.unpack(">I", data)[0]
+
+    if len(data) == 8:
+        return struct.unpack(">Q", data)[0]
+
+    if len(data) % 4 == 0:
+        return list(struct.unpack(f">{len(data) // 4}I", data))
+
+    return data.hex()
+
+class LiveDeviceTree():
+    """
+    Reader for the devicetree the running kernel was booted with.
+
+    Every property of a node is read in a single directory scan and decoded. The live
+    devicetree cannot change until the next boot, so each node is only read once.
+    """
+
+    def __init__(self, base_path=LIVE_DEVICETREE_PATH):
+        self.base_path = base_path
+        self.nodes = {}
+
+    def read_node(self, node_path):
+        """Read and decode every property of a node.
+
+        :param node_path: path of the node, such as /loki-metadata
+        :return: dictionary of the decoded properties
+        """
+        if node_path not in self.nodes:
+            properties = {}
+
+            with os.scandir(os.path.join(self.base_path, node_path.strip("/"))) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        with open(entry.path, "rb") as property_file:
+                            properties[entry.name] = decode_property(property_file.read())
+
+            self.nodes[node_path] = properties
+
+        return dict(self.nodes[node_path])
+
+def read_runtime_metadata(tree):
+    """Read the LOKI metadata from the live devicetree.
+
+    The result has the same form as read_image_metadata, so the running image can be compared
+    with an installed one directly. The build timestamp is taken from the metadata node if it
+    has one, otherwise from the root node.
+
+    :param tree: LiveDeviceTree to read from
+    :return: tuple of the metadata dictionary and every property of the metadata node
+    """
+    node = tree.read_node(LOKI_METADATA_NODE)
+
+    metadata = {}
+    for name in LOKI_METADATA_PROPERTIES:
+        value = node.get(name, "")
+        metadata[name] = ", ".join(value) if isinstance(value, list) else str(value)
+
+    timestamp = node["timestamp"] if "timestamp" in node else tree.read_node("/").get("timestamp")
+    metadata["timestamp"] = "" if timestamp is None else str(timestamp)
+
+    return metadata, node
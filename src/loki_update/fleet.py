@@ -0,0 +1,493 @@
+"""Fleet coordinator, for rolling an update out to many LOKI boards.
+
+An update is pushed to each board through the same loki-update adapter endpoints the UI uses:
+the copy target is set, then either the image files are uploaded with their checksums, or the
+board is asked to retrieve a release itself. The board's jobs are polled until the copy has
+finished, the installed version is checked, and the board is optionally rebooted.
+
+Boards are updated in waves, canary boards first, with a limit on how many are updated at
+once. Any failure in the canary wave stops the rollout, as does the failures across the fleet
+exceeding a threshold. Boards that have not been started by then are skipped.
+
+Run with: python -m loki_update.fleet --board URL [--board URL ...] (--files FILE ... | --release REPO:TAG)
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+import argparse
+
+import tornado.httpclient
+
+DEFAULT_ADAPTER = "loki-update"
+API_VERSION = "0.1"
+
+# Devices an update can be copied to, and the job each copy runs as
+COPY_TARGETS = ["emmc", "sd", "flash"]
+
+# Share of a release update's progress given to the download, the rest being the copy
+DOWNLOAD_SHARE = 0.5
+
+class FleetError(Exception):
+    """
+    Simple exception class for errors updating a board
+    """
+
+    pass
+
+class BoardClient():
+    """
+    Client of the loki-update adapter running on one board
+    """
+
+    def __init__(self, url, http_client, adapter=DEFAULT_ADAPTER, request_timeout=60):
+        """Initialise the BoardClient object.
+
+        :param url: base URL of the board's odin-control server, e.g. http://loki1:8888
+        :param http_client: Tornado AsyncHTTPClient the requests are made with
+        :param adapter: name the loki-update adapter is loaded under
+        :param request_timeout: timeout in seconds of each request
+        """
+        self.url = url.rstrip("/")
+        self.api_url = f"{self.url}/api/{API_VERSION}/{adapter}"
+        self.http_client = http_client
+        self.request_timeout = request_timeout
+
+    async def request(self, method, path, body=None, headers=None):
+        url = f"{self.api_url}/{path}" if path else self.api_url
+        headers = dict({"Content-Type": "application/json", "Accept": "application/json"}, **(headers or {}))
+
+        try:
+            response = await self.http_client.fetch(url, method=method, body=body, headers=headers,
+                                                    request_timeout=self.request_timeout)
+        except tornado.httpclient.HTTPClientError as error:
+            message = str(error)
+            if error.response is not None and error.response.body:
+                try:
+                    message = json.loads(error.response.body).get("error", message)
+                except (ValueError, AttributeError):
+                    pass
+            raise FleetError(f"{method} {path or '/'} failed: {message}")
+        except (OSError, asyncio.TimeoutError) as error:
+            raise FleetError(f"{method} {path or '/'} failed: {error}")
+
+        return json.loads(response.body) if response.body else None
+
+    async def get(self, path):
+        """Get the value of a parameter tree path.
+
+        :param path: path to retrieve from the tree
+        """
+        response = await self.request("GET", path)
+        return response[path.rstrip("/").split("/")[-1]]
+
+    async def put(self, path, value):
+        """Set the value of a parameter tree path.
+
+        :param path: path to set
+        :param value: value to set, sent as JSON
+        """
+        await self.request("PUT", path, json.dumps(value))
+
+    async def upload(self, files):
+        """Upload image files, as the UI does, which starts the copy to the target.
+
+        :param files: dictionary of file names and contents
+        """
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, data in files.items():
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{name}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + data + b"\r\n")
+        body = b"".join(parts) + f"--{boundary}--\r\n".encode()
+
+        await self.request("POST", "", body, {"Content-Type": f"multipart/form-data; boundary={boundary}"})
+
+class BoardStatus():
+    """
+    Progress of the update of one board
+    """
+
+    def __init__(self, url):
+        self.url = url
+        self.state = "pending"
+        self.stage = ""
+        self.progress = 0
+        self.installed_version = ""
+        self.error_message = ""
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "stage": self.stage,
+            "progress": self.progress,
+            "installed_version": self.installed_version,
+            "error_message": self.error_message,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+class FleetCoordinator():
+    """
+    Pushes an update to a fleet of boards concurrently, in canary and rolling waves.
+    """
+
+    def __init__(self, boards, target, files=None, release=None, concurrency=4, canary=1, wave_size=0,
+                 max_failures=0.0, reboot=False, expected_version=None, adapter=DEFAULT_ADAPTER,
+                 poll_interval=1.0, timeout=1800, reboot_timeout=600):
+        """Initialise the FleetCoordinator object.
+
+        :param boards: base URLs of the boards' odin-control servers
+        :param target: device the update is copied to (emmc, sd or flash)
+        :param files: dictionary of image file names and contents to upload, if not retrieving a release
+        :param release: dictionary of the repo and tag of the release each board retrieves, if not uploading files
+        :param concurrency: maximum number of boards updated at once
+        :param canary: number of boards updated first, any failure of which stops the rollout
+        :param wave_size: number of boards in each wave after the canaries, or 0 for a single wave
+        :param max_failures: fraction of the fleet which may fail before the rollout is stopped
+        :param reboot: reboot each board once its update is installed
+        :param expected_version: application version the target must report after the update, if checked
+        :param adapter: name the loki-update adapter is loaded under on the boards
+        :param poll_interval: time in seconds between polls of each board
+        :param timeout: time in seconds allowed for the update of each board
+        :param reboot_timeout: time in seconds allowed for a board to come back after a reboot
+        """
+        if target not in COPY_TARGETS:
+            raise FleetError(f"Invalid copy target: {target}")
+        if bool(files) == bool(release):
+            raise FleetError("Either files to upload or a release to retrieve must be given")
+
+        self.boards = boards
+        self.target = target
+        self.files = files
+        self.release = release
+        self.checksums = [{"fileName": name, "checksum": hashlib.sha256(data).hexdigest()} for name, data in (files or {}).items()]
+        self.concurrency = max(1, concurrency)
+        self.canary = canary
+        self.wave_size = wave_size
+        self.max_failures = max_failures
+        self.reboot = reboot
+        self.expected_version = expected_version
+        self.adapter = adapter
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+        self.reboot_timeout = reboot_timeout
+
+        self.status = {url: BoardStatus(url) for url in boards}
+        self.waves = self.plan_waves()
+        self.wave = 0
+        self.aborted = False
+        self.abort_reason = ""
+
+    def plan_waves(self):
+        canaries = self.boards[:self.canary]
+        rest = self.boards[self.canary:]
+        wave_size = self.wave_size or len(rest)
+
+        return ([canaries] if canaries else []) + [rest[i:i + wave_size] for i in range(0, len(rest), wave_size)]
+
+    def count(self, state):
+        return sum(1 for status in self.status.values() if status.state == state)
+
+    def get_progress(self):
+        """Get the progress of the rollout, aggregated across the fleet."""
+        return {
+            "boards": {url: status.to_dict() for url, status in self.status.items()},
+            "total": len(self.boards),
+            "pending": self.count("pending"),
+            "running": self.count("running"),
+            "succeeded": self.count("succeeded"),
+            "failed": self.count("failed"),
+            "skipped": self.count("skipped"),
+            "progress": round(sum(status.progress for status in self.status.values()) / len(self.boards), 1) if self.boards else 100,
+            "wave": self.wave,
+            "waves": len(self.waves),
+            "aborted": self.aborted,
+            "abort_reason": self.abort_reason
+        }
+
+    async def run(self):
+        """Roll the update out across the fleet.
+
+        :return: True if every board was updated
+        """
+        http_client = tornado.httpclient.AsyncHTTPClient(force_instance=True, max_clients=max(10, self.concurrency * 2))
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        try:
+            for index, wave in enumerate(self.waves):
+                self.wave = index + 1
+                is_canary = index == 0 and self.canary > 0
+                logging.info(f"Starting wave {self.wave} of {len(self.waves)}{' (canary)' if is_canary else ''}: {len(wave)} boards")
+
+                await asyncio.gather(*[self.run_board(url, http_client, semaphore, is_canary) for url in wave])
+
+                if self.aborted:
+                    break
+        finally:
+            http_client.close()
+
+        for status in self.status.values():
+            if status.state == "pending":
+                status.state = "skipped"
+
+        return self.count("succeeded") == len(self.boards)
+
+    async def run_board(self, url, http_client, semaphore, is_canary):
+        async with semaphore:
+            if self.aborted:
+                return
+
+            status = self.status[url]
+            status.state = "running"
+            status.started = time.time()
+
+            try:
+                await asyncio.wait_for(self.update_board(BoardClient(url, http_client, self.adapter), status), self.timeout)
+                status.state = "succeeded"
+                status.progress = 100
+                logging.info(f"{url}: updated")
+
+            except (FleetError, asyncio.TimeoutError) as error:
+                status.state = "failed"
+                status.error_message = str(error) or f"Update timed out after {self.timeout}s"
+                logging.error(f"{url}: update failed during {status.stage}: {status.error_message}")
+                self.check_failures(is_canary)
+
+            finally:
+                status.finished = time.time()
+
+    def check_failures(self, is_canary):
+        allowed = int(self.max_failures * len(self.boards))
+
+        if is_canary:
+            self.abort("a canary board failed")
+        elif self.count("failed") > allowed:
+            self.abort(f"{self.count('failed')} boards failed, more than the {allowed} allowed")
+
+    def abort(self, reason):
+        if not self.aborted:
+            self.aborted = True
+            self.abort_reason = reason
+            logging.error(f"Stopping the rollout: {reason}")
+
+    async def update_board(self, client, status):
+        """Update one board, returning once the update is installed and checked.
+
+        :param client: BoardClient of the board
+        :param status: BoardStatus the progress is reported to
+        """
+        status.stage = "check"
+        restrictions = await client.get("restrictions")
+        if self.target != "emmc" and restrictions["allow_only_emmc_upload"]:
+            raise FleetError("Board only allows updates to the eMMC")
+        if self.release and not restrictions["allow_images_from_repo"]:
+            raise FleetError("Board does not allow images from repositories")
+        if self.reboot and not restrictions["allow_reboot"]:
+            raise FleetError("Board does not allow rebooting")
+
+        copy_progress = await client.get("copy_progress")
+        if copy_progress["copying"] or copy_progress["flash_copying"] or await client.get("github_repos/downloading"):
+            raise FleetError("Board is busy with another copy")
+
+        # Only jobs started after this point belong to this update
+        first_job = max((int(job_id) for job_id in await client.get("jobs")), default=0) + 1
+
+        await client.put("copy_progress/target", self.target)
+
+        if self.files:
+            status.stage = "upload"
+            await client.put("copy_progress/checksums", self.checksums)
+            await client.upload(self.files)
+        else:
+            status.stage = "download"
+            await client.put("github_repos/release_to_retrieve", self.release)
+
+        await self.wait_for_copy(client, status, first_job)
+
+        status.stage = "verify"
+        await self.wait_until(client, f"installed_images/ready/{self.target}", lambda ready: ready, self.timeout)
+        info = await client.get(f"installed_images/{self.target}/info")
+        status.installed_version = info["app_version"]
+        if info["error_occurred"]:
+            raise FleetError(f"Unable to read the installed image: {info['error_message']}")
+        if self.expected_version and info["app_version"] != self.expected_version:
+            raise FleetError(f"Installed version is {info['app_version']}, expected {self.expected_version}")
+
+        if self.reboot:
+            await self.reboot_board(client, status)
+
+    async def wait_for_copy(self, client, status, first_job):
+        """Poll the board's jobs until the copy of this update has finished.
+
+        :param client: BoardClient of the board
+        :param status: BoardStatus the progress is reported to
+        :param first_job: ID of the first job started by this update
+        """
+        copy_name = f"copy_to_{self.target}"
+
+        while True:
+            jobs = {job_id: job for job_id, job in (await client.get("jobs")).items() if int(job_id) >= first_job}
+            download = next((job for job in jobs.values() if job["name"] == "download_release"), None)
+            copy = next((job for job in jobs.values() if job["name"] == copy_name), None)
+
+            if download and download["status"] == "failed":
+                raise FleetError(f"Download failed: {download['error_message']}")
+
+            if copy:
+                status.stage = "copy"
+                if copy["status"] == "failed" or copy["error_message"]:
+                    raise FleetError(f"Copy failed: {copy['error_message']}")
+                if copy["status"] == "complete":
+                    return
+
+            if self.release:
+                download_progress = 100 if copy else (download["progress"] if download else 0)
+                copy_progress = copy["progress"] if copy else 0
+                status.progress = round(DOWNLOAD_SHARE * download_progress + (1 - DOWNLOAD_SHARE) * copy_progress, 1)
+            elif copy:
+                status.progress = copy["progress"]
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def wait_until(self, client, path, condition, timeout):
+        """Poll a parameter tree path until its value meets a condition.
+
+        Requests which fail, as they do while a board reboots, are retried.
+
+        :param client: BoardClient of the board
+        :param path: path to poll
+        :param condition: function called with the value, returning True once it is met
+        :param timeout: time in seconds to wait
+        :return: the value which met the condition
+        """
+        deadline = time.monotonic() + timeout
+
+        while True:
+            try:
+                value = await client.get(path)
+                if condition(value):
+                    return value
+            except FleetError as error:
+                logging.debug(f"{client.url}: {error}")
+
+            if time.monotonic() > deadline:
+                raise FleetError(f"Timed out waiting for {path}")
+
+            await asyncio.sleep(self.poll_interval)
+
+    async def reboot_board(self, client, status):
+        """Reboot a board once its filesystems are synced, and wait for it to come back.
+
+        :param client: BoardClient of the board
+        :param status: BoardStatus the progress is reported to
+        """
+        status.stage = "sync"
+        await client.put("copy_progress/sync/sync_now", True)
+        await self.wait_until(client, "copy_progress/mmc_synced", lambda synced: synced, self.timeout)
+
+        status.stage = "reboot"
+        reboot_time = time.monotonic()
+        try:
+            await client.put("reboot_board/reboot", True)
+        except FleetError as error:
+            # The connection may drop as the board goes down
+            logging.debug(f"{client.url}: {error}")
+
+        # The board is back once the server uptime has restarted since the reboot was requested
+        await self.wait_until(client, "server_uptime", lambda uptime: uptime < time.monotonic() - reboot_time,
+                              self.reboot_timeout)
+
+def format_progress(progress):
+    return (f"wave {progress['wave']}/{progress['waves']} {progress['progress']:5.1f}% - "
+            f"{progress['succeeded']} succeeded, {progress['failed']} failed, {progress['running']} running, "
+            f"{progress['pending']} pending")
+
+async def report_progress(coordinator, interval):
+    while True:
+        await asyncio.sleep(interval)
+        print(format_progress(coordinator.get_progress()), flush=True)
+
+async def run_coordinator(coordinator, report_interval):
+    reporter = asyncio.ensure_future(report_progress(coordinator, report_interval))
+    try:
+        return await coordinator.run()
+    finally:
+        reporter.cancel()
+
+def read_boards(args):
+    boards = list(args.board or [])
+
+    if args.boards_file:
+        with open(args.boards_file, "r") as boards_file:
+            boards += [line.strip() for line in boards_file if line.strip() and not line.startswith("#")]
+
+    return boards
+
+def main():
+    parser = argparse.ArgumentParser(description="Roll an update out to a fleet of LOKI boards")
+    parser.add_argument("--board", action="append", metavar="URL", help="base URL of a board's odin-control server, may be repeated")
+    parser.add_argument("--boards-file", metavar="PATH", help="file listing the base URL of a board on each line")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--files", nargs="+", metavar="FILE", help="image files to upload to each board")
+    source.add_argument("--release", metavar="REPO:TAG", help="release each board retrieves from its configured repository")
+    parser.add_argument("--target", choices=COPY_TARGETS, default="emmc", help="device the update is copied to")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of boards updated at once")
+    parser.add_argument("--canary", type=int, default=1, help="number of boards updated first, whose failure stops the rollout")
+    parser.add_argument("--wave-size", type=int, default=0, help="number of boards in each wave after the canaries, 0 for one wave")
+    parser.add_argument("--max-failures", type=float, default=0.0, help="fraction of the fleet which may fail before the rollout stops")
+    parser.add_argument("--expect-version", help="application version the target must report after the update")
+    parser.add_argument("--reboot", action="store_true", help="reboot each board once the update is installed")
+    parser.add_argument("--adapter", default=DEFAULT_ADAPTER, help="name the loki-update adapter is loaded under")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="time in seconds between polls of each board")
+    parser.add_argument("--timeout", type=float, default=1800, help="time in seconds allowed for the update of each board")
+    parser.add_argument("--verbose", action="store_true", help="log each board's progress")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO if args.verbose else logging.WARNING, format="%(asctime)s %(levelname)s %(message)s")
+
+    boards = read_boards(args)
+    if not boards:
+        parser.error("no boards given")
+
+    files = None
+    release = None
+    if args.files:
+        files = {}
+        for path in args.files:
+            with open(path, "rb") as in_file:
+                files[os.path.basename(path)] = in_file.read()
+    else:
+        repo, _, tag = args.release.partition(":")
+        if not tag:
+            parser.error("--release must be given as REPO:TAG")
+        release = {"repo": repo, "tag": tag}
+
+    try:
+        coordinator = FleetCoordinator(boards, args.target, files, release, args.concurrency, args.canary, args.wave_size,
+                                       args.max_failures, args.reboot, args.expect_version, args.adapter, args.poll_interval,
+                                       args.timeout)
+    except FleetError as error:
+        parser.error(str(error))
+
+    success = asyncio.run(run_coordinator(coordinator, max(args.poll_interval, 2.0)))
+
+    progress = coordinator.get_progress()
+    print(format_progress(progress))
+    for url, status in progress["boards"].items():
+        detail = status["error_message"] or status["installed_version"]
+        print(f"{url}: {status['state']}" + (f" ({detail})" if detail else ""))
+    if progress["aborted"]:
+        print(f"Rollout stopped: {progress['abort_reason']}")
+
+    return 0 if success else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,163 @@
+import time
+import logging
+import threading
+from concurrent import futures
+from collections import OrderedDict
+
+class Job():
+    """
+    Background operation run by the JobScheduler, with its own progress and result
+    """
+
+    def __init__(self, job_id, name, devices, writes):
+        self.job_id = job_id
+        self.name = name
+        self.devices = devices
+        self.writes = writes
+        self.status = "queued"
+        self.file_name = ""
+        self.stage = ""
+        self.progress = 0
+        self.throughput = 0
+        self.error_message = ""
+        self.result = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "devices": self.devices,
+            "writes": self.writes,
+            "status": self.status,
+            "file_name": self.file_name,
+            "stage": self.stage,
+            "progress": self.progress,
+            "throughput": self.throughput,
+            "error_message": self.error_message,
+            "result": self.result,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished
+        }
+
+class JobScheduler():
+    """
+    Runs background operations on a worker pool, serialising operations on the same device.
+
+    Each job names the devices it reads or writes. Jobs sharing a device run one at a time, in
+    the order they were submitted, while jobs on independent devices, such as an SD deploy and
+    an eMMC backup, run concurrently. A job is only handed to the pool once its devices are
+    free, so jobs waiting for a device never hold a worker.
+    """
+
+    def __init__(self, max_workers=4, max_history=20, metrics=None, on_change=None):
+        """Initialise the JobScheduler object.
+
+        :param max_workers: number of worker threads
+        :param max_history: number of finished jobs kept for reporting
+        :param metrics: Metrics the duration and failures of each job are recorded in
+        :param on_change: function called with a Job when it is submitted, starts or finishes
+        """
+        self.executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        self.metrics = metrics
+        self.on_change = on_change
+        self.max_history = max_history
+        self.busy_devices = set()
+        self.waiting = []
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.next_id = 1
+        self.stopped = False
+
+    def submit(self, name, devices, function, *args, writes=None):
+        """Submit a job to run in the background.
+
+        :param name: name describing the operation
+        :param devices: names of the devices the operation uses
+        :param function: function to run, called with the Job followed by args. Its return
+            value, if not None, becomes the result of the job
+        :param writes: names of the devices the operation writes to, all of them if not given
+        :return: the submitted Job
+        """
+        with self.lock:
+            job = Job(str(self.next_id), name, sorted(devices), sorted(devices if writes is None else writes))
+            self.next_id += 1
+            self.jobs[job.job_id] = job
+            self.prune()
+
+            self.waiting.append((job, function, args))
+            self.dispatch()
+
+        self.changed(job)
+        return job
+
+    def dispatch(self):
+        """Start each waiting job whose devices are free, called with the lock held."""
+        if self.stopped:
+            return
+
+        # Devices wanted by a job still waiting are held back for it, so that jobs on the same
+        # device keep their order
+        claimed = set(self.busy_devices)
+        waiting = []
+
+        for job, function, args in self.waiting:
+            if claimed.isdisjoint(job.devices):
+                self.busy_devices.update(job.devices)
+                self.executor.submit(self.run, job, function, args)
+            else:
+                waiting.append((job, function, args))
+            claimed.update(job.devices)
+
+        self.waiting = waiting
+
+    def run(self, job, function, args):
+        try:
+            job.status = "running"
+            job.started = time.time()
+            self.changed(job)
+            result = function(job, *args)
+            if result is not None:
+                job.result = result
+            job.status = "complete"
+
+        except Exception as error:
+            job.status = "failed"
+            job.error_message = str(error)
+            logging.error(f"Job {job.job_id} ({job.name}) failed: {error}")
+            if self.metrics:
+                self.metrics.increment(f"job_{job.name}_failed")
+
+        finally:
+            job.finished = time.time()
+            if self.metrics:
+                self.metrics.observe(f"job_{job.name}", job.finished - job.started)
+            with self.lock:
+                self.busy_devices.difference_update(job.devices)
+                self.dispatch()
+            self.changed(job)
+
+    def changed(self, job):
+        if self.on_change:
+            try:
+                self.on_change(job)
+            except Exception as error:
+                logging.error(f"Error handling change to job {job.job_id} ({job.name}): {error}")
+
+    def prune(self):
+        finished = [job_id for job_id, job in self.jobs.items() if job.status in ("complete", "failed")]
+        for job_id in finished[:max(0, len(self.jobs) - self.max_history)]:
+            del self.jobs[job_id]
+
+    def is_writing(self, device):
+        return any(job.status in ("queued", "running") and device in job.writes for job in list(self.jobs.values()))
+
+    def get_jobs(self):
+        return {job_id: job.to_dict() for job_id, job in list(self.jobs.items())}
+
+    def shutdown(self):
+        with self.lock:
+            self.stopped = True
+        self.executor.shutdown(wait=False)
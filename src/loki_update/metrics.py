@@ -0,0 +1,151 @@
+import bisect
+import threading
+
+# Upper bounds in seconds of the operation timing histogram buckets
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900)
+
+METRIC_PREFIX = "loki_update"
+
+class Histogram():
+    """
+    Timing histogram with fixed buckets, allocated once so recording a sample is cheap
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def to_dict(self):
+        cumulative = 0
+        buckets = {}
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            buckets[str(bound)] = cumulative
+
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "mean": round(self.sum / self.count, 6) if self.count else 0,
+            "buckets": buckets
+        }
+
+class DeviceTransfer():
+    """
+    Bytes moved to or from a device, with the throughput of the most recent transfer
+    """
+
+    def __init__(self):
+        self.bytes = 0
+        self.transfers = 0
+        self.throughput = 0.0
+
+    def record(self, count, duration):
+        self.bytes += count
+        self.transfers += 1
+        if duration > 0:
+            self.throughput = count / duration
+
+    def to_dict(self):
+        return {"bytes": self.bytes, "transfers": self.transfers, "throughput": round(self.throughput)}
+
+class Metrics():
+    """
+    Timing histograms, counters and per-device transfer totals for the controller operations.
+
+    Each histogram and counter is created the first time its name is recorded, after which
+    recording only updates preallocated values, so instrumentation can stay on in production.
+    Operations are recorded from executor threads, so every update and read holds the lock.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.operations = {}
+        self.counters = {}
+        self.devices = {}
+        self.lock = threading.Lock()
+
+    def observe(self, operation, duration):
+        """Record the duration of an operation.
+
+        :param operation: name of the operation
+        :param duration: duration in seconds
+        """
+        with self.lock:
+            histogram = self.operations.get(operation)
+            if histogram is None:
+                histogram = self.operations[operation] = Histogram(self.buckets)
+            histogram.observe(duration)
+
+    def increment(self, counter, count=1):
+        with self.lock:
+            self.counters[counter] = self.counters.get(counter, 0) + count
+
+    def record_transfer(self, device, count, duration):
+        """Record bytes moved to or from a device.
+
+        :param device: name of the device
+        :param count: number of bytes moved
+        :param duration: time taken in seconds
+        """
+        with self.lock:
+            transfer = self.devices.get(device)
+            if transfer is None:
+                transfer = self.devices[device] = DeviceTransfer()
+            transfer.record(count, duration)
+
+    def to_dict(self):
+        with self.lock:
+            return {
+                "operations": {name: histogram.to_dict() for name, histogram in self.operations.items()},
+                "counters": dict(self.counters),
+                "devices": {name: transfer.to_dict() for name, transfer in self.devices.items()}
+            }
+
+    def to_prometheus(self):
+        """Format the metrics in the Prometheus text exposition format."""
+        with self.lock:
+            return self.format_prometheus()
+
+    def format_prometheus(self):
+        lines = [
+            f"# HELP {METRIC_PREFIX}_operation_seconds Duration of controller operations",
+            f"# TYPE {METRIC_PREFIX}_operation_seconds histogram"
+        ]
+        for name, histogram in sorted(self.operations.items()):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{METRIC_PREFIX}_operation_seconds_bucket{{operation="{name}",le="{bound}"}} {cumulative}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_bucket{{operation="{name}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_sum{{operation="{name}"}} {histogram.sum}')
+            lines.append(f'{METRIC_PREFIX}_operation_seconds_count{{operation="{name}"}} {histogram.count}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_events_total Count of controller events",
+            f"# TYPE {METRIC_PREFIX}_events_total counter"
+        ]
+        for name, count in sorted(self.counters.items()):
+            lines.append(f'{METRIC_PREFIX}_events_total{{event="{name}"}} {count}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_device_bytes_total Bytes moved to or from each device",
+            f"# TYPE {METRIC_PREFIX}_device_bytes_total counter"
+        ]
+        for name, transfer in sorted(self.devices.items()):
+            lines.append(f'{METRIC_PREFIX}_device_bytes_total{{device="{name}"}} {transfer.bytes}')
+
+        lines += [
+            f"# HELP {METRIC_PREFIX}_device_throughput_bytes Throughput of the most recent transfer to or from each device, in bytes per second",
+            f"# TYPE {METRIC_PREFIX}_device_throughput_bytes gauge"
+        ]
+        for name, transfer in sorted(self.devices.items()):
+            lines.append(f'{METRIC_PREFIX}_device_throughput_bytes{{device="{name}"}} {transfer.throughput}')
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,306 @@
+import os
+import re
+import time
+import logging
+import threading
+import errno
+import fcntl
+import struct
+
+# struct mtd_info_user and struct erase_info_user from <mtd/mtd-abi.h>
+MTD_INFO_FORMAT = "=B3xIIIIIQ"
+ERASE_INFO_FORMAT = "=II"
+
+# MTD ioctl request codes: _IOR('M', 1, mtd_info_user), _IOW('M', 2/6, erase_info_user)
+MEMGETINFO = 0x80204d01
+MEMERASE = 0x40084d02
+MEMUNLOCK = 0x40084d06
+
+# Sources of the MTD partition table
+PROC_MTD_PATH = "/proc/mtd"
+SYS_CLASS_MTD_PATH = "/sys/class/mtd/"
+
+# Erase block size assumed for file-backed stand-ins, which have no MTD ioctls
+DEFAULT_ERASE_SIZE = 64 * 1024
+
+# Stage names matching those printed by flashcp -v
+STAGE_ERASE = "Erasing blocks"
+STAGE_WRITE = "Writing data"
+STAGE_VERIFY = "Verifying data"
+
+class MtdError(Exception):
+    """
+    Simple exception class for errors raised while accessing MTD devices
+    """
+
+    pass
+
+class MtdEraseError(MtdError):
+    pass
+
+class MtdWriteError(MtdError):
+    pass
+
+class MtdVerifyError(MtdError):
+    pass
+
+class MtdRegistry():
+    """
+    Cached table of MTD partitions, mapping each exact label to its device, size and erase size.
+
+    The table is read from /sys/class/mtd, or /proc/mtd if sysfs is unavailable, without
+    spawning any processes. It is read on first use, and only re-read when the set of MTD
+    devices in sysfs changes, as happens on hotplug, or when a rescan is requested.
+    """
+
+    def __init__(self, proc_path=PROC_MTD_PATH, sys_path=SYS_CLASS_MTD_PATH, dev_path="/dev/"):
+        self.proc_path = proc_path
+        self.sys_path = sys_path
+        self.dev_path = dev_path
+        self.partitions = {}
+        self.devices_seen = None
+        self.lock = threading.Lock()
+
+    def list_sys_devices(self):
+        try:
+            return sorted(name for name in os.listdir(self.sys_path) if re.fullmatch(r"mtd\d+", name))
+        except OSError:
+            return []
+
+    def scan(self):
+        """Re-read the MTD partition table."""
+        devices = self.list_sys_devices()
+
+        if devices:
+            partitions = self.scan_sys(devices)
+        else:
+            partitions = self.scan_proc()
+
+        with self.lock:
+            self.partitions = partitions
+            self.devices_seen = devices
+
+        logging.debug(f"MTD partitions: {partitions}")
+
+    def scan_sys(self, devices):
+        partitions = {}
+        for device in devices:
+            try:
+                with open(os.path.join(self.sys_path, device, "name"), "r") as name_file:
+                    label = name_file.read().strip()
+                with open(os.path.join(self.sys_path, device, "size"), "r") as size_file:
+                    size = int(size_file.read())
+                with open(os.path.join(self.sys_path, device, "erasesize"), "r") as erase_size_file:
+                    erase_size = int(erase_size_file.read())
+
+            except (OSError, ValueError) as error:
+                logging.error(f"Unable to read MTD device {device} from sysfs: {error}")
+                continue
+
+            partitions[label] = {"device": self.dev_path + device, "size": size, "erase_size": erase_size}
+
+        return partitions
+
+    def scan_proc(self):
+        partitions = {}
+        try:
+            with open(self.proc_path, "r") as proc_file:
+                lines = proc_file.read().splitlines()
+        except OSError as error:
+            logging.debug(f"Unable to read {self.proc_path}: {error}")
+            return partitions
+
+        for line in lines:
+            match = re.match(r'(mtd\d+):\s+([0-9a-fA-F]+)\s+([0-9a-fA-F]+)\s+"(.*)"', line)
+            if match:
+                device, size, erase_size, label = match.groups()
+                partitions[label] = {"device": self.dev_path + device, "size": int(size, 16), "erase_size": int(erase_size, 16)}
+
+        return partitions
+
+    def check_for_changes(self):
+        if self.list_sys_devices() != self.devices_seen:
+            self.scan()
+
+    def get_partitions(self):
+        self.check_for_changes()
+        with self.lock:
+            return dict(self.partitions)
+
+    def label_to_device(self, label):
+        """Get the device path of the MTD partition with exactly the given label.
+
+        :param label: partition label, such as kernel, boot or bootscr
+        """
+        self.check_for_changes()
+
+        with self.lock:
+            partition = self.partitions.get(label)
+
+        if partition is None:
+            raise MtdError(f"No MTD partition labelled {label}")
+
+        return partition["device"]
+
+class MtdDevice():
+    """
+    MTD character device, or a regular file standing in for one.
+
+    Device geometry comes from the MEMGETINFO ioctl. For a regular file, which does not
+    support the MTD ioctls, the file size and a default erase size are used and erasing is
+    emulated by filling with 0xFF.
+    """
+
+    def __init__(self, path, erase_size=None):
+        """Open the device and read its geometry.
+
+        :param path: path of the MTD character device or file-backed stand-in
+        :param erase_size: erase block size to use for a file-backed stand-in
+        """
+        self.path = path
+        self.fd = os.open(path, os.O_RDWR)
+
+        try:
+            info = fcntl.ioctl(self.fd, MEMGETINFO, bytes(struct.calcsize(MTD_INFO_FORMAT)))
+            _, _, self.size, self.erase_size, self.write_size, _, _ = struct.unpack(MTD_INFO_FORMAT, info)
+            self.is_mtd = True
+
+        except OSError as error:
+            if error.errno not in (errno.ENOTTY, errno.EINVAL):
+                os.close(self.fd)
+                raise MtdError(f"Unable to get MTD info for {path}: {error}")
+
+            self.size = os.fstat(self.fd).st_size
+            self.erase_size = erase_size or DEFAULT_ERASE_SIZE
+            self.write_size = 1
+            self.is_mtd = False
+
+    def close(self):
+        os.close(self.fd)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def read(self, offset, length):
+        return os.pread(self.fd, length, offset)
+
+    def unlock(self, offset, length):
+        if not self.is_mtd:
+            return
+
+        try:
+            fcntl.ioctl(self.fd, MEMUNLOCK, struct.pack(ERASE_INFO_FORMAT, offset, length))
+        except OSError as error:
+            # Many devices have no lock support, which is not an error
+            if error.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EINVAL):
+                raise MtdEraseError(f"Unable to unlock {self.path} at {offset:#x}: {error}")
+
+    def erase(self, offset, length):
+        try:
+            if self.is_mtd:
+                fcntl.ioctl(self.fd, MEMERASE, struct.pack(ERASE_INFO_FORMAT, offset, length))
+            else:
+                os.pwrite(self.fd, b"\xff" * length, offset)
+
+        except OSError as error:
+            raise MtdEraseError(f"Unable to erase {self.path} at {offset:#x}: {error}")
+
+    def write(self, offset, data):
+        # Writes must be a whole number of pages, so pad with the erased value
+        padding = -len(data) % self.write_size
+        data = data + b"\xff" * padding
+
+        try:
+            written = os.pwrite(self.fd, data, offset)
+        except OSError as error:
+            raise MtdWriteError(f"Unable to write {self.path} at {offset:#x}: {error}")
+
+        if written != len(data):
+            raise MtdWriteError(f"Short write to {self.path} at {offset:#x}: {written} of {len(data)} bytes")
+
+class MtdWriter():
+    """
+    In-process replacement for flashcp, writing an image to an MTD device erase block by block.
+
+    The write runs in three stages, like flashcp: blocks that differ from the image are erased,
+    then written, then every written block is read back and verified. Blocks already holding
+    the image data are left alone, and blocks already erased are not erased again.
+    """
+
+    def __init__(self, progress_callback=None, progress_interval=0.25):
+        """Initialise the MtdWriter object.
+
+        :param progress_callback: function called with (stage, bytes done, total bytes, throughput in MB/s)
+        :param progress_interval: minimum time in seconds between progress reports
+        """
+        self.progress_callback = progress_callback
+        self.progress_interval = progress_interval
+
+    def write_image(self, src_path, mtd_path, erase_size=None):
+        """Write an image file to an MTD device.
+
+        :param src_path: path of the image file
+        :param mtd_path: path of the MTD device, or file-backed stand-in
+        :param erase_size: erase block size to use for a file-backed stand-in
+        :return: dictionary of the number of blocks erased, written and left unchanged
+        """
+        # The image is read one erase block at a time in every stage, so however large it is,
+        # only a block of it is held in memory
+        with open(src_path, "rb") as src_file, MtdDevice(mtd_path, erase_size) as device:
+            image_size = os.fstat(src_file.fileno()).st_size
+            if image_size > device.size:
+                raise MtdWriteError(f"Image of {image_size} bytes is larger than {mtd_path} ({device.size} bytes)")
+
+            block_size = device.erase_size
+            offsets = range(0, image_size, block_size)
+            read_block = lambda offset: os.pread(src_file.fileno(), block_size, offset)
+
+            to_write = []
+            to_erase = []
+            for offset in offsets:
+                new_block = read_block(offset)
+                current_block = device.read(offset, block_size)
+
+                if current_block[:len(new_block)] == new_block and current_block[len(new_block):].count(0xff) == len(current_block) - len(new_block):
+                    continue
+
+                to_write.append(offset)
+                if current_block.count(0xff) != len(current_block):
+                    to_erase.append(offset)
+
+            if to_erase:
+                device.unlock(0, len(offsets) * block_size)
+
+            self.run_stage(STAGE_ERASE, to_erase, block_size, lambda offset: device.erase(offset, block_size))
+            self.run_stage(STAGE_WRITE, to_write, block_size,
+                           lambda offset: device.write(offset, read_block(offset)))
+            self.run_stage(STAGE_VERIFY, to_write, block_size,
+                           lambda offset: self.verify_block(device, offset, read_block(offset)))
+
+        return {
+            "erased": len(to_erase),
+            "written": len(to_write),
+            "unchanged": len(offsets) - len(to_write)
+        }
+
+    def verify_block(self, device, offset, expected):
+        if device.read(offset, len(expected)) != expected:
+            raise MtdVerifyError(f"Verification of {device.path} failed at {offset:#x}")
+
+    def run_stage(self, stage, offsets, block_size, operation):
+        total = len(offsets) * block_size
+        start_time = time.monotonic()
+        last_report_time = 0
+
+        for count, offset in enumerate(offsets, 1):
+            operation(offset)
+
+            now = time.monotonic()
+            if self.progress_callback and (now - last_report_time >= self.progress_interval or count == len(offsets)):
+                elapsed = now - start_time
+                throughput = round(count * block_size / elapsed / (1024 * 1024), 1) if elapsed > 0 else 0
+                self.progress_callback(stage, count * block_size, total, throughput)
+                last_report_time = now
@@ -0,0 +1,356 @@
+"""Simulated LOKI board, for running the adapter off-target.
+
+This builds a directory tree standing in for the parts of a LOKI board used by the adapter:
+eMMC, SD and backup mount directories holding synthetic FIT images, file-backed MTD
+partitions described in a fake /sys/class/mtd and /proc/mtd, MMC block device statistics,
+and the live devicetree metadata node. Pointing the system_root option at the tree runs the
+adapter against it. A local stand-in for the GitHub releases API can also be served, and a
+fleet of boards created, each with an odin-control config on its own port, for trying out the
+fleet coordinator. The pytest fixtures in test/conftest.py build their boards with this module.
+
+Run with: python -m loki_update.simulation [root] [--serve-releases PORT] [--fleet N --base-port PORT]
+"""
+
+import os
+import sys
+import json
+import time
+import struct
+import hashlib
+import argparse
+
+import tornado.web
+import tornado.ioloop
+
+from loki_update.fdt import FDT_MAGIC, FDT_HEADER_SIZE, FDT_BEGIN_NODE, FDT_END_NODE, FDT_PROP, FDT_END, LIVE_DEVICETREE_PATH
+
+DEFAULT_SIMULATION_ROOT = "/tmp/loki-update-sim"
+
+DEFAULT_METADATA = {
+    "application-name": "loki-sim",
+    "application-version": "1.0.0",
+    "loki-version": "1.0.0",
+    "platform": "simulated"
+}
+
+ODIN_CONFIG_TEMPLATE = """[server]
+debug_mode = 1
+http_port  = {http_port}
+http_addr  = 127.0.0.1
+adapters   = loki-update
+
+[tornado]
+logging = warning
+
+[adapter.loki-update]
+module = loki_update.adapter.LokiUpdateAdapter
+{options}
+"""
+
+# MTD partitions of the simulated board, as (label, size, erase size)
+MTD_PARTITIONS = [("boot", 4 * 1024 * 1024, 64 * 1024), ("bootscr", 256 * 1024, 64 * 1024), ("kernel", 64 * 1024 * 1024, 64 * 1024)]
+
+def pad_to_word(data):
+    return data + b"\0" * (-len(data) % 4)
+
+def encode_property(value):
+    if isinstance(value, bytes):
+        return value
+    if isinstance(value, str):
+        return value.encode() + b"\0"
+    if isinstance(value, list):
+        return b"".join(item.encode() + b"\0" for item in value)
+
+    return struct.pack(">I", value)
+
+def build_fdt(root):
+    """Build a flattened device tree blob.
+
+    :param root: root node, as a tuple of its name, a dictionary of properties and a list of child nodes
+    :return: the device tree blob
+    """
+    structure = bytearray()
+    strings = bytearray()
+    string_offsets = {}
+
+    def add_node(node):
+        name, properties, children = node
+        structure.extend(struct.pack(">I", FDT_BEGIN_NODE) + pad_to_word(name.encode() + b"\0"))
+
+        for property_name, value in properties.items():
+            if property_name not in string_offsets:
+                string_offsets[property_name] = len(strings)
+                strings.extend(property_name.encode() + b"\0")
+
+            data = encode_property(value)
+            structure.extend(struct.pack(">III", FDT_PROP, len(data), string_offsets[property_name]) + pad_to_word(data))
+
+        for child in children:
+            add_node(child)
+
+        structure.extend(struct.pack(">I", FDT_END_NODE))
+
+    add_node(root)
+    structure.extend(struct.pack(">I", FDT_END))
+
+    # Header, then an empty memory reservation map, the structure block and the strings block
+    reserve_offset = FDT_HEADER_SIZE
+    structure_offset = reserve_offset + 16
+    strings_offset = structure_offset + len(structure)
+    total_size = strings_offset + len(strings)
+
+    header = struct.pack(">10I", FDT_MAGIC, total_size, structure_offset, strings_offset, reserve_offset,
+                         17, 16, 0, len(strings), len(structure))
+
+    return header + bytes(16) + bytes(structure) + bytes(strings)
+
+def make_fit_image(metadata=DEFAULT_METADATA, kernel_size=1024 * 1024, timestamp=None):
+    """Generate a synthetic FIT image, with the metadata held in its embedded device tree.
+
+    :param metadata: dictionary of the loki-metadata properties
+    :param kernel_size: size in bytes of the kernel sub-image, which sets the image size
+    :param timestamp: build timestamp of the image, the current time if not given
+    """
+    dtb = build_fdt(("", {}, [("loki-metadata", dict(metadata), [])]))
+    kernel = bytes(range(256)) * (kernel_size // 256) + bytes(kernel_size % 256)
+
+    return build_fdt(("", {"timestamp": int(timestamp or time.time()), "description": "Simulated LOKI image"}, [
+        ("images", {}, [
+            ("kernel-1", {"type": "kernel", "data": kernel}, []),
+            ("fdt-1", {"type": "flat_dt", "data": dtb}, [])
+        ]),
+        ("configurations", {"default": "conf-1"}, [("conf-1", {"kernel": "kernel-1", "fdt": "fdt-1"}, [])])
+    ]))
+
+def write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb" if isinstance(data, bytes) else "w") as out_file:
+        out_file.write(data)
+
+class SimulatedBoard():
+    """
+    Directory tree standing in for a LOKI board, laid out under a root directory.
+    """
+
+    def __init__(self, root=DEFAULT_SIMULATION_ROOT):
+        self.root = root
+        self.emmc_path = os.path.join(root, "mnt", "emmc") + "/"
+        self.sd_path = os.path.join(root, "mnt", "sd") + "/"
+        self.backup_path = os.path.join(self.emmc_path, "backup") + "/"
+
+    def install_image(self, base_path, metadata=DEFAULT_METADATA, kernel_size=1024 * 1024):
+        """Install a synthetic image set, made up of image.ub, BOOT.BIN and boot.scr.
+
+        :param base_path: directory to install the images to
+        :param metadata: dictionary of the loki-metadata properties
+        :param kernel_size: size in bytes of the kernel sub-image
+        """
+        write_file(base_path + "image.ub", make_fit_image(metadata, kernel_size))
+        write_file(base_path + "BOOT.BIN", hashlib.sha256(metadata["application-version"].encode()).digest() * 4096)
+        write_file(base_path + "boot.scr", f"# boot script for {metadata['application-name']}\n")
+
+    def create(self, metadata=DEFAULT_METADATA, kernel_size=1024 * 1024):
+        """Create the board, with the same image installed on every device.
+
+        :param metadata: dictionary of the loki-metadata properties
+        :param kernel_size: size in bytes of the kernel sub-image
+        """
+        for base_path in [self.emmc_path, self.sd_path, self.backup_path]:
+            self.install_image(base_path, metadata, kernel_size)
+
+        proc_mtd = "dev:    size   erasesize  name\n"
+        for index, (label, size, erase_size) in enumerate(MTD_PARTITIONS):
+            device = f"mtd{index}"
+            sys_dir = os.path.join(self.root, "sys", "class", "mtd", device)
+            write_file(os.path.join(sys_dir, "name"), label + "\n")
+            write_file(os.path.join(sys_dir, "size"), f"{size}\n")
+            write_file(os.path.join(sys_dir, "erasesize"), f"{erase_size}\n")
+
+            contents = make_fit_image(metadata, kernel_size) if label == "kernel" else b""
+            write_file(os.path.join(self.root, "dev", device), contents + b"\xff" * (size - len(contents)))
+            proc_mtd += f'{device}: {size:08x} {erase_size:08x} "{label}"\n'
+
+        write_file(os.path.join(self.root, "proc", "mtd"), proc_mtd)
+        write_file(os.path.join(self.root, "proc", "meminfo"), "MemTotal:  2048000 kB\nDirty:  0 kB\nWriteback:  0 kB\n")
+
+        for device in ["mmcblk0", "mmcblk1"]:
+            write_file(os.path.join(self.root, "sys", "block", device, "inflight"), "       0        0\n")
+            write_file(os.path.join(self.root, "sys", "block", device, "stat"), " 0 0 0 0 0 0 0 0 0 0 0\n")
+
+        devicetree_path = self.root + LIVE_DEVICETREE_PATH
+        write_file(os.path.join(devicetree_path, "compatible"), b"loki,simulated\0")
+        for name, value in dict(metadata, timestamp=int(time.time())).items():
+            write_file(os.path.join(devicetree_path, "loki-metadata", name),
+                       struct.pack(">I", value) if isinstance(value, int) else value.encode() + b"\0")
+
+    def adapter_options(self, upload_port=0, github_api_url="http://127.0.0.1:8891/repos", artifact_peers=(), **overrides):
+        """Get the options running the adapter against the board, as odin-control passes them.
+
+        :param upload_port: port the upload and peer artifact endpoints listen on, or 0 for none
+        :param github_api_url: base URL of the releases API the board retrieves releases from
+        :param artifact_peers: base URLs of the peer boards release assets are fetched from
+        :param overrides: further options, replacing the defaults
+        :return: dictionary of option names and string values
+        """
+        options = {
+            "emmc_base_path": self.emmc_path,
+            "sd_base_path": self.sd_path,
+            "backup_base_path": self.backup_path,
+            "system_root": self.root,
+            "github_api_url": github_api_url,
+            "allow_reboot": "False",
+            "allow_only_emmc_upload": "False",
+            "allow_images_from_repo": "True",
+            "available_repos": json.dumps([{"name": "loki", "owner": "stfc-aeg"}]),
+            "metadata_cache_path": f"{self.root}/metadata.json",
+            "checksum_cache_path": f"{self.root}/checksums.json",
+            "artifact_cache_dir": f"{self.root}/artifacts/",
+            "catalogue_snapshot_path": f"{self.root}/catalogue.json",
+            "upload_port": str(upload_port),
+            "artifact_seed": "True",
+            "artifact_peers": json.dumps(list(artifact_peers))
+        }
+
+        return dict(options, **{name: str(value) for name, value in overrides.items()})
+
+    def write_config(self, http_port, upload_port, github_api_url="http://127.0.0.1:8891/repos", artifact_peers=()):
+        """Write an odin-control config running the adapter against the board.
+
+        :param http_port: port the odin-control server listens on
+        :param upload_port: port the upload and peer artifact endpoints listen on
+        :param github_api_url: base URL of the releases API the board retrieves releases from
+        :param artifact_peers: base URLs of the peer boards release assets are fetched from
+        :return: path of the config file
+        """
+        options = self.adapter_options(upload_port, github_api_url, artifact_peers)
+        config_path = os.path.join(self.root, "loki-update.cfg")
+        write_file(config_path, ODIN_CONFIG_TEMPLATE.format(http_port=http_port,
+                                                            options="\n".join(f"{name} = {value}" for name, value in options.items())))
+
+        return config_path
+
+class ReleaseAssetHandler(tornado.web.RequestHandler):
+    """
+    Request handler serving a release asset, with support for Range requests
+    """
+
+    def initialize(self, releases):
+        self.releases = releases
+
+    def get(self, tag, name):
+        data = self.releases.get(tag, {}).get(name)
+        if data is None:
+            raise tornado.web.HTTPError(404)
+
+        byte_range = self.request.headers.get("Range")
+        if byte_range and byte_range.startswith("bytes="):
+            start = int(byte_range[len("bytes="):].partition("-")[0])
+            if start >= len(data):
+                self.set_status(416)
+                self.set_header("Content-Range", f"bytes */{len(data)}")
+                return
+            self.set_status(206)
+            self.set_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            data = data[start:]
+
+        self.set_header("Content-Type", "application/octet-stream")
+        self.write(data)
+
+class ReleaseListHandler(tornado.web.RequestHandler):
+    """
+    Request handler standing in for the GitHub releases API, with ETag support
+    """
+
+    def initialize(self, releases):
+        self.releases = releases
+
+    def release(self, tag):
+        return {
+            "tag_name": tag,
+            "assets": [
+                {
+                    "name": name,
+                    "size": len(data),
+                    "digest": "sha256:" + hashlib.sha256(data).hexdigest(),
+                    "browser_download_url": f"{self.request.protocol}://{self.request.host}/assets/{tag}/{name}"
+                }
+                for name, data in self.releases[tag].items()
+            ]
+        }
+
+    def get(self, owner, repo, tag=None):
+        if tag is None:
+            body = json.dumps([self.release(tag) for tag in self.releases])
+        elif tag in self.releases:
+            body = json.dumps(self.release(tag))
+        else:
+            raise tornado.web.HTTPError(404)
+
+        etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:16] + '"'
+        if self.request.headers.get("If-None-Match") == etag:
+            self.set_status(304)
+            return
+
+        self.set_header("ETag", etag)
+        self.set_header("Content-Type", "application/json")
+        self.write(body)
+
+def make_release_app(releases):
+    """Create a Tornado application standing in for the GitHub releases API and downloads.
+
+    Point the github_api_url option at http://<host>:<port>/repos to use it.
+
+    :param releases: dictionary of release tags, each a dictionary of asset names and contents
+    """
+    params = dict(releases=releases)
+
+    return tornado.web.Application([
+        (r"/repos/([^/]+)/([^/]+)/releases/?", ReleaseListHandler, params),
+        (r"/repos/([^/]+)/([^/]+)/releases/tags/([^/]+)", ReleaseListHandler, params),
+        (r"/assets/([^/]+)/([^/]+)", ReleaseAssetHandler, params)
+    ])
+
+def make_release(version, kernel_size=1024 * 1024):
+    metadata = dict(DEFAULT_METADATA, **{"application-version": version})
+    return {
+        "image.ub": make_fit_image(metadata, kernel_size),
+        "BOOT.BIN": hashlib.sha256(version.encode()).digest() * 4096,
+        "boot.scr": f"# boot script for {version}\n".encode()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Create a simulated LOKI board for running loki-update off-target")
+    parser.add_argument("root", nargs="?", default=DEFAULT_SIMULATION_ROOT, help="directory to create the board in")
+    parser.add_argument("--kernel-size", type=int, default=1024 * 1024, help="size in bytes of the kernel in each image")
+    parser.add_argument("--serve-releases", type=int, metavar="PORT", help="serve a stand-in GitHub releases API on this port")
+    parser.add_argument("--fleet", type=int, default=0, metavar="N", help="create N boards, each with an odin-control config")
+    parser.add_argument("--base-port", type=int, default=8900, help="odin-control port of the first board of a fleet")
+    parser.add_argument("--upload-base-port", type=int, default=8950, help="upload and peer artifact port of the first board of a fleet")
+    args = parser.parse_args()
+
+    github_api_url = f"http://127.0.0.1:{args.serve_releases or 8891}/repos"
+
+    if args.fleet:
+        # Each board fetches release assets from every other board before going upstream
+        upload_urls = [f"http://127.0.0.1:{args.upload_base_port + index}" for index in range(args.fleet)]
+        for index in range(args.fleet):
+            board = SimulatedBoard(os.path.join(args.root, f"board{index + 1}"))
+            board.create(kernel_size=args.kernel_size)
+            config_path = board.write_config(args.base_port + index, args.upload_base_port + index, github_api_url,
+                                             upload_urls[:index] + upload_urls[index + 1:])
+            print(f"odin_server --config {config_path}  # http://127.0.0.1:{args.base_port + index}")
+    else:
+        board = SimulatedBoard(args.root)
+        board.create(kernel_size=args.kernel_size)
+        print(f"Simulated board created in {args.root}")
+        print(f"emmc_base_path = {board.emmc_path}\nsd_base_path = {board.sd_path}\n"
+              f"backup_base_path = {board.backup_path}\nsystem_root = {args.root}")
+
+    if args.serve_releases:
+        releases = {version: make_release(version, args.kernel_size) for version in ["1.0.0", "1.1.0"]}
+        make_release_app(releases).listen(args.serve_releases)
+        print(f"github_api_url = {github_api_url}")
+        tornado.ioloop.IOLoop.current().start()
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,113 @@
+import json
+import itertools
+import threading
+
+# Maximum number of serialised paths kept, beyond which the oldest are dropped
+DEFAULT_MAX_ENTRIES = 64
+
+class TreeSnapshots():
+    """
+    Pre-serialised JSON of a parameter tree, reused until the subtrees it covers change.
+
+    Each versioned top-level subtree has a counter which is bumped whenever one of its values
+    changes, so a request for an unchanged subtree is answered with the JSON serialised for its
+    current version, without evaluating any getters. Volatile subtrees, such as the uptime and
+    copy progress, change too often to be worth caching and are evaluated on every request.
+    """
+
+    def __init__(self, param_tree, subtrees, version_sources, max_entries=DEFAULT_MAX_ENTRIES):
+        """Initialise the TreeSnapshots object.
+
+        :param param_tree: parameter tree to serialise
+        :param subtrees: names of the top-level subtrees, in the order they appear in the tree
+        :param version_sources: dictionary of the versioned subtrees, each with a function
+                                returning the version of any state the subtree reads from other
+                                objects, or None if it has none
+        :param max_entries: maximum number of serialised paths kept
+        """
+        self.param_tree = param_tree
+        self.subtrees = subtrees
+        self.version_sources = version_sources
+        self.max_entries = max_entries
+        self.counter = itertools.count(1)
+        self.versions = {subtree: 0 for subtree in version_sources}
+        self.entries = {}
+        self.listeners = []
+        self.lock = threading.Lock()
+
+    def add_listener(self, listener):
+        """Add a function called with the name of each subtree as it is bumped.
+
+        Listeners are called on the thread which bumped the subtree, so they must be thread safe.
+        """
+        self.listeners.append(listener)
+
+    def bump(self, subtree):
+        """Mark a subtree as changed, so its JSON is serialised again on the next request.
+
+        Versions are drawn from a single counter, so they only ever increase, whichever
+        thread bumps them. Volatile subtrees have no version, but their listeners are still told.
+
+        :param subtree: name of the top-level subtree
+        """
+        if subtree in self.versions:
+            self.versions[subtree] = next(self.counter)
+
+        for listener in self.listeners:
+            listener(subtree)
+
+    def bump_path(self, path):
+        """Mark the subtree holding a parameter tree path as changed, or every subtree for the root."""
+        subtree = path.strip("/").split("/")[0]
+
+        for name in ([subtree] if subtree else self.subtrees):
+            self.bump(name)
+
+    def get_version(self, subtree):
+        source = self.version_sources[subtree]
+        return (self.versions[subtree], source() if source else None)
+
+    def serialise(self, path):
+        """Get the JSON of a parameter tree path, from the snapshot of its current version if possible.
+
+        :param path: path to retrieve from the tree
+        :return: the JSON body
+        """
+        path = path.strip("/")
+
+        if not path:
+            fragments = [f"{json.dumps(subtree)}: {self.get_fragment(subtree)}" for subtree in self.subtrees]
+            return "{" + ", ".join(fragments) + "}"
+
+        subtree = path.split("/")[0]
+        if subtree not in self.versions:
+            return json.dumps(self.param_tree.get(path))
+
+        return self.get_entry(path, subtree, lambda: json.dumps(self.param_tree.get(path)))
+
+    def get_fragment(self, subtree):
+        """Get the JSON of the value of a top-level subtree, for assembling the whole tree."""
+        serialise = lambda: json.dumps(self.param_tree.get(subtree)[subtree])
+
+        if subtree not in self.versions:
+            return serialise()
+
+        return self.get_entry(("fragment", subtree), subtree, serialise)
+
+    def get_entry(self, key, subtree, serialise):
+        # The version is read before the getters run, so a change made while serialising
+        # leaves the entry out of date, and it is serialised again on the next request
+        version = self.get_version(subtree)
+
+        entry = self.entries.get(key)
+        if entry and entry[0] == version:
+            return entry[1]
+
+        body = serialise()
+
+        with self.lock:
+            if len(self.entries) >= self.max_entries and key not in self.entries:
+                self.entries.pop(next(iter(self.entries)))
+            self.entries[key] = (version, body)
+
+        return body
@@ -0,0 +1,215 @@
+import os
+import time
+import ctypes
+import ctypes.util
+import logging
+import threading
+
+SYS_BLOCK_PATH = "/sys/block"
+MEMINFO_PATH = "/proc/meminfo"
+
+# Block devices holding the eMMC and SD filesystems
+MMC_BLOCK_DEVICES = ["mmcblk0", "mmcblk1"]
+
+# Dirty and writeback data below which the filesystems are considered synced
+DEFAULT_DIRTY_THRESHOLD = 1024 * 1024
+
+# Weight given to the latest sample in the smoothed write rate
+RATE_SMOOTHING = 0.3
+
+SECTOR_SIZE = 512
+
+def read_sys_file(path):
+    with open(path, "r") as sys_file:
+        return sys_file.read()
+
+def read_meminfo(meminfo_path=MEMINFO_PATH):
+    """Get the amount of dirty and writeback data waiting to be written to disk.
+
+    :param meminfo_path: path of the meminfo file
+    :return: tuple of the dirty and writeback sizes in bytes
+    """
+    values = {}
+    for line in read_sys_file(meminfo_path).splitlines():
+        name, _, value = line.partition(":")
+        if name in ("Dirty", "Writeback"):
+            values[name] = int(value.split()[0]) * 1024
+
+    return values.get("Dirty", 0), values.get("Writeback", 0)
+
+def syncfs(path):
+    """Flush the filesystem holding a path to disk.
+
+    syncfs is used where the C library provides it, so only that filesystem is flushed,
+    otherwise every filesystem is flushed with os.sync.
+
+    :param path: path on the filesystem to flush
+    """
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+
+    if not hasattr(libc, "syncfs"):
+        os.sync()
+        return
+
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if libc.syncfs(fd) != 0:
+            error = ctypes.get_errno()
+            raise OSError(error, f"syncfs failed for {path}: {os.strerror(error)}")
+    finally:
+        os.close(fd)
+
+class SyncMonitor():
+    """
+    Background sampler of the write state of the MMC block devices.
+
+    The in-flight writes and sectors written of each device, and the dirty and writeback
+    data in the page cache, are read from sysfs and procfs at a fixed interval. The cached
+    result gives whether the filesystems are synced, and so safe to reboot, and an estimate
+    of the time until they will be, from the recent write rate.
+    """
+
+    def __init__(self, block_devices=MMC_BLOCK_DEVICES, interval=0.5, dirty_threshold=DEFAULT_DIRTY_THRESHOLD,
+                 sys_block_path=SYS_BLOCK_PATH, meminfo_path=MEMINFO_PATH):
+        """Initialise the SyncMonitor object.
+
+        :param block_devices: names of the block devices to monitor
+        :param interval: time in seconds between samples
+        :param dirty_threshold: dirty and writeback data in bytes below which the filesystems are synced
+        :param sys_block_path: path of the block device directory in sysfs
+        :param meminfo_path: path of the meminfo file
+        """
+        self.block_devices = block_devices
+        self.interval = interval
+        self.dirty_threshold = dirty_threshold
+        self.sys_block_path = sys_block_path
+        self.meminfo_path = meminfo_path
+        self.last_sectors = None
+        self.last_sample_time = None
+        self.write_rate = 0
+        self.status = {
+            "synced": True,
+            "inflight_writes": 0,
+            "dirty_bytes": 0,
+            "writeback_bytes": 0,
+            "write_rate": 0,
+            "eta": 0,
+            "last_sample": None
+        }
+        # Function called, from whichever thread took the sample, when the sync state changes
+        self.on_change = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def read_device(self, device):
+        """Read the in-flight writes and total sectors written of a block device.
+
+        :param device: name of the block device
+        :return: tuple of in-flight writes and sectors written, or None if the device does not exist
+        """
+        device_path = os.path.join(self.sys_block_path, device)
+
+        try:
+            inflight = [int(x) for x in read_sys_file(os.path.join(device_path, "inflight")).split()]
+            stat = [int(x) for x in read_sys_file(os.path.join(device_path, "stat")).split()]
+        except FileNotFoundError:
+            return None
+
+        # Field 7 of the stat file is the number of sectors written
+        return inflight[1], stat[6]
+
+    def sample(self):
+        """Take a sample and update the cached sync state.
+
+        Samples may be taken from other threads as well as the sampling thread, such as when a
+        write finishes, so they are taken one at a time.
+        """
+        with self.lock:
+            changed = self.take_sample()
+
+        if changed and self.on_change:
+            self.on_change()
+
+    def take_sample(self):
+        now = time.monotonic()
+        inflight_writes = 0
+        sectors = 0
+
+        for device in self.block_devices:
+            try:
+                state = self.read_device(device)
+            except (OSError, ValueError, IndexError) as error:
+                logging.error(f"Error reading mmc sync state for {device}: {error}")
+                continue
+
+            if state:
+                inflight_writes += state[0]
+                sectors += state[1]
+
+        try:
+            dirty, writeback = read_meminfo(self.meminfo_path)
+        except (OSError, ValueError) as error:
+            logging.error(f"Error reading dirty page counts: {error}")
+            dirty, writeback = 0, 0
+
+        if self.last_sectors is not None and now > self.last_sample_time:
+            rate = max(sectors - self.last_sectors, 0) * SECTOR_SIZE / (now - self.last_sample_time)
+            self.write_rate = RATE_SMOOTHING * rate + (1 - RATE_SMOOTHING) * self.write_rate
+
+        self.last_sectors = sectors
+        self.last_sample_time = now
+
+        synced = inflight_writes == 0 and dirty + writeback <= self.dirty_threshold
+        if synced:
+            eta = 0
+        elif self.write_rate > 0:
+            eta = round((dirty + writeback) / self.write_rate, 1)
+        else:
+            eta = None
+
+        if not synced:
+            logging.debug(f"Block devices still syncing: {inflight_writes} writes in flight, {dirty + writeback} bytes dirty")
+
+        status = {
+            "synced": synced,
+            "inflight_writes": inflight_writes,
+            "dirty_bytes": dirty,
+            "writeback_bytes": writeback,
+            "write_rate": round(self.write_rate),
+            "eta": eta,
+            "last_sample": time.time()
+        }
+        changed = any(status[key] != self.status[key] for key in status if key != "last_sample")
+        self.status = status
+
+        return changed
+
+    def is_synced(self):
+        return self.status["synced"]
+
+    def get_status(self):
+        return dict(self.status)
+
+    def start(self):
+        self.sample()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def stop(self):
+        self.stopped.set()
+
+    def sync_now(self, paths):
+        """Flush the filesystems holding a set of paths to disk, then take a fresh sample.
+
+        :param paths: paths on the filesystems to flush
+        """
+        for path in paths:
+            if os.path.exists(path):
+                syncfs(path)
+
+        self.sample()
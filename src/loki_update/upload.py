@@ -0,0 +1,619 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+import tornado.web
+import tornado.ioloop
+
+from loki_update.controller import LokiUpdateError
+from loki_update.delta import DEFAULT_BLOCK_SIZE
+from loki_update.download import DEFAULT_PEER_CHUNK_SIZE
+from loki_update.events import EventStreamHandler
+
+# Largest single file accepted by the streaming upload handler
+MAX_UPLOAD_SIZE = 1024 * 1024 * 1024
+
+# Largest chunk accepted by a resumable upload session
+MAX_CHUNK_SIZE = 16 * 1024 * 1024
+
+# Size of each read made while serving a release asset to a peer
+SEED_READ_SIZE = 1024 * 1024
+
+class StagedUpload():
+    """
+    File being written to the staging directory, with a running SHA-256 of its contents.
+
+    Chunks are written and hashed on an executor thread, so the lock keeps a chunk still
+    being written from racing an abort when the connection closes.
+    """
+
+    def __init__(self, path):
+        """Initialise the StagedUpload object, creating the staging file.
+
+        :param path: path of the staging file
+        """
+        self.path = path
+        self.hash = hashlib.new("sha256")
+        self.size = 0
+        self.lock = threading.Lock()
+        self.file = open(path, "wb")
+
+    def write(self, chunk):
+        with self.lock:
+            if self.file.closed:
+                return
+            self.file.write(chunk)
+            self.hash.update(chunk)
+            self.size += len(chunk)
+
+    def finish(self):
+        """Close the staging file.
+
+        :return: SHA-256 hex digest of everything written
+        """
+        with self.lock:
+            self.file.close()
+        return self.hash.hexdigest()
+
+    def abort(self):
+        with self.lock:
+            self.file.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class UploadSession():
+    """
+    Resumable upload of a single file, written to the staging directory in chunks at offsets.
+
+    The ranges received so far are saved to an index file after every chunk, so a session
+    can be resumed after the connection, or the adapter, is restarted.
+    """
+
+    def __init__(self, session_dir, session_id, path, file_name, size, checksum, ranges=None):
+        self.session_dir = session_dir
+        self.session_id = session_id
+        self.path = path
+        self.file_name = file_name
+        self.size = size
+        self.checksum = checksum
+        self.ranges = ranges or []
+
+        if not os.path.exists(self.path):
+            self.ranges = []
+
+        with open(self.path, "ab") as staging_file:
+            staging_file.truncate(self.size)
+
+    @property
+    def index_path(self):
+        return self.session_dir + self.session_id + ".json"
+
+    def write_chunk(self, offset, chunk, chunk_checksum):
+        """Write a chunk to the staging file at an offset, after checking its SHA-256.
+
+        :param offset: offset of the chunk within the file
+        :param chunk: chunk data
+        :param chunk_checksum: SHA-256 hex digest of the chunk provided by the client
+        """
+        if offset < 0 or offset + len(chunk) > self.size:
+            raise LokiUpdateError(f"Chunk at offset {offset} is outside {self.file_name}")
+
+        if hashlib.sha256(chunk).hexdigest() != chunk_checksum:
+            raise LokiUpdateError(f"Checksum failed for chunk at offset {offset} of {self.file_name}")
+
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            os.pwrite(fd, chunk, offset)
+        finally:
+            os.close(fd)
+
+        self.add_range(offset, offset + len(chunk))
+        self.save()
+
+    def add_range(self, start, end):
+        merged = []
+        for range_start, range_end in sorted(self.ranges + [[start, end]]):
+            if merged and range_start <= merged[-1][1]:
+                merged[-1][1] = max(merged[-1][1], range_end)
+            else:
+                merged.append([range_start, range_end])
+
+        self.ranges = merged
+
+    def missing_ranges(self):
+        missing = []
+        position = 0
+        for start, end in self.ranges:
+            if start > position:
+                missing.append([position, start])
+            position = max(position, end)
+
+        if position < self.size:
+            missing.append([position, self.size])
+
+        return missing
+
+    def is_complete(self):
+        return not self.missing_ranges()
+
+    def file_checksum(self):
+        hash = hashlib.new("sha256")
+        with open(self.path, "rb") as in_file:
+            for chunk in iter(lambda: in_file.read(1024 * 1024), b""):
+                hash.update(chunk)
+
+        return hash.hexdigest()
+
+    def status(self):
+        return {
+            "session_id": self.session_id,
+            "file_name": self.file_name,
+            "size": self.size,
+            "received": self.ranges,
+            "missing": self.missing_ranges()
+        }
+
+    def save(self):
+        stored = dict(self.status(), path=self.path, checksum=self.checksum)
+        temp_path = self.index_path + ".tmp"
+
+        with open(temp_path, "w") as index_file:
+            json.dump(stored, index_file)
+        os.replace(temp_path, self.index_path)
+
+    def remove(self, remove_staging_file=False):
+        if os.path.exists(self.index_path):
+            os.remove(self.index_path)
+
+        if remove_staging_file and os.path.exists(self.path):
+            os.remove(self.path)
+
+class UploadSessionManager():
+    """
+    Store of the resumable upload sessions in progress, reloaded from their index files
+    """
+
+    def __init__(self, controller):
+        self.controller = controller
+        self.sessions = {}
+        self.session_dir = controller.get_upload_session_dir()
+
+        for index_name in os.listdir(self.session_dir):
+            if not index_name.endswith(".json"):
+                continue
+
+            try:
+                with open(self.session_dir + index_name, "r") as index_file:
+                    stored = json.load(index_file)
+
+                self.sessions[stored["session_id"]] = UploadSession(
+                    self.session_dir, stored["session_id"], stored["path"], stored["file_name"], stored["size"],
+                    stored["checksum"], stored["received"])
+
+            except (OSError, ValueError, KeyError) as error:
+                logging.error(f"Unable to reload upload session {index_name}: {error}")
+
+    def open(self, file_name, size, checksum):
+        """Start a session for a file, or resume the existing session for the same file.
+
+        :param file_name: name of the file being uploaded
+        :param size: size of the complete file in bytes
+        :param checksum: SHA-256 hex digest of the complete file
+        """
+        path = self.controller.begin_upload(file_name)
+        session_id = hashlib.sha256(f"{path}:{size}:{checksum}".encode()).hexdigest()[:16]
+
+        session = self.sessions.get(session_id)
+        if session is None or not os.path.exists(session.path):
+            session = UploadSession(self.session_dir, session_id, path, file_name, size, checksum)
+            session.save()
+            self.sessions[session_id] = session
+
+        return session
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise LokiUpdateError(f"No upload session with ID {session_id}")
+
+        return session
+
+    def finalise(self, session_id):
+        """Verify a complete session and hand the file to the controller.
+
+        :param session_id: ID of the session to finalise
+        """
+        session = self.get(session_id)
+
+        if not session.is_complete():
+            raise LokiUpdateError(f"Upload of {session.file_name} is incomplete")
+
+        checksum = session.file_checksum()
+        session.remove()
+        del self.sessions[session_id]
+
+        self.controller.complete_upload(session.file_name, checksum)
+
+    def abort(self, session_id):
+        session = self.get(session_id)
+        session.remove(remove_staging_file=True)
+        del self.sessions[session_id]
+
+class UploadHandlerBase(tornado.web.RequestHandler):
+    """
+    Base class for upload request handlers, providing CORS headers and JSON responses
+    """
+
+    enable_cors = False
+
+    def set_default_headers(self):
+        if self.enable_cors:
+            self.set_header("Access-Control-Allow-Origin", "*")
+            self.set_header("Access-Control-Allow-Headers", "Content-Type, X-Chunk-Checksum")
+            self.set_header("Access-Control-Allow-Methods", "GET, POST, PUT, DELETE, OPTIONS")
+
+    def options(self, *_):
+        self.set_status(204)
+        self.finish()
+
+    def respond(self, response, status_code):
+        logging.debug(response)
+        self.set_status(status_code)
+        self.set_header("Content-Type", "application/json")
+        self.finish(json.dumps(response))
+
+class UploadSessionListHandler(UploadHandlerBase):
+    """
+    Request handler which starts, or resumes, a resumable upload session.
+
+    The body is a JSON object giving the fileName, size and checksum of the complete file.
+    """
+
+    def initialize(self, sessions, enable_cors=False):
+        self.sessions = sessions
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    def post(self):
+        try:
+            request = json.loads(self.request.body)
+            session = self.sessions.open(request["fileName"], int(request["size"]), request["checksum"])
+            self.respond(session.status(), 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+        except (KeyError, TypeError, ValueError) as error:
+            self.respond({"error": f"Failed to decode upload session request: {error}"}, 400)
+
+@tornado.web.stream_request_body
+class UploadSessionHandler(UploadHandlerBase):
+    """
+    Request handler for a resumable upload session.
+
+    GET returns the ranges received and missing, PUT writes the body as a chunk at the
+    offset given in the query string, with its SHA-256 in the X-Chunk-Checksum header, and
+    DELETE abandons the session. Chunk bodies are streamed, so one larger than the chunk
+    limit is refused before it is read.
+    """
+
+    def initialize(self, sessions, enable_cors=False):
+        self.sessions = sessions
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    def prepare(self):
+        self.chunk = bytearray()
+
+        if self.request.method == "PUT":
+            if int(self.request.headers.get("Content-Length", 0)) > MAX_CHUNK_SIZE:
+                self.respond({"error": f"Chunks must be no larger than {MAX_CHUNK_SIZE} bytes"}, 413)
+                return
+            # Bodies sent without a Content-Length are cut off at the limit as they are read
+            self.request.connection.set_max_body_size(MAX_CHUNK_SIZE)
+
+    def data_received(self, chunk):
+        self.chunk.extend(chunk)
+
+    def get(self, session_id):
+        try:
+            self.respond(self.sessions.get(session_id).status(), 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 404)
+
+    async def put(self, session_id):
+        try:
+            session = self.sessions.get(session_id)
+            offset = int(self.get_query_argument("offset"))
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, session.write_chunk, offset, bytes(self.chunk), self.request.headers.get("X-Chunk-Checksum", ""))
+            self.respond(session.status(), 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+        except (tornado.web.MissingArgumentError, ValueError) as error:
+            self.respond({"error": f"Invalid chunk offset: {error}"}, 400)
+
+    def delete(self, session_id):
+        try:
+            self.sessions.abort(session_id)
+            self.respond({"ok": f"Upload session {session_id} abandoned"}, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 404)
+
+class UploadSessionFinaliseHandler(UploadHandlerBase):
+    """
+    Request handler which verifies a complete upload session and starts the copy
+    """
+
+    def initialize(self, sessions, enable_cors=False):
+        self.sessions = sessions
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    async def post(self, session_id):
+        try:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, self.sessions.finalise, session_id)
+            self.respond({"ok": f"Upload session {session_id} complete"}, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+
+@tornado.web.stream_request_body
+class StreamingUploadHandler(UploadHandlerBase):
+    """
+    Request handler which streams a single uploaded file straight to the staging directory.
+
+    Each file is sent as the raw body of a PUT to /upload/<file name>, after the copy target
+    and checksums have been set in the parameter tree. Once every file listed in the
+    checksums has been received and verified, the copy to the target device is started.
+    """
+
+    upload = None
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    def prepare(self):
+        if self.request.method != "PUT":
+            return
+
+        self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+        file_name = os.path.basename(self.path_args[0])
+
+        try:
+            self.upload = StagedUpload(self.controller.begin_upload(file_name))
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+
+    async def data_received(self, chunk):
+        # Tornado waits for each write before reading the next chunk, so the IOLoop stays free
+        # and the body is never buffered in memory faster than it reaches the disk
+        if self.upload:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, self.upload.write, chunk)
+
+    async def put(self, file_name):
+        file_name = os.path.basename(file_name)
+        checksum = self.upload.finish()
+        self.upload = None
+
+        try:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, self.controller.complete_upload, file_name, checksum)
+            self.respond({"ok": f"{file_name} uploaded", "checksum": checksum}, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+
+    def on_connection_close(self):
+        if self.upload:
+            logging.error("Upload connection closed before the file was received")
+            self.upload.abort()
+            self.upload = None
+
+class DeltaSignatureHandler(UploadHandlerBase):
+    """
+    Request handler returning the block checksums of a file installed on a device.
+
+    A client uses these to compute a delta between the installed file and a new release, so
+    that only the changed blocks need to be sent.
+    """
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    async def get(self, device, file_name):
+        try:
+            block_size = int(self.get_query_argument("block_size", DEFAULT_BLOCK_SIZE))
+            signatures = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.controller.get_block_signatures, device, file_name, block_size)
+            self.respond(signatures, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+        except ValueError as error:
+            self.respond({"error": f"Invalid block size: {error}"}, 400)
+
+@tornado.web.stream_request_body
+class DeltaUploadHandler(UploadHandlerBase):
+    """
+    Request handler which receives a delta and reconstructs the new file from it.
+
+    The delta is the raw body of a PUT to /delta/<device>/<file name>?block_size=N, where
+    device holds the basis file the delta was computed against. The reconstructed file is
+    verified against the checksums, and the copy starts once every expected file has arrived.
+    """
+
+    upload = None
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    def prepare(self):
+        if self.request.method != "PUT":
+            return
+
+        self.request.connection.set_max_body_size(MAX_UPLOAD_SIZE)
+        file_name = os.path.basename(self.path_args[1])
+
+        try:
+            self.upload = StagedUpload(self.controller.begin_upload(file_name) + ".delta")
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+
+    async def data_received(self, chunk):
+        if self.upload:
+            await tornado.ioloop.IOLoop.current().run_in_executor(None, self.upload.write, chunk)
+
+    async def put(self, device, file_name):
+        file_name = os.path.basename(file_name)
+        self.upload.finish()
+        delta_path = self.upload.path
+        self.upload = None
+
+        try:
+            block_size = int(self.get_query_argument("block_size", DEFAULT_BLOCK_SIZE))
+            await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.controller.complete_delta_upload, device, file_name, delta_path, block_size)
+            self.respond({"ok": f"{file_name} reconstructed from delta"}, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 400)
+        except ValueError as error:
+            self.respond({"error": f"Invalid block size: {error}"}, 400)
+
+    def on_connection_close(self):
+        if self.upload:
+            logging.error("Delta upload connection closed before the delta was received")
+            self.upload.abort()
+            self.upload = None
+
+class MetricsHandler(UploadHandlerBase):
+    """
+    Request handler exposing the controller metrics in the Prometheus text format
+    """
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4")
+        self.finish(self.controller.metrics.to_prometheus())
+
+class ArtifactListHandler(UploadHandlerBase):
+    """
+    Request handler listing the assets of a release held in the artifact cache, for peers to fetch.
+
+    Each asset is listed with its size and SHA-256, and the SHA-256 of each of its chunks of the
+    size given in the chunk_size query argument, so a peer can check every chunk it fetches.
+    """
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    async def get(self, owner, repo, tag):
+        try:
+            chunk_size = int(self.get_query_argument("chunk_size", DEFAULT_PEER_CHUNK_SIZE))
+            if chunk_size <= 0:
+                raise ValueError(chunk_size)
+            assets = await tornado.ioloop.IOLoop.current().run_in_executor(
+                None, self.controller.get_seed_assets, owner, repo, tag, chunk_size)
+            self.respond(assets, 200)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 404)
+        except ValueError as error:
+            self.respond({"error": f"Invalid chunk size: {error}"}, 400)
+
+class ArtifactHandler(UploadHandlerBase):
+    """
+    Request handler serving a release asset held in the artifact cache to a peer, with support
+    for Range requests so that peers can fetch chunks of it from several boards at once.
+    """
+
+    def initialize(self, controller, enable_cors=False):
+        self.controller = controller
+        self.enable_cors = enable_cors
+        self.set_default_headers()
+
+    async def get(self, owner, repo, tag, name):
+        try:
+            cached = self.controller.get_seed_asset(owner, repo, tag, name)
+        except LokiUpdateError as error:
+            self.respond({"error": str(error)}, 404)
+            return
+
+        if cached is None:
+            self.respond({"error": f"{owner}/{repo} {tag} {name} is not cached"}, 404)
+            return
+
+        path, sha256 = cached
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+
+        byte_range = self.request.headers.get("Range")
+        if byte_range:
+            try:
+                start_text, _, end_text = byte_range.partition("=")[2].partition("-")
+                start = int(start_text)
+                end = min(int(end_text), size - 1) if end_text else size - 1
+                if not byte_range.startswith("bytes=") or start > end:
+                    raise ValueError(byte_range)
+            except ValueError:
+                self.set_status(416)
+                self.set_header("Content-Range", f"bytes */{size}")
+                self.finish()
+                return
+
+            self.set_status(206)
+            self.set_header("Content-Range", f"bytes {start}-{end}/{size}")
+
+        self.set_header("Content-Type", "application/octet-stream")
+        self.set_header("Content-Length", end - start + 1)
+        self.set_header("Accept-Ranges", "bytes")
+        self.set_header("ETag", f'"{sha256}"')
+
+        # Read on an executor thread and flush each read, so large assets are never held in memory
+        io_loop = tornado.ioloop.IOLoop.current()
+        with open(path, "rb") as asset_file:
+            asset_file.seek(start)
+            remaining = end - start + 1
+            while remaining > 0:
+                chunk = await io_loop.run_in_executor(None, asset_file.read, min(SEED_READ_SIZE, remaining))
+                if not chunk:
+                    break
+                remaining -= len(chunk)
+                self.write(chunk)
+                await self.flush()
+
+        self.finish()
+
+def make_upload_app(controller, enable_cors=False, events=None):
+    """Create the Tornado application serving the upload, event stream, metrics and peer artifact endpoints.
+
+    :param controller: LokiUpdateController the uploads are passed to
+    :param enable_cors: flag to add CORS headers to responses
+    :param events: EventPublisher served on the /events stream, if given
+    """
+    sessions = UploadSessionManager(controller)
+    session_params = dict(sessions=sessions, enable_cors=enable_cors)
+    controller_params = dict(controller=controller, enable_cors=enable_cors)
+
+    handlers = []
+    if events:
+        handlers.append((r"/events/?", EventStreamHandler, dict(events=events, enable_cors=enable_cors)))
+
+    return tornado.web.Application(handlers + [
+        (r"/sessions/?", UploadSessionListHandler, session_params),
+        (r"/sessions/([0-9a-f]+)/finalise/?", UploadSessionFinaliseHandler, session_params),
+        (r"/sessions/([0-9a-f]+)/?", UploadSessionHandler, session_params),
+        (r"/delta/(emmc|sd|backup)/([^/]+)/signature/?", DeltaSignatureHandler, controller_params),
+        (r"/delta/(emmc|sd|backup)/([^/]+)", DeltaUploadHandler, controller_params),
+        (r"/upload/(.+)", StreamingUploadHandler, controller_params),
+        (r"/metrics/?", MetricsHandler, controller_params),
+        (r"/artifacts/([^/]+)/([^/]+)/([^/]+)/?", ArtifactListHandler, controller_params),
+        (r"/artifacts/([^/]+)/([^/]+)/([^/]+)/([^/]+)", ArtifactHandler, controller_params)
+    ])
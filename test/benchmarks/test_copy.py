@@ -0,0 +1,85 @@
+"""Benchmarks of copying images between devices."""
+
+import os
+import shutil
+import tempfile
+
+import pytest
+
+from loki_update.copier import FileCopier
+
+from conftest import wait_for_jobs
+
+COPY_SIZE = 16 * 1024 * 1024
+
+COPY_SIZES = [64 * 1024, 1024 * 1024, 16 * 1024 * 1024, 128 * 1024 * 1024]
+
+# Further directories to compare copies in, such as loopback-mounted ext4 and vfat images
+COPY_DIRS = [path for path in os.environ.get("LOKI_UPDATE_BENCHMARK_DIRS", "").split(os.pathsep) if path]
+
+ROUNDS = 5
+
+def write_new_image(path, size=COPY_SIZE):
+    """Replace an image with new contents, so the next copy of it is not skipped as unchanged."""
+    with open(path, "wb") as image_file:
+        image_file.write(os.urandom(size))
+
+def copy_file_in_chunks(src, dest, buffer_size=64 * 1024):
+    """Copy a file as the adapter did before the copy engine, updating progress on every chunk."""
+    progress = 0
+    total = os.stat(src).st_size
+    total_copied = 0
+
+    with open(src, "rb") as src_file:
+        with open(dest, "wb") as dest_file:
+            while True:
+                buf = src_file.read(buffer_size)
+                if not buf:
+                    break
+                dest_file.write(buf)
+                total_copied += len(buf)
+                progress = round((total_copied / total) * 100, 1)
+
+    shutil.copymode(src, dest)
+    assert progress == 100
+    return total_copied
+
+@pytest.fixture(params=["tmp"] + COPY_DIRS)
+def copy_dir(request, tmp_path):
+    if request.param == "tmp":
+        yield tmp_path
+        return
+
+    with tempfile.TemporaryDirectory(dir=request.param) as copy_dir:
+        yield copy_dir
+
+@pytest.mark.parametrize("size", COPY_SIZES)
+@pytest.mark.parametrize("copier", ["engine", "chunks"])
+def test_copy_file(benchmark, copy_dir, copier, size):
+    src_path = os.path.join(copy_dir, "image.ub")
+    write_new_image(src_path, size)
+    copy_file = FileCopier(lambda *progress: None).copy_file if copier == "engine" else copy_file_in_chunks
+
+    copied = benchmark(copy_file, src_path, os.path.join(copy_dir, "copy.ub"))
+
+    assert copied == size
+
+def test_backup_emmc(benchmark, controller):
+    def backup():
+        controller.set_emmc_backup(True)
+        wait_for_jobs(controller)
+
+    benchmark.pedantic(backup, setup=lambda: write_new_image(controller.emmc_base_path + "image.ub"), rounds=ROUNDS)
+
+    with open(controller.emmc_base_path + "image.ub", "rb") as emmc_file, open(controller.backup_base_path + "image.ub", "rb") as backup_file:
+        assert emmc_file.read() == backup_file.read()
+
+def test_restore_emmc(benchmark, controller):
+    def restore():
+        controller.set_restore_emmc(True)
+        wait_for_jobs(controller)
+
+    benchmark.pedantic(restore, setup=lambda: write_new_image(controller.backup_base_path + "image.ub"), rounds=ROUNDS)
+
+    with open(controller.emmc_base_path + "image.ub", "rb") as emmc_file, open(controller.backup_base_path + "image.ub", "rb") as backup_file:
+        assert emmc_file.read() == backup_file.read()
@@ -0,0 +1,66 @@
+"""Benchmarks of calculating and applying delta updates of image.ub."""
+
+import os
+import io
+import hashlib
+
+import pytest
+
+from loki_update.delta import DEFAULT_BLOCK_SIZE, block_signatures, compute_delta, apply_delta
+
+IMAGE_SIZE = 32 * 1024 * 1024
+
+CHANGED_BLOCKS = 4
+
+@pytest.fixture(scope="module")
+def images(tmp_path_factory):
+    """Write a basis image and a new release of it with a few blocks changed."""
+    image_dir = tmp_path_factory.mktemp("delta")
+    basis = bytearray(os.urandom(IMAGE_SIZE))
+    basis_path = str(image_dir / "basis.ub")
+    with open(basis_path, "wb") as image_file:
+        image_file.write(basis)
+
+    for index in range(CHANGED_BLOCKS):
+        offset = (index + 1) * IMAGE_SIZE // (CHANGED_BLOCKS + 1)
+        basis[offset:offset + 100] = os.urandom(100)
+
+    new_path = str(image_dir / "new.ub")
+    with open(new_path, "wb") as image_file:
+        image_file.write(basis)
+
+    return basis_path, new_path, hashlib.sha256(basis).hexdigest()
+
+def test_block_signatures(benchmark, images):
+    basis_path, _, _ = images
+
+    signatures = benchmark(block_signatures, basis_path)
+
+    assert len(signatures["blocks"]) == IMAGE_SIZE // DEFAULT_BLOCK_SIZE
+
+def test_compute_delta(benchmark, images):
+    basis_path, new_path, _ = images
+    signatures = block_signatures(basis_path)
+
+    literal_bytes = benchmark(lambda: compute_delta(signatures, new_path, io.BytesIO()))
+
+    assert literal_bytes == CHANGED_BLOCKS * DEFAULT_BLOCK_SIZE
+
+def test_compute_delta_after_insertion(benchmark, images, tmp_path):
+    # An insertion near the start moves every later block off the basis block boundaries
+    basis_path, _, _ = images
+    shifted_path = str(tmp_path / "shifted.ub")
+    with open(basis_path, "rb") as basis_file, open(shifted_path, "wb") as shifted_file:
+        shifted_file.write(b"inserted" + basis_file.read())
+
+    literal_bytes = benchmark(lambda: compute_delta(block_signatures(basis_path), shifted_path, io.BytesIO()))
+
+    assert literal_bytes < DEFAULT_BLOCK_SIZE
+
+def test_apply_delta(benchmark, images, tmp_path):
+    basis_path, new_path, digest = images
+    delta_path = str(tmp_path / "image.ub.delta")
+    with open(delta_path, "wb") as delta_file:
+        compute_delta(block_signatures(basis_path), new_path, delta_file)
+
+    assert benchmark(apply_delta, basis_path, delta_path, str(tmp_path / "image.ub"), DEFAULT_BLOCK_SIZE) == digest
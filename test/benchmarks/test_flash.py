@@ -0,0 +1,37 @@
+"""Benchmarks of writing images to the simulated board's file-backed MTD partitions."""
+
+import os
+import itertools
+
+from loki_update.mtd import MtdWriter
+
+IMAGE_SIZE = 4 * 1024 * 1024
+
+ROUNDS = 5
+
+def test_write_changed_image(benchmark, fake_system_root, tmp_path):
+    # Alternating between two unrelated images means every block is erased and written each round
+    images = []
+    for name in ["a.ub", "b.ub"]:
+        images.append(str(tmp_path / name))
+        with open(images[-1], "wb") as image_file:
+            image_file.write(os.urandom(IMAGE_SIZE))
+
+    writer = MtdWriter()
+    next_image = itertools.cycle(images)
+
+    blocks = benchmark.pedantic(writer.write_image, setup=lambda: ((next(next_image), fake_system_root + "/dev/mtd2"), {}), rounds=ROUNDS)
+
+    assert blocks["written"] == IMAGE_SIZE // (64 * 1024)
+
+def test_write_unchanged_image(benchmark, fake_system_root, tmp_path):
+    image_path = str(tmp_path / "image.ub")
+    with open(image_path, "wb") as image_file:
+        image_file.write(os.urandom(IMAGE_SIZE))
+
+    writer = MtdWriter()
+    writer.write_image(image_path, fake_system_root + "/dev/mtd2")
+
+    blocks = benchmark(writer.write_image, image_path, fake_system_root + "/dev/mtd2")
+
+    assert blocks["written"] == 0
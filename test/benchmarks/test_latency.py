@@ -0,0 +1,94 @@
+"""Benchmarks of the latency of parameter tree requests."""
+
+import os
+import hashlib
+import threading
+import statistics
+
+import pytest
+import requests
+
+from conftest import unused_port, wait_for_jobs
+
+DEPLOY_SIZE = 32 * 1024 * 1024
+
+DEPLOY_ROUNDS = 200
+
+def test_get_json(benchmark, controller):
+    body = benchmark(controller.get_json, "")
+
+    assert '"installed_images"' in body
+
+def test_get_tree(benchmark, board_server):
+    served = board_server()
+    wait_for_jobs(served.controller)
+    session = requests.Session()
+
+    response = benchmark(session.get, served.api_url)
+
+    assert response.status_code == 200
+
+def test_get_unchanged_subtree(benchmark, board_server):
+    served = board_server()
+    wait_for_jobs(served.controller)
+    session = requests.Session()
+    etag = session.get(served.api_url + "/installed_images").headers["ETag"]
+
+    response = benchmark(session.get, served.api_url + "/installed_images", headers={"If-None-Match": etag})
+
+    assert response.status_code == 304
+
+def deploy_repeatedly(served, upload, started, stop):
+    """Upload and deploy images to the SD card of a board until stopped, returning the number deployed.
+
+    :param upload: function uploading an image to the board through the session given
+    """
+    session = requests.Session()
+    data = os.urandom(DEPLOY_SIZE)
+    deployed = 0
+
+    while not stop.is_set():
+        data = data[1:] + data[:1]
+        session.put(served.api_url + "/copy_progress/target", json="sd").raise_for_status()
+        session.put(served.api_url + "/copy_progress/checksums",
+                    json=[{"fileName": "image.ub", "checksum": hashlib.sha256(data).hexdigest()}]).raise_for_status()
+        started.set()
+        upload(session, data)
+        wait_for_jobs(served.controller)
+        deployed += 1
+
+    return deployed
+
+@pytest.mark.parametrize("streaming", [False, True], ids=["form", "streaming"])
+def test_get_during_deploy(benchmark, board_server, streaming):
+    # Form uploads are buffered and parsed by the server before the adapter sees them
+    upload_port = unused_port()
+    served = board_server(upload_port=upload_port)
+    wait_for_jobs(served.controller)
+
+    def upload(session, data):
+        if streaming:
+            session.put(f"http://127.0.0.1:{upload_port}/upload/image.ub", data=data).raise_for_status()
+        else:
+            session.post(served.api_url, files={"file": ("image.ub", data)}).raise_for_status()
+
+    session = requests.Session()
+
+    started = threading.Event()
+    stop = threading.Event()
+    deployed = []
+    deployer = threading.Thread(target=lambda: deployed.append(deploy_repeatedly(served, upload, started, stop)))
+    deployer.start()
+    started.wait()
+
+    try:
+        response = benchmark.pedantic(session.get, (served.api_url + "/copy_progress",), rounds=DEPLOY_ROUNDS)
+    finally:
+        stop.set()
+        deployer.join()
+
+    assert response.status_code == 200
+    assert deployed[0] > 0
+
+    if benchmark.stats:
+        benchmark.extra_info["p99"] = statistics.quantiles(benchmark.stats.stats.data, n=100)[98]
@@ -0,0 +1,61 @@
+"""Benchmarks of reading the metadata of installed images."""
+
+import shutil
+import subprocess
+
+import pytest
+
+from loki_update.fdt import read_image_metadata, read_device_metadata
+from loki_update.simulation import make_fit_image, write_file
+
+from conftest import wait_for_jobs
+
+@pytest.mark.parametrize("kernel_size", [1024 * 1024, 16 * 1024 * 1024])
+def test_read_image_metadata(benchmark, tmp_path, kernel_size):
+    path = str(tmp_path / "image.ub")
+    write_file(path, make_fit_image(kernel_size=kernel_size))
+
+    metadata = benchmark(read_image_metadata, path)
+
+    assert metadata["application-name"] == "loki-sim"
+
+def read_image_metadata_with_tools(path, dtb_path):
+    """Read image metadata as the adapter did before parsing in-process, with fdtget and dumpimage."""
+    def fdtget(image_path, node, name, value_type="s"):
+        return subprocess.run(["fdtget", "-t", value_type, image_path, node, name], capture_output=True, text=True, check=True).stdout.strip()
+
+    if subprocess.run(["fdtget", "-t", "s", path, "/loki-metadata", "loki-version"], capture_output=True).returncode != 0:
+        subprocess.run(["dumpimage", "-T", "flat_dt", "-p", "1", path, "-o", dtb_path], capture_output=True, check=True)
+        metadata_path = dtb_path
+    else:
+        metadata_path = path
+
+    metadata = {name: fdtget(metadata_path, "/loki-metadata", name)
+                for name in ["application-name", "application-version", "loki-version", "platform"]}
+    metadata["timestamp"] = fdtget(path, "/", "timestamp", "i")
+    return metadata
+
+@pytest.mark.skipif(not (shutil.which("fdtget") and shutil.which("dumpimage")), reason="fdtget and dumpimage are not installed")
+@pytest.mark.parametrize("kernel_size", [1024 * 1024, 16 * 1024 * 1024])
+def test_read_image_metadata_with_tools(benchmark, tmp_path, kernel_size):
+    path = str(tmp_path / "image.ub")
+    write_file(path, make_fit_image(kernel_size=kernel_size))
+
+    metadata = benchmark(read_image_metadata_with_tools, path, str(tmp_path / "system.dtb"))
+
+    assert metadata["application-name"] == "loki-sim"
+
+def test_read_flash_metadata(benchmark, fake_system_root):
+    metadata, _ = benchmark(read_device_metadata, fake_system_root + "/dev/mtd2")
+
+    assert metadata["application-name"] == "loki-sim"
+
+def test_refresh_all_image_info(benchmark, controller):
+    def refresh():
+        controller.set_refresh_all_image_info(True)
+        wait_for_jobs(controller)
+
+    benchmark(refresh)
+
+    assert controller.emmc_installed_image["app_name"] == "loki-sim"
+    assert controller.flash_app_name == "loki-sim"
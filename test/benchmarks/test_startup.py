@@ -0,0 +1,27 @@
+"""Benchmarks of the time taken to load the adapter."""
+
+import pytest
+
+from loki_update.adapter import LokiUpdateAdapter
+
+ROUNDS = 20
+
+# Target load time with every device probe deferred
+DEFERRED_LOAD_TIME = 0.1
+
+@pytest.mark.parametrize("probe_on_startup", [False, True], ids=["deferred", "probe"])
+def test_load_adapter(benchmark, simulated_board, release_server, server_thread, probe_on_startup):
+    options = simulated_board.adapter_options(github_api_url=release_server + "/repos", probe_on_startup=probe_on_startup)
+    adapters = []
+
+    def load():
+        adapters.append(server_thread.call(lambda: LokiUpdateAdapter(**options)))
+
+    try:
+        benchmark.pedantic(load, rounds=ROUNDS)
+    finally:
+        for adapter in adapters:
+            server_thread.call(adapter.cleanup)
+
+    if benchmark.stats and not probe_on_startup:
+        assert benchmark.stats.stats.mean < DEFERRED_LOAD_TIME
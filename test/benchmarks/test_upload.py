@@ -0,0 +1,57 @@
+"""Benchmarks of uploading an image to a board over HTTP, until it has been deployed."""
+
+import os
+import hashlib
+import itertools
+
+import requests
+
+from conftest import unused_port, wait_for_jobs
+
+UPLOAD_SIZE = 8 * 1024 * 1024
+
+ROUNDS = 5
+
+def upload_rounds(served, session):
+    """Get a benchmark setup function giving each round a new image, with its checksum set on the board."""
+    images = itertools.cycle([os.urandom(UPLOAD_SIZE), os.urandom(UPLOAD_SIZE)])
+
+    def setup():
+        data = next(images)
+        session.put(served.api_url + "/copy_progress/target", json="sd").raise_for_status()
+        session.put(served.api_url + "/copy_progress/checksums",
+                    json=[{"fileName": "image.ub", "checksum": hashlib.sha256(data).hexdigest()}]).raise_for_status()
+        return (data,), {}
+
+    return setup
+
+def read_installed(served):
+    with open(served.board.sd_path + "image.ub", "rb") as image_file:
+        return image_file.read()
+
+def test_upload_form(benchmark, board_server):
+    served = board_server()
+    session = requests.Session()
+
+    def upload(data):
+        session.post(served.api_url, files={"file": ("image.ub", data)}).raise_for_status()
+        wait_for_jobs(served.controller)
+        return data
+
+    data = benchmark.pedantic(upload, setup=upload_rounds(served, session), rounds=ROUNDS)
+
+    assert read_installed(served) == data
+
+def test_upload_streaming(benchmark, board_server):
+    upload_port = unused_port()
+    served = board_server(upload_port=upload_port)
+    session = requests.Session()
+
+    def upload(data):
+        session.put(f"http://127.0.0.1:{upload_port}/upload/image.ub", data=data).raise_for_status()
+        wait_for_jobs(served.controller)
+        return data
+
+    data = benchmark.pedantic(upload, setup=upload_rounds(served, session), rounds=ROUNDS)
+
+    assert read_installed(served) == data
@@ -0,0 +1,187 @@
+"""Fixtures running loki-update against simulated LOKI boards.
+
+The boards are built by loki_update.simulation: a temporary root holding eMMC, SD and backup
+mount directories with synthetic FIT images, file-backed MTD partitions with a fake /proc/mtd
+and /sys/class/mtd, MMC block device statistics and the live devicetree. Releases are served
+by a local stand-in for the GitHub API, and the adapter can be served over HTTP, as
+odin-control serves it, on a background IOLoop.
+"""
+
+import time
+import asyncio
+import threading
+from concurrent import futures
+
+import pytest
+import tornado.web
+import tornado.ioloop
+import tornado.testing
+import tornado.httpserver
+from odin.http.routes.api import ApiRoute
+
+from loki_update.adapter import LokiUpdateAdapter
+from loki_update.controller import LokiUpdateController
+from loki_update.simulation import SimulatedBoard, make_release, make_release_app
+
+# Release tags served by the release server fixture
+RELEASE_TAGS = ["1.1.0", "1.2.0"]
+
+# Size in bytes of the kernel in the synthetic images, small enough to keep the tests fast
+KERNEL_SIZE = 256 * 1024
+
+class ServerThread():
+    """
+    Tornado IOLoop running on a background thread, serving applications to the tests
+    """
+
+    def __init__(self):
+        self.io_loop = None
+        self.servers = []
+        ready = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(asyncio.new_event_loop())
+            self.io_loop = tornado.ioloop.IOLoop.current()
+            ready.set()
+            self.io_loop.start()
+
+        self.thread = threading.Thread(target=run, daemon=True)
+        self.thread.start()
+        ready.wait()
+
+    def call(self, function, *args):
+        """Call a function, or await a coroutine function, on the IOLoop thread and return its result."""
+        future = futures.Future()
+
+        async def run():
+            try:
+                result = function(*args)
+                if asyncio.iscoroutine(result):
+                    result = await result
+                future.set_result(result)
+            except Exception as error:
+                future.set_exception(error)
+
+        self.io_loop.add_callback(run)
+        return future.result()
+
+    def listen(self, application):
+        """Serve an application on an unused port.
+
+        :return: the port the application is served on
+        """
+        def start():
+            sock, port = tornado.testing.bind_unused_port()
+            server = tornado.httpserver.HTTPServer(application)
+            server.add_sockets([sock])
+            self.servers.append(server)
+            return port
+
+        return self.call(start)
+
+    def stop(self):
+        self.call(lambda: [server.stop() for server in self.servers])
+        self.io_loop.add_callback(self.io_loop.stop)
+        self.thread.join()
+
+class ServedBoard():
+    """
+    Simulated board with the adapter served over HTTP
+    """
+
+    def __init__(self, board, adapter, url):
+        self.board = board
+        self.adapter = adapter
+        self.controller = adapter.controller
+        self.url = url
+        self.api_url = f"{url}/api/0.1/loki-update"
+
+def unused_port():
+    sock, port = tornado.testing.bind_unused_port()
+    sock.close()
+    return port
+
+def wait_for_jobs(controller, timeout=30):
+    """Wait until every job submitted to a controller has finished.
+
+    :return: dictionary of the jobs, as reported in the parameter tree
+    """
+    deadline = time.monotonic() + timeout
+    while any(job["status"] in ("queued", "running") for job in controller.scheduler.get_jobs().values()):
+        if time.monotonic() > deadline:
+            raise TimeoutError("Jobs did not finish in time")
+        time.sleep(0.001)
+
+    return controller.scheduler.get_jobs()
+
+@pytest.fixture
+def server_thread():
+    thread = ServerThread()
+    yield thread
+    thread.stop()
+
+@pytest.fixture
+def simulated_board(tmp_path):
+    """Simulated board, with the same image installed on every device."""
+    board = SimulatedBoard(str(tmp_path / "board"))
+    board.create(kernel_size=KERNEL_SIZE)
+    return board
+
+@pytest.fixture
+def fake_system_root(simulated_board):
+    """Root of the simulated board's /sys, /proc and /dev, passed to the adapter as system_root."""
+    return simulated_board.root
+
+@pytest.fixture
+def releases():
+    """Release assets served by the release server, by tag and asset name."""
+    return {tag: make_release(tag, KERNEL_SIZE) for tag in RELEASE_TAGS}
+
+@pytest.fixture
+def release_server(server_thread, releases):
+    """Base URL of a local stand-in for the GitHub releases API, serving the releases fixture."""
+    port = server_thread.listen(make_release_app(releases))
+    return f"http://127.0.0.1:{port}"
+
+@pytest.fixture
+def controller(simulated_board, release_server):
+    """Controller running against the simulated board, retrieving releases from the release server."""
+    controller = LokiUpdateController(simulated_board.emmc_path, simulated_board.sd_path, simulated_board.backup_path,
+                                      False, False, True, [{"name": "loki", "owner": "stfc-aeg"}],
+                                      metadata_cache_path=simulated_board.root + "/metadata.json",
+                                      checksum_cache_path=simulated_board.root + "/checksums.json",
+                                      artifact_cache_dir=simulated_board.root + "/artifacts/",
+                                      catalogue_snapshot_path=simulated_board.root + "/catalogue.json",
+                                      system_root=simulated_board.root,
+                                      github_api_url=release_server + "/repos")
+    wait_for_jobs(controller)
+    yield controller
+    controller.cleanup()
+
+@pytest.fixture
+def board_server(tmp_path, server_thread, release_server):
+    """Factory serving the adapter on simulated boards over HTTP, as odin-control does.
+
+    Each call creates a board and returns it as a ServedBoard. Keyword arguments are passed to
+    SimulatedBoard.adapter_options, overriding the defaults.
+    """
+    adapters = []
+
+    def serve(name=None, **options):
+        board = SimulatedBoard(str(tmp_path / (name or f"board{len(adapters) + 1}")))
+        board.create(kernel_size=KERNEL_SIZE)
+
+        adapter_options = board.adapter_options(github_api_url=release_server + "/repos", **options)
+        adapter = server_thread.call(lambda: LokiUpdateAdapter(**adapter_options))
+        adapters.append(adapter)
+
+        route = ApiRoute()
+        route.adapters["loki-update"] = adapter
+        port = server_thread.listen(tornado.web.Application(route.get_handlers()))
+
+        return ServedBoard(board, adapter, f"http://127.0.0.1:{port}")
+
+    yield serve
+
+    for adapter in adapters:
+        server_thread.call(adapter.cleanup)
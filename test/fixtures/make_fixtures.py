@@ -0,0 +1,163 @@
+"""Generate the FIT image fixtures and their expected contents with libfdt.
+
+The images are laid out as PetaLinux builds image.ub, and are written with libfdt's
+sequential writer rather than the simulator's own encoder, so the parser is checked against
+blobs it had no part in building. The expected contents are read back with libfdt, the library
+fdtget is built on, and saved next to each image.
+
+Run with: python test/fixtures/make_fixtures.py (requires pylibfdt)
+"""
+
+import os
+import json
+import struct
+import hashlib
+
+import libfdt
+
+FIXTURES_DIR = os.path.dirname(os.path.abspath(__file__))
+
+TIMESTAMP = 1718000000
+KERNEL_SIZE = 8 * 1024
+DTB_NAME = "fdt-system-top.dtb"
+
+METADATA = {
+    "application-name": "loki-fixture",
+    "application-version": "2.3.1",
+    "loki-version": "1.4.0",
+    "platform": "zynqmp"
+}
+
+def u32(value):
+    return struct.pack(">I", value)
+
+def strings(*values):
+    return b"".join(value.encode() + b"\0" for value in values)
+
+def make_kernel():
+    return b"".join(hashlib.sha256(struct.pack(">I", block)).digest() for block in range(KERNEL_SIZE // 32))
+
+def write_tree(root):
+    """Write a device tree with libfdt's sequential writer.
+
+    :param root: root node, as a tuple of its name, a list of (name, bytes) properties and a list of child nodes
+    """
+    sw = libfdt.FdtSw()
+    sw.finish_reservemap()
+
+    def add_node(node):
+        name, properties, children = node
+        sw.begin_node(name)
+        for property_name, value in properties:
+            sw.property(property_name, value)
+        for child in children:
+            add_node(child)
+        sw.end_node()
+
+    add_node(root)
+    fdt = sw.as_fdt()
+    fdt.pack()
+    return bytes(fdt.as_bytearray())
+
+def make_dtb():
+    return write_tree(("", [("#address-cells", u32(2)), ("#size-cells", u32(2)),
+                            ("compatible", strings("xlnx,zynqmp-zcu102-rev1.0", "xlnx,zynqmp")),
+                            ("model", strings("LOKI fixture"))], [
+        ("chosen", [("bootargs", strings("earlycon console=ttyPS0,115200 root=/dev/mmcblk0p2 rw rootwait"))], []),
+        ("cpus", [("#address-cells", u32(1)), ("#size-cells", u32(0))], [
+            (f"cpu@{index}", [("compatible", strings("arm,cortex-a53")), ("device_type", strings("cpu")), ("reg", u32(index))], [])
+            for index in range(4)
+        ]),
+        ("loki-metadata", [(name, strings(value)) for name, value in METADATA.items()], []),
+        ("memory@0", [("device_type", strings("memory")), ("reg", struct.pack(">4I", 0, 0, 0, 0x7ff00000))], [])
+    ]))
+
+def image_node(name, data_properties, image_type, description, extra):
+    hash_node = ("hash-1", [("algo", strings("sha256"))], [])
+    return (name, [("description", strings(description)), *data_properties, ("type", strings(image_type)),
+                   ("arch", strings("arm64")), ("compression", strings("none")), *extra], [hash_node])
+
+def make_fit(kernel, dtb, external):
+    """Build a FIT image, with its data embedded or, as mkimage -E does, stored after the structure."""
+    if external:
+        kernel_data = [("data-offset", u32(0)), ("data-size", u32(len(kernel)))]
+        dtb_data = [("data-offset", u32((len(kernel) + 3) & ~3)), ("data-size", u32(len(dtb)))]
+    else:
+        kernel_data = [("data", kernel)]
+        dtb_data = [("data", dtb)]
+
+    fit = write_tree(("", [("timestamp", u32(TIMESTAMP)), ("description", strings("Kernel fitImage for PetaLinux")),
+                           ("#address-cells", u32(1))], [
+        ("images", [], [
+            image_node("kernel-1", kernel_data, "kernel", "Linux kernel",
+                       [("os", strings("linux")), ("load", u32(0x200000)), ("entry", u32(0x200000))]),
+            image_node(DTB_NAME, dtb_data, "flat_dt", "Flattened Device Tree blob", [])
+        ]),
+        ("configurations", [("default", strings("conf-system-top.dtb"))], [
+            ("conf-system-top.dtb", [("description", strings("1 Linux kernel, FDT blob")),
+                                     ("kernel", strings("kernel-1")), ("fdt", strings(DTB_NAME))], [])
+        ])
+    ]))
+
+    if external:
+        fit = fit + bytes(-len(fit) % 4) + kernel + bytes(-len(kernel) % 4) + dtb
+
+    return fit
+
+def describe_tree(blob):
+    """Read every node and property of a device tree with libfdt.
+
+    :return: dictionary of each node path, giving the length and SHA-256 of each property value
+    """
+    fdt = libfdt.Fdt(blob)
+    nodes = {}
+
+    def visit(offset, path):
+        properties = {}
+        prop_offset = fdt.first_property_offset(offset, libfdt.QUIET_NOTFOUND)
+        while prop_offset >= 0:
+            prop = fdt.get_property_by_offset(prop_offset)
+            properties[prop.name] = {"length": len(prop), "sha256": hashlib.sha256(bytes(prop)).hexdigest()}
+            prop_offset = fdt.next_property_offset(prop_offset, libfdt.QUIET_NOTFOUND)
+        nodes[path] = properties
+
+        child = fdt.first_subnode(offset, libfdt.QUIET_NOTFOUND)
+        while child >= 0:
+            visit(child, path.rstrip("/") + "/" + fdt.get_name(child))
+            child = fdt.next_subnode(child, libfdt.QUIET_NOTFOUND)
+
+    visit(0, "/")
+    return nodes
+
+def read_expected(blob, external):
+    """Read the LOKI metadata from a FIT image with libfdt, as fdtget and dumpimage would."""
+    fit = libfdt.Fdt(blob)
+    dtb_node = fit.path_offset(f"/images/{DTB_NAME}")
+
+    if external:
+        start = ((fit.totalsize() + 3) & ~3) + fit.getprop(dtb_node, "data-offset").as_uint32()
+        dtb = blob[start:start + fit.getprop(dtb_node, "data-size").as_uint32()]
+    else:
+        dtb = bytes(fit.getprop(dtb_node, "data"))
+
+    metadata_fdt = libfdt.Fdt(dtb)
+    metadata_node = metadata_fdt.path_offset("/loki-metadata")
+    metadata = {name: metadata_fdt.getprop(metadata_node, name).as_str() for name in METADATA}
+    metadata["timestamp"] = str(fit.getprop(0, "timestamp").as_uint32())
+
+    return {"metadata": metadata, "nodes": describe_tree(blob), "dtb_nodes": describe_tree(dtb)}
+
+def main():
+    kernel = make_kernel()
+    dtb = make_dtb()
+
+    for name, external in [("image.ub", False), ("image-external.ub", True)]:
+        blob = make_fit(kernel, dtb, external)
+        with open(os.path.join(FIXTURES_DIR, name), "wb") as image_file:
+            image_file.write(blob)
+        with open(os.path.join(FIXTURES_DIR, name + ".json"), "w") as expected_file:
+            json.dump(read_expected(blob, external), expected_file, indent=4, sort_keys=True)
+            expected_file.write("\n")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Tests of the adapter's handling of concurrent requests."""
+
+import time
+import threading
+from concurrent import futures
+
+import requests
+
+from conftest import wait_for_jobs
+
+def test_setters_run_one_at_a_time(board_server):
+    served = board_server()
+    controller = served.controller
+    set_tree = controller.set
+    running = []
+    overlaps = []
+
+    def slow_set(path, data):
+        running.append(path)
+        overlaps.append(len(running))
+        time.sleep(0.05)
+        set_tree(path, data)
+        running.remove(path)
+
+    controller.set = slow_set
+
+    with futures.ThreadPoolExecutor(4) as executor:
+        responses = list(executor.map(lambda target: requests.put(served.api_url + "/copy_progress", json={"target": target}),
+                                      ["sd", "emmc", "sd", "emmc"]))
+
+    assert all(response.status_code == 200 for response in responses)
+    assert max(overlaps) == 1
+
+def test_release_keeps_target_it_was_requested_with(board_server, releases):
+    served = board_server()
+    controller = served.controller
+    requests.put(served.api_url + "/copy_progress", json={"target": "sd"}).raise_for_status()
+
+    # Hold the download back until the target has changed
+    release_download = threading.Event()
+    download = controller.download_release_assets
+    controller.download_release_assets = lambda *args: release_download.wait(10) and download(*args)
+
+    requests.put(served.api_url + "/github_repos", json={"release_to_retrieve": {"repo": "loki", "tag": "1.1.0"}}).raise_for_status()
+    requests.put(served.api_url + "/copy_progress", json={"target": "emmc"}).raise_for_status()
+    release_download.set()
+
+    jobs = wait_for_jobs(controller)
+    copies = [job["name"] for job in jobs.values() if job["name"].startswith("copy_to_")]
+    assert copies == ["copy_to_sd"]
+
+    with open(served.board.sd_path + "image.ub", "rb") as sd_image:
+        assert sd_image.read() == releases["1.1.0"]["image.ub"]
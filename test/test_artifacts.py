@@ -0,0 +1,105 @@
+"""Tests of the on-disk cache of release assets."""
+
+import os
+import hashlib
+
+import pytest
+
+from loki_update.artifacts import ArtifactCache
+
+def write_asset(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as out_file:
+        out_file.write(data)
+    return path
+
+def read_file(path):
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+@pytest.fixture
+def cache_dir(tmp_path):
+    return str(tmp_path / "artifacts")
+
+def test_put_and_get(cache_dir, tmp_path):
+    cache = ArtifactCache(cache_dir)
+    src_path = write_asset(str(tmp_path / "image.ub"), b"image 1.1.0")
+
+    digest = cache.put("stfc-aeg", "loki", "1.1.0", "image.ub", src_path)
+    # The asset is copied, so later changes to the source do not reach the cache
+    write_asset(src_path, b"rewritten")
+
+    path, cached_digest = cache.get("stfc-aeg", "loki", "1.1.0", "image.ub")
+    assert cached_digest == digest == hashlib.sha256(b"image 1.1.0").hexdigest()
+    assert read_file(path) == b"image 1.1.0"
+    assert cache.get("stfc-aeg", "loki", "1.2.0", "image.ub") is None
+
+def test_identical_assets_stored_once(cache_dir, tmp_path):
+    cache = ArtifactCache(cache_dir, max_size=100)
+    src_path = write_asset(str(tmp_path / "BOOT.BIN"), b"x" * 60)
+
+    cache.put("stfc-aeg", "loki", "1.1.0", "BOOT.BIN", src_path)
+    cache.put("stfc-aeg", "loki", "1.2.0", "BOOT.BIN", src_path)
+
+    assert cache.total_size() == 60
+    assert cache.get_tags("stfc-aeg", "loki", ["BOOT.BIN"]) == ["1.1.0", "1.2.0"]
+
+def test_least_recently_used_evicted(cache_dir, tmp_path):
+    cache = ArtifactCache(cache_dir, max_size=250)
+    for tag in ["1.0.0", "1.1.0"]:
+        cache.put("stfc-aeg", "loki", tag, "image.ub", write_asset(str(tmp_path / tag), tag.encode() * 20))
+    cache.get("stfc-aeg", "loki", "1.0.0", "image.ub")
+
+    cache.put("stfc-aeg", "loki", "1.2.0", "image.ub", write_asset(str(tmp_path / "1.2.0"), b"1.2.0" * 20))
+
+    assert cache.get_tags("stfc-aeg", "loki", ["image.ub"]) == ["1.0.0", "1.2.0"]
+    assert sum(len(files) for _, _, files in os.walk(os.path.join(cache_dir, "objects"))) == 2
+
+def test_index_reloaded(cache_dir, tmp_path):
+    ArtifactCache(cache_dir).put("stfc-aeg", "loki", "1.1.0", "boot.scr", write_asset(str(tmp_path / "boot.scr"), b"boot"))
+
+    assert read_file(ArtifactCache(cache_dir).get("stfc-aeg", "loki", "1.1.0", "boot.scr")[0]) == b"boot"
+
+def test_damaged_asset_removed(cache_dir, tmp_path):
+    cache = ArtifactCache(cache_dir)
+    cache.put("stfc-aeg", "loki", "1.1.0", "image.ub", write_asset(str(tmp_path / "image.ub"), b"image"))
+    path, digest = cache.get("stfc-aeg", "loki", "1.1.0", "image.ub")
+
+    # Damage which keeps the size is caught when chunk hashes are calculated for peers
+    write_asset(path, b"IMAGE")
+    assert cache.get_chunk_hashes(digest, 2) is None
+
+    write_asset(path, b"imag")
+    assert cache.get("stfc-aeg", "loki", "1.1.0", "image.ub") is None
+    assert not os.path.exists(path)
+
+def test_chunk_hashes(cache_dir, tmp_path):
+    cache = ArtifactCache(cache_dir)
+    digest = cache.put("stfc-aeg", "loki", "1.1.0", "image.ub", write_asset(str(tmp_path / "image.ub"), b"abcdefg"))
+
+    assert cache.get_chunk_hashes(digest, 3) == [hashlib.sha256(chunk).hexdigest() for chunk in [b"abc", b"def", b"g"]]
+
+def test_seed_from_directory(cache_dir, tmp_path):
+    seed_dir = str(tmp_path / "seed")
+    for tag in ["1.1.0", "1.2.0"]:
+        for name in ["image.ub", "BOOT.BIN"]:
+            write_asset(os.path.join(seed_dir, tag, name), f"{name} {tag}".encode())
+    cache = ArtifactCache(cache_dir)
+
+    assert cache.seed_from_directory("stfc-aeg", "loki", seed_dir) == 4
+    assert cache.seed_from_directory("stfc-aeg", "loki", seed_dir) == 0
+    assert cache.get_tags("stfc-aeg", "loki", ["image.ub", "BOOT.BIN"]) == ["1.1.0", "1.2.0"]
+
+def test_unusable_directory_disables_cache(tmp_path):
+    write_asset(str(tmp_path / "state"), b"not a directory")
+
+    cache = ArtifactCache(str(tmp_path / "state" / "artifacts"))
+
+    assert not cache.enabled
+
+def test_adapter_loads_without_cache(board_server, tmp_path):
+    write_asset(str(tmp_path / "state"), b"not a directory")
+
+    served = board_server(artifact_cache_dir=str(tmp_path / "state" / "artifacts") + "/")
+
+    assert served.controller.artifact_cache is None
@@ -0,0 +1,133 @@
+"""Tests of the image metadata cache."""
+
+import os
+
+import pytest
+
+from loki_update.cache import MetadataCache
+
+METADATA = {"app_name": "loki-sim", "app_version": "1.0.0"}
+
+def write_file(path, data):
+    with open(path, "wb") as out_file:
+        out_file.write(data)
+
+@pytest.fixture
+def image(tmp_path):
+    path = str(tmp_path / "image.ub")
+    write_file(path, b"image" * 1000)
+    return path
+
+@pytest.fixture
+def cache(tmp_path):
+    return MetadataCache(str(tmp_path / "state" / "metadata.json"))
+
+def test_hit_for_unchanged_file(cache, image):
+    assert cache.get(image) is None
+
+    cache.put(image, METADATA)
+
+    assert cache.get(image) == METADATA
+
+def test_size_change_invalidates(cache, image):
+    cache.put(image, METADATA)
+    stat = os.stat(image)
+
+    write_file(image, b"image" * 1001)
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert cache.get(image) is None
+
+def test_mtime_change_invalidates(cache, image):
+    cache.put(image, METADATA)
+    stat = os.stat(image)
+
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+
+    assert cache.get(image) is None
+
+def test_inode_change_invalidates(cache, image):
+    cache.put(image, METADATA)
+    stat = os.stat(image)
+
+    # Replace the file with one of the same size and mtime, as a rename into place would
+    replacement = image + ".new"
+    write_file(replacement, b"IMAGE" * 1000)
+    os.utime(replacement, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    os.replace(replacement, image)
+
+    assert os.stat(image).st_ino != stat.st_ino
+    assert cache.get(image) is None
+
+def test_verify_detects_rewrite_in_place(image):
+    cache = MetadataCache(verify=True)
+    unverified = MetadataCache()
+    cache.put(image, METADATA)
+    unverified.put(image, METADATA)
+    stat = os.stat(image)
+
+    with open(image, "r+b") as image_file:
+        image_file.write(b"IMAGE")
+    os.utime(image, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    assert unverified.get(image) == METADATA
+    assert cache.get(image) is None
+
+def test_least_recently_used_evicted(tmp_path):
+    cache = MetadataCache(max_entries=2)
+    paths = []
+    for name in ["a", "b", "c"]:
+        paths.append(str(tmp_path / name))
+        write_file(paths[-1], name.encode())
+
+    cache.put(paths[0], {"name": "a"})
+    cache.put(paths[1], {"name": "b"})
+    cache.get(paths[0])
+    cache.put(paths[2], {"name": "c"})
+
+    assert cache.get(paths[0]) == {"name": "a"}
+    assert cache.get(paths[1]) is None
+    assert cache.get(paths[2]) == {"name": "c"}
+
+def test_put_replaces_entries_for_path(cache, image):
+    cache.put(image, METADATA)
+    write_file(image, b"new image")
+    cache.put(image, dict(METADATA, app_version="1.1.0"))
+
+    assert len(cache.entries) == 1
+    assert cache.get(image)["app_version"] == "1.1.0"
+
+def test_invalidate(cache, image):
+    cache.put(image, METADATA)
+
+    cache.invalidate(image)
+
+    assert cache.get(image) is None
+    assert MetadataCache(cache.store_path).get(image) is None
+
+def test_persisted_across_instances(cache, image):
+    cache.put(image, METADATA)
+
+    assert MetadataCache(cache.store_path).get(image) == METADATA
+
+def test_persisted_entries_limited(tmp_path):
+    store_path = str(tmp_path / "metadata.json")
+    cache = MetadataCache(store_path, max_entries=3)
+    for index in range(3):
+        path = str(tmp_path / f"image{index}")
+        write_file(path, bytes([index]))
+        cache.put(path, {"index": index})
+
+    reloaded = MetadataCache(store_path, max_entries=2)
+
+    assert [entry["metadata"]["index"] for entry in reloaded.entries.values()] == [1, 2]
+
+def test_corrupt_store_ignored(tmp_path, image):
+    store_path = str(tmp_path / "metadata.json")
+    write_file(store_path, b"{not json")
+
+    cache = MetadataCache(store_path)
+
+    assert cache.get(image) is None
+    cache.put(image, METADATA)
+    assert MetadataCache(store_path).get(image) == METADATA
@@ -0,0 +1,144 @@
+"""Tests of the release catalogue against a paginated stand-in for the GitHub releases API."""
+
+import json
+import types
+import hashlib
+
+import pytest
+import tornado.web
+
+from loki_update.catalogue import ReleaseCatalogue
+from loki_update.download import make_session
+
+from conftest import unused_port
+
+PAGE_SIZE = 2
+
+class PagedReleaseHandler(tornado.web.RequestHandler):
+    """
+    Request handler listing releases a page at a time, with Link headers and ETags as GitHub does
+    """
+
+    def initialize(self, server):
+        self.server = server
+
+    def get(self, owner, repo):
+        page = int(self.get_query_argument("page", "1"))
+        releases = self.server.releases[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+        body = json.dumps(releases)
+        etag = '"' + hashlib.sha256(body.encode()).hexdigest()[:16] + '"'
+        self.server.requests.append((page, self.request.headers.get("If-None-Match")))
+
+        if page * PAGE_SIZE < len(self.server.releases):
+            next_url = f"{self.request.protocol}://{self.request.host}{self.request.path}?per_page=100&page={page + 1}"
+            self.set_header("Link", f'<{next_url}>; rel="next"')
+
+        if self.request.headers.get("If-None-Match") == etag:
+            self.set_status(304)
+            return
+
+        self.set_header("ETag", etag)
+        self.write(body)
+
+def make_release(tag, assets=("image.ub", "BOOT.BIN")):
+    return {"tag_name": tag, "assets": [{"name": name} for name in assets]}
+
+@pytest.fixture
+def api(server_thread):
+    """Paginated releases API, holding the releases it lists and the requests made to it."""
+    server = types.SimpleNamespace(releases=[make_release(f"1.{minor}.0") for minor in range(5)], requests=[])
+    port = server_thread.listen(tornado.web.Application([(r"/repos/([^/]+)/([^/]+)/releases", PagedReleaseHandler, dict(server=server))]))
+    server.url = f"http://127.0.0.1:{port}/repos"
+    return server
+
+def make_catalogue(api_url, snapshot_path=None):
+    return ReleaseCatalogue(make_session(), api_url, [{"owner": "stfc-aeg", "name": "loki"}], ["image.ub"], snapshot_path)
+
+def test_pages_followed(api):
+    catalogue = make_catalogue(api.url)
+
+    assert catalogue.refresh()
+
+    assert catalogue.get_tags("stfc-aeg", "loki") == [release["tag_name"] for release in api.releases]
+    assert [page for page, _ in api.requests] == [1, 2, 3]
+    assert catalogue.last_updated is not None
+    assert catalogue.error_message == ""
+
+def test_releases_without_required_assets_not_listed(api):
+    api.releases.insert(0, make_release("2.0.0-rc1", assets=("BOOT.BIN",)))
+    catalogue = make_catalogue(api.url)
+
+    catalogue.refresh()
+
+    assert "2.0.0-rc1" not in catalogue.get_tags("stfc-aeg", "loki")
+
+def test_unchanged_pages_not_modified(api):
+    catalogue = make_catalogue(api.url)
+    catalogue.refresh()
+    pages = dict(catalogue.pages)
+    api.requests.clear()
+
+    assert catalogue.refresh()
+
+    # Every page is requested with its ETag, and the cached copy kept on a 304
+    assert all(etag is not None for _, etag in api.requests)
+    assert [page for page, _ in api.requests] == [1, 2, 3]
+    assert catalogue.pages == pages
+
+def test_changed_page_fetched(api):
+    catalogue = make_catalogue(api.url)
+    catalogue.refresh()
+    version = catalogue.version
+
+    api.releases.append(make_release("1.5.0"))
+    catalogue.refresh()
+
+    assert catalogue.get_tags("stfc-aeg", "loki")[-1] == "1.5.0"
+    assert catalogue.version > version
+
+def test_unreachable_repository_keeps_tags(api):
+    catalogue = make_catalogue(api.url)
+    catalogue.refresh()
+    tags = catalogue.get_tags("stfc-aeg", "loki")
+    last_updated = catalogue.last_updated
+
+    catalogue.api_url = f"http://127.0.0.1:{unused_port()}/repos"
+
+    assert not catalogue.refresh()
+    assert "loki" in catalogue.error_message
+    assert catalogue.last_updated == last_updated
+    catalogue.api_url = api.url
+    assert catalogue.get_tags("stfc-aeg", "loki") == tags
+
+def test_snapshot_restored(api, tmp_path):
+    snapshot_path = str(tmp_path / "state" / "catalogue.json")
+    catalogue = make_catalogue(api.url, snapshot_path)
+    catalogue.refresh()
+
+    # A new catalogue lists the tags from the snapshot without any network access
+    restored = make_catalogue(api.url, snapshot_path)
+    assert restored.get_tags("stfc-aeg", "loki") == catalogue.get_tags("stfc-aeg", "loki")
+    assert restored.last_updated == catalogue.last_updated
+
+    # and refreshes with the ETags it was saved with
+    api.requests.clear()
+    restored.refresh()
+    assert all(etag is not None for _, etag in api.requests)
+
+def test_corrupt_snapshot_ignored(api, tmp_path):
+    snapshot_path = tmp_path / "catalogue.json"
+    snapshot_path.write_text("{\"pages\": ")
+
+    catalogue = make_catalogue(api.url, str(snapshot_path))
+
+    assert catalogue.pages == {}
+    assert catalogue.get_tags("stfc-aeg", "loki") == []
+
+def test_refresh_notifies(api):
+    catalogue = make_catalogue(api.url)
+    refreshes = []
+    catalogue.on_change = lambda: refreshes.append(catalogue.version)
+
+    catalogue.refresh()
+
+    assert refreshes == [catalogue.version]
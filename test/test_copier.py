@@ -0,0 +1,89 @@
+"""Tests of the copy engine and its fallbacks."""
+
+import os
+import errno
+
+import pytest
+
+from loki_update.copier import CopyError, FileCopier
+
+COPY_SIZE = 3 * 1024 * 1024 + 123
+
+def unsupported(*args):
+    raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+@pytest.fixture
+def src_path(tmp_path):
+    path = str(tmp_path / "image.ub")
+    with open(path, "wb") as src_file:
+        src_file.write(os.urandom(COPY_SIZE))
+    os.chmod(path, 0o640)
+    return path
+
+def read_file(path):
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+def copy(src_path, dest_path, **options):
+    progress = []
+    copied = FileCopier(lambda *report: progress.append(report), buffer_size=64 * 1024, call_size=1024 * 1024,
+                        **options).copy_file(src_path, dest_path)
+
+    assert read_file(dest_path) == read_file(src_path)
+    assert progress[-1][:2] == (COPY_SIZE, COPY_SIZE)
+    return copied
+
+def test_copy_file(src_path, tmp_path):
+    dest_path = str(tmp_path / "copy.ub")
+
+    assert copy(src_path, dest_path) == COPY_SIZE
+    assert os.stat(dest_path).st_mode & 0o777 == 0o640
+
+def test_falls_back_to_sendfile(src_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", unsupported)
+
+    assert copy(src_path, str(tmp_path / "copy.ub")) == COPY_SIZE
+
+def test_falls_back_to_buffered_copy(src_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", unsupported)
+    monkeypatch.setattr(os, "sendfile", unsupported)
+
+    assert copy(src_path, str(tmp_path / "copy.ub")) == COPY_SIZE
+
+def test_resumes_after_copy_range_stops_early(src_path, tmp_path, monkeypatch):
+    # Copy one call's worth, then report end of file as some filesystems do
+    copy_file_range = os.copy_file_range
+    calls = []
+
+    def stop_early(*args):
+        calls.append(args)
+        return copy_file_range(*args) if len(calls) == 1 else 0
+
+    monkeypatch.setattr(os, "copy_file_range", stop_early)
+    monkeypatch.setattr(os, "sendfile", unsupported)
+
+    assert copy(src_path, str(tmp_path / "copy.ub")) == COPY_SIZE
+    assert len(calls) == 2
+
+def test_short_copy_raises(src_path, tmp_path):
+    # The source is shorter than the size given, as when it shrinks during the copy
+    with open(src_path, "rb") as src_file, open(str(tmp_path / "copy.ub"), "wb") as dest_file:
+        with pytest.raises(CopyError, match=f"expected {COPY_SIZE + 100}"):
+            FileCopier().copy_file_object(src_file, dest_file, COPY_SIZE + 100)
+
+def test_short_buffered_copy_raises(src_path, tmp_path, monkeypatch):
+    monkeypatch.setattr(os, "copy_file_range", unsupported)
+    monkeypatch.setattr(os, "sendfile", unsupported)
+
+    with open(src_path, "rb") as src_file, open(str(tmp_path / "copy.ub"), "wb") as dest_file:
+        with pytest.raises(CopyError):
+            FileCopier().copy_file_object(src_file, dest_file, COPY_SIZE + 100)
+
+def test_other_errors_are_raised(src_path, tmp_path, monkeypatch):
+    def no_space(*args):
+        raise OSError(errno.ENOSPC, "No space left on device")
+
+    monkeypatch.setattr(os, "copy_file_range", no_space)
+
+    with pytest.raises(OSError, match="No space"):
+        FileCopier().copy_file(src_path, str(tmp_path / "copy.ub"))
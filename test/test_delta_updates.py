@@ -0,0 +1,48 @@
+"""Tests of calculating and applying delta updates."""
+
+import os
+import hashlib
+
+from loki_update.delta import block_signatures, compute_delta, apply_delta
+
+BLOCK_SIZE = 4096
+
+def delta_round_trip(tmp_path, basis, new):
+    paths = {name: str(tmp_path / name) for name in ["basis", "new", "delta", "out"]}
+    for name, data in [("basis", basis), ("new", new)]:
+        with open(paths[name], "wb") as out_file:
+            out_file.write(data)
+
+    with open(paths["delta"], "wb") as delta_file:
+        literal_bytes = compute_delta(block_signatures(paths["basis"], BLOCK_SIZE), paths["new"], delta_file)
+
+    assert apply_delta(paths["basis"], paths["delta"], paths["out"], BLOCK_SIZE) == hashlib.sha256(new).hexdigest()
+    return literal_bytes
+
+def test_unchanged_file_with_partial_tail(tmp_path):
+    data = os.urandom(BLOCK_SIZE * 10 + 123)
+
+    assert delta_round_trip(tmp_path, data, data) == 0
+
+def test_moved_and_changed_blocks(tmp_path):
+    blocks = [os.urandom(BLOCK_SIZE) for _ in range(8)]
+    new = blocks[4:] + [os.urandom(BLOCK_SIZE)] + blocks[:4]
+
+    assert delta_round_trip(tmp_path, b"".join(blocks), b"".join(new)) == BLOCK_SIZE
+
+def test_literal_tail(tmp_path):
+    basis = os.urandom(BLOCK_SIZE * 4)
+
+    assert delta_round_trip(tmp_path, basis, basis + b"extra") == 5
+
+def test_insertion_near_start(tmp_path):
+    basis = os.urandom(BLOCK_SIZE * 16 + 100)
+    new = basis[:1000] + b"inserted" + basis[1000:]
+
+    assert delta_round_trip(tmp_path, basis, new) < BLOCK_SIZE + 100
+
+def test_removal_near_start(tmp_path):
+    basis = os.urandom(BLOCK_SIZE * 16)
+    new = basis[:1000] + basis[1010:]
+
+    assert delta_round_trip(tmp_path, basis, new) < BLOCK_SIZE
@@ -0,0 +1,110 @@
+"""Tests of journalled deployments and their recovery after an interruption."""
+
+import os
+import json
+
+import pytest
+
+from loki_update.copier import FileCopier
+from loki_update.deploy import (DeploymentTransaction, JOURNAL_NAME, STATE_COMMITTING, STATE_STAGING, TEMP_SUFFIX,
+                                recover_deployment, write_journal)
+
+FILE_NAMES = ["image.ub", "BOOT.BIN", "boot.scr"]
+
+def write_files(directory, version):
+    os.makedirs(directory, exist_ok=True)
+    for file_name in FILE_NAMES:
+        with open(os.path.join(directory, file_name), "w") as out_file:
+            out_file.write(f"{file_name} {version}")
+
+def read_files(directory):
+    contents = {}
+    for file_name in FILE_NAMES:
+        with open(os.path.join(directory, file_name), "r") as in_file:
+            contents[file_name] = in_file.read().split()[1]
+
+    return contents
+
+def leftovers(directory):
+    return sorted(name for name in os.listdir(directory) if name == JOURNAL_NAME or name.endswith(TEMP_SUFFIX))
+
+@pytest.fixture
+def dirs(tmp_path):
+    """Deployment directory holding release 1.0.0, and a staging directory holding 1.1.0."""
+    dest_dir, src_dir = str(tmp_path / "emmc"), str(tmp_path / "staging")
+    write_files(dest_dir, "1.0.0")
+    write_files(src_dir, "1.1.0")
+    return dest_dir, src_dir
+
+def stage_files(dest_dir, src_dir, file_names):
+    transaction = DeploymentTransaction(dest_dir, FILE_NAMES, FileCopier())
+    for file_name in file_names:
+        transaction.stage(os.path.join(src_dir, file_name), file_name)
+
+    return transaction
+
+def test_commit(dirs):
+    dest_dir, src_dir = dirs
+
+    stage_files(dest_dir, src_dir, FILE_NAMES).commit()
+
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.1.0")
+    assert leftovers(dest_dir) == []
+
+def test_abort(dirs):
+    dest_dir, src_dir = dirs
+
+    stage_files(dest_dir, src_dir, FILE_NAMES[:2]).abort()
+
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.0.0")
+    assert leftovers(dest_dir) == []
+
+def test_interrupted_while_staging_rolls_back(dirs):
+    dest_dir, src_dir = dirs
+    # Interrupted after two of the three files were written
+    stage_files(dest_dir, src_dir, FILE_NAMES[:2])
+    assert leftovers(dest_dir) == sorted([JOURNAL_NAME] + [name + TEMP_SUFFIX for name in FILE_NAMES[:2]])
+
+    assert recover_deployment(dest_dir) == "rolled_back"
+
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.0.0")
+    assert leftovers(dest_dir) == []
+
+def test_interrupted_while_committing_rolls_forward(dirs):
+    dest_dir, src_dir = dirs
+    # Interrupted after the journal was committed and the first file renamed into place
+    stage_files(dest_dir, src_dir, FILE_NAMES)
+    write_journal(dest_dir, STATE_COMMITTING, FILE_NAMES)
+    os.replace(os.path.join(dest_dir, FILE_NAMES[0] + TEMP_SUFFIX), os.path.join(dest_dir, FILE_NAMES[0]))
+
+    assert recover_deployment(dest_dir) == "rolled_forward"
+
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.1.0")
+    assert leftovers(dest_dir) == []
+
+def test_nothing_to_recover(dirs):
+    dest_dir, _ = dirs
+
+    assert recover_deployment(dest_dir) is None
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.0.0")
+
+def test_unreadable_journal_is_left_alone(dirs):
+    dest_dir, _ = dirs
+    with open(os.path.join(dest_dir, JOURNAL_NAME), "w") as journal_file:
+        journal_file.write(json.dumps({"files": FILE_NAMES})[:10])
+
+    assert recover_deployment(dest_dir) is None
+    assert read_files(dest_dir) == dict.fromkeys(FILE_NAMES, "1.0.0")
+
+@pytest.fixture
+def interrupted_sd_deploy(simulated_board):
+    """Leave an SD card deployment interrupted while staging, before the controller is created."""
+    write_journal(simulated_board.sd_path, STATE_STAGING, ["image.ub"])
+    with open(simulated_board.sd_path + "image.ub" + TEMP_SUFFIX, "wb") as temp_file:
+        temp_file.write(b"partial image")
+
+    return simulated_board.sd_path
+
+def test_controller_recovers_on_startup(interrupted_sd_deploy, controller):
+    assert leftovers(interrupted_sd_deploy) == []
+    assert controller.sd_installed_image["app_name"] == "loki-sim"
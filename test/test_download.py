@@ -0,0 +1,155 @@
+"""Tests of downloading release assets from a local stand-in for GitHub."""
+
+import os
+import hashlib
+
+import pytest
+import tornado.web
+
+from loki_update.download import AssetDownloader, DownloadError, PARTIAL_SUFFIX, make_session
+
+from conftest import wait_for_jobs
+
+class IgnoreRangeHandler(tornado.web.RequestHandler):
+    """
+    Request handler serving an asset whole, as a server without Range support does
+    """
+
+    def initialize(self, data):
+        self.data = data
+
+    def get(self):
+        self.write(self.data)
+
+def make_asset(release_server, releases, name, **fields):
+    data = releases["1.1.0"][name]
+    return dict({"name": name, "url": f"{release_server}/assets/1.1.0/{name}", "size": len(data),
+                 "sha256": hashlib.sha256(data).hexdigest()}, **fields)
+
+def write_partial(dest_dir, name, data):
+    with open(os.path.join(dest_dir, name + PARTIAL_SUFFIX), "wb") as partial_file:
+        partial_file.write(data)
+
+def read_file(path):
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+@pytest.fixture
+def downloader():
+    progress = []
+    downloader = AssetDownloader(make_session(), lambda *report: progress.append(report), chunk_size=64 * 1024)
+    downloader.progress = progress
+    return downloader
+
+def test_download_assets(downloader, release_server, releases, tmp_path):
+    assets = [make_asset(release_server, releases, name) for name in releases["1.1.0"]]
+
+    digests = downloader.download_assets(assets, str(tmp_path))
+
+    for asset in assets:
+        assert digests[asset["name"]] == asset["sha256"]
+        assert read_file(str(tmp_path / asset["name"])) == releases["1.1.0"][asset["name"]]
+        assert not os.path.exists(str(tmp_path / asset["name"]) + PARTIAL_SUFFIX)
+
+    downloaded, total, _, eta = downloader.progress[-1]
+    assert downloaded == total == sum(asset["size"] for asset in assets)
+    assert eta == 0
+
+def test_resume_with_range(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "image.ub")
+    data = releases["1.1.0"]["image.ub"]
+    write_partial(str(tmp_path), "image.ub", data[:100000])
+
+    digests = downloader.download_assets([asset], str(tmp_path))
+
+    assert digests["image.ub"] == asset["sha256"]
+    assert read_file(str(tmp_path / "image.ub")) == data
+    assert downloader.resumed == 100000
+
+def test_server_ignoring_range_restarts(downloader, server_thread, releases, tmp_path):
+    data = releases["1.1.0"]["image.ub"]
+    port = server_thread.listen(tornado.web.Application([(r"/image.ub", IgnoreRangeHandler, dict(data=data))]))
+    asset = {"name": "image.ub", "url": f"http://127.0.0.1:{port}/image.ub", "size": len(data),
+             "sha256": hashlib.sha256(data).hexdigest()}
+    write_partial(str(tmp_path), "image.ub", b"\0" * 100000)
+
+    digests = downloader.download_assets([asset], str(tmp_path))
+
+    assert digests["image.ub"] == asset["sha256"]
+    assert read_file(str(tmp_path / "image.ub")) == data
+    assert downloader.resumed == 0
+
+def test_unsatisfiable_range_discards_partial(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "boot.scr")
+    write_partial(str(tmp_path), "boot.scr", b"\0" * (asset["size"] + 10))
+
+    with pytest.raises(DownloadError, match="not valid"):
+        downloader.download_assets([asset], str(tmp_path))
+
+    assert not os.path.exists(str(tmp_path / "boot.scr") + PARTIAL_SUFFIX)
+    assert not os.path.exists(str(tmp_path / "boot.scr"))
+
+def test_complete_partial_checked_before_accepted(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "boot.scr")
+    data = releases["1.1.0"]["boot.scr"]
+    write_partial(str(tmp_path), "boot.scr", data)
+
+    digests = downloader.download_assets([asset], str(tmp_path))
+
+    assert digests["boot.scr"] == asset["sha256"]
+    assert read_file(str(tmp_path / "boot.scr")) == data
+    assert downloader.resumed == len(data)
+
+def test_complete_partial_size_from_content_range(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "boot.scr", size=None)
+    write_partial(str(tmp_path), "boot.scr", releases["1.1.0"]["boot.scr"])
+
+    digests = downloader.download_assets([asset], str(tmp_path))
+
+    assert digests["boot.scr"] == asset["sha256"]
+
+def test_complete_partial_with_wrong_content_rejected(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "boot.scr")
+    write_partial(str(tmp_path), "boot.scr", b"\0" * asset["size"])
+
+    with pytest.raises(DownloadError, match="Checksum failed"):
+        downloader.download_assets([asset], str(tmp_path))
+
+    assert not os.path.exists(str(tmp_path / "boot.scr") + PARTIAL_SUFFIX)
+    assert not os.path.exists(str(tmp_path / "boot.scr"))
+
+def test_checksum_mismatch_removes_partial(downloader, release_server, releases, tmp_path):
+    asset = make_asset(release_server, releases, "BOOT.BIN", sha256="0" * 64)
+
+    with pytest.raises(DownloadError, match="Checksum failed"):
+        downloader.download_assets([asset], str(tmp_path))
+
+    assert not os.path.exists(str(tmp_path / "BOOT.BIN") + PARTIAL_SUFFIX)
+    assert not os.path.exists(str(tmp_path / "BOOT.BIN"))
+
+def test_missing_asset(downloader, release_server, tmp_path):
+    asset = {"name": "image.ub", "url": f"{release_server}/assets/9.9.9/image.ub"}
+
+    with pytest.raises(DownloadError, match="HTTP 404"):
+        downloader.download_assets([asset], str(tmp_path))
+
+def test_mirror_assets_carry_release_digests(controller, release_server, releases):
+    assets = controller.get_release_assets("stfc-aeg", "loki", "1.1.0", "http://mirror.example/loki/")
+
+    assert {asset["name"] for asset in assets} == set(releases["1.1.0"])
+    for asset in assets:
+        assert asset["url"] == f"http://mirror.example/loki/1.1.0/{asset['name']}"
+        assert asset["sha256"] == hashlib.sha256(releases["1.1.0"][asset["name"]]).hexdigest()
+
+def test_tampered_mirror_rejected(controller, server_thread, simulated_board):
+    port = server_thread.listen(tornado.web.Application([(r"/[^/]+/[^/]+", IgnoreRangeHandler, dict(data=b"tampered"))]))
+    controller.available_repos[0]["mirror"] = f"http://127.0.0.1:{port}"
+    installed = read_file(simulated_board.sd_path + "image.ub")
+
+    controller.set_copy_target("sd")
+    controller.set_release_to_retrieve({"repo": "loki", "tag": "1.1.0"})
+    jobs = wait_for_jobs(controller)
+
+    assert [job["status"] for job in jobs.values() if job["name"] == "download_release"] == ["failed"]
+    assert "Checksum failed" in controller.download_error_message
+    assert read_file(simulated_board.sd_path + "image.ub") == installed
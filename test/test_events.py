@@ -0,0 +1,135 @@
+"""Tests of the parameter tree event stream."""
+
+import json
+import time
+import queue
+import socket
+import threading
+
+import pytest
+import requests
+
+from loki_update.events import tree_delta, merge_delta
+
+from conftest import unused_port, wait_for_jobs
+
+class EventReader():
+    """
+    Client of the event stream, collecting each event on a background thread
+    """
+
+    def __init__(self, url):
+        self.response = requests.get(url, stream=True, timeout=10)
+        self.events = queue.Queue()
+        self.thread = threading.Thread(target=self.read, daemon=True)
+        self.thread.start()
+
+    def read(self):
+        event = {}
+        try:
+            for line in self.response.iter_lines(decode_unicode=True):
+                if line:
+                    field, _, value = line.partition(": ")
+                    event[field] = value
+                else:
+                    self.events.put((event["event"], json.loads(event["data"])))
+                    event = {}
+        except (requests.RequestException, AttributeError, OSError):
+            pass
+
+    def next_event(self, timeout=5):
+        return self.events.get(timeout=timeout)
+
+    def wait_for(self, condition, timeout=5):
+        """Merge the deltas received until they match a condition.
+
+        :return: the merged deltas
+        """
+        deadline = time.monotonic() + timeout
+        merged = {}
+        while not condition(merged):
+            event, data = self.next_event(max(deadline - time.monotonic(), 0.01))
+            if event == "delta":
+                merge_delta(merged, data)
+
+        return merged
+
+    def drain(self, controller):
+        """Wait for the probes started by the first snapshot, and discard the events they caused."""
+        wait_for_jobs(controller)
+        time.sleep(0.5)
+        while not self.events.empty():
+            self.events.get()
+
+    def close(self):
+        # Shutting the socket down wakes the reading thread, which a plain close would wait for
+        connection = self.response.raw.connection
+        if connection and connection.sock:
+            connection.sock.shutdown(socket.SHUT_RDWR)
+        self.response.close()
+
+@pytest.fixture
+def events(board_server):
+    upload_port = unused_port()
+    served = board_server(upload_port=upload_port, probe_on_startup=False)
+    reader = EventReader(f"http://127.0.0.1:{upload_port}/events")
+    served.reader = reader
+    yield served
+    reader.close()
+
+def test_tree_delta():
+    old = {"copy_progress": {"progress": 10, "copying": True}, "jobs": {"1": {}}}
+    new = {"copy_progress": {"progress": 50, "copying": True}, "jobs": {}}
+    assert tree_delta(old, new) == {"copy_progress": {"progress": 50}, "jobs": {"1": None}}
+
+def test_merge_delta_keeps_latest():
+    pending = {"copy_progress": {"progress": 10, "file_name": "image.ub"}}
+    merge_delta(pending, {"copy_progress": {"progress": 20}})
+    assert pending == {"copy_progress": {"progress": 20, "file_name": "image.ub"}}
+
+def test_snapshot_sent_first(events):
+    event, data = events.reader.next_event()
+    assert event == "snapshot"
+    assert set(data) == {"copy_progress", "installed_images", "jobs", "github_repos", "reboot_board"}
+    assert "server_uptime" not in data
+
+def test_set_is_pushed(events):
+    events.reader.next_event()
+
+    requests.put(events.api_url + "/copy_progress", json={"target": "sd"}).raise_for_status()
+
+    delta = events.reader.wait_for(lambda data: "copy_progress" in data)
+    assert delta["copy_progress"]["target"] == "sd"
+
+def test_background_job_is_pushed(events):
+    events.reader.drain(events.controller)
+
+    # The backup returns straight away, and finishes on a worker thread
+    requests.put(events.api_url + "/installed_images/emmc", json={"backup": True}).raise_for_status()
+    job_id = max(events.controller.scheduler.get_jobs(), key=int)
+
+    delta = events.reader.wait_for(lambda data: data.get("jobs", {}).get(job_id, {}).get("status") == "complete" and
+                                   data.get("copy_progress", {}).get("backup_success"))
+    assert delta["jobs"][job_id]["status"] == "complete"
+
+def test_unbumped_change_is_not_published(events):
+    events.reader.drain(events.controller)
+
+    # The tree is no longer polled, so a value changed without bumping its subtree is not sent
+    events.controller.copy_target = "emmc"
+    with pytest.raises(queue.Empty):
+        events.reader.wait_for(lambda data: "copy_progress" in data, timeout=0.5)
+
+def test_disconnect_unsubscribes(events):
+    events.reader.next_event()
+    assert events.adapter.events.clients
+
+    events.reader.close()
+
+    # The closed stream is noticed on the next change
+    deadline = time.monotonic() + 5
+    while events.adapter.events.clients and time.monotonic() < deadline:
+        events.controller.snapshots.bump("copy_progress")
+        time.sleep(0.05)
+
+    assert not events.adapter.events.clients
@@ -0,0 +1,314 @@
+"""Tests of the flattened device tree parser, using hand-built blobs."""
+
+import os
+import json
+import struct
+import hashlib
+
+import pytest
+
+from loki_update.fdt import (FDT_HEADER_SIZE, FDT_NOP, BufferSource, FdtError, FileSource, FlatDeviceTree,
+                             LiveDeviceTree, decode_property, find_embedded_dtb, read_device_metadata,
+                             read_image_metadata, read_loki_metadata, read_runtime_metadata)
+from loki_update.simulation import DEFAULT_METADATA, build_fdt, make_fit_image
+
+TIMESTAMP = 1700000000
+
+FIXTURES_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+REFERENCE_IMAGES = ["image.ub", "image-external.ub"]
+
+def make_dtb(metadata=DEFAULT_METADATA):
+    return build_fdt(("", {}, [("loki-metadata", dict(metadata), [])]))
+
+def make_external_fit(dtb, field):
+    """Build a FIT image whose device tree is stored after the structure, as mkimage -E does.
+
+    :param dtb: device tree sub-image
+    :param field: data-offset, giving the offset from the end of the FIT structure, or
+        data-position, giving the offset from the start of the image
+    """
+    def build(position):
+        return build_fdt(("", {"timestamp": TIMESTAMP}, [
+            ("images", {}, [
+                ("kernel-1", {"type": "kernel", "data": b"kernel"}, []),
+                ("fdt-1", {"type": "flat_dt", field: position, "data-size": len(dtb)}, [])
+            ])
+        ]))
+
+    # The position does not change the size of the structure, so it is found with a first pass
+    fit_size = (len(build(0)) + 3) & ~3
+    fit = build(0 if field == "data-offset" else fit_size)
+
+    return fit + bytes(fit_size - len(fit)) + dtb
+
+def test_walk_records_nodes_and_properties():
+    blob = build_fdt(("", {"compatible": "loki,board"}, [
+        ("images", {}, [("kernel-1", {"type": "kernel", "load": 0x80000}, [])]),
+        ("configurations", {"default": "conf-1"}, [])
+    ]))
+    fdt = FlatDeviceTree(BufferSource(blob))
+
+    assert list(fdt.nodes) == ["/", "/images", "/images/kernel-1", "/configurations"]
+    assert fdt.children("/") == ["/images", "/configurations"]
+    assert fdt.children("/images") == ["/images/kernel-1"]
+    assert fdt.get_string("/", "compatible") == "loki,board"
+    assert fdt.get_u32("/images/kernel-1", "load") == 0x80000
+    assert fdt.get_property("/images/kernel-1", "missing") is None
+
+def test_walk_skips_nop_tokens():
+    blob = build_fdt(("", {"model": "loki"}, []))
+    total_size, struct_offset, strings_offset = struct.unpack_from(">3I", blob, 4)
+    struct_size, = struct.unpack_from(">I", blob, 36)
+
+    # Insert a NOP before the FDT_END token, moving the strings block along to make room
+    end_token = struct_offset + struct_size - 4
+    patched = bytearray(blob[:end_token] + struct.pack(">I", FDT_NOP) + blob[end_token:])
+    struct.pack_into(">3I", patched, 4, total_size + 4, struct_offset, strings_offset + 4)
+    struct.pack_into(">I", patched, 36, struct_size + 4)
+
+    fdt = FlatDeviceTree(BufferSource(bytes(patched)))
+    assert fdt.get_string("/", "model") == "loki"
+
+def test_embedded_dtb():
+    fit = make_fit_image(DEFAULT_METADATA, 64 * 1024, TIMESTAMP)
+    fdt = FlatDeviceTree(BufferSource(fit))
+
+    offset = find_embedded_dtb(fdt)
+    assert fdt.get_property_location("/images/fdt-1", "data")[0] == offset
+    assert FlatDeviceTree(BufferSource(fit), offset).has_node("/loki-metadata")
+
+@pytest.mark.parametrize("field", ["data-offset", "data-position"])
+def test_external_dtb(field):
+    fit = make_external_fit(make_dtb(), field)
+
+    metadata = read_loki_metadata(BufferSource(fit))
+
+    assert metadata == dict(DEFAULT_METADATA, timestamp=str(TIMESTAMP))
+
+def test_dtb_found_by_position_without_type():
+    dtb = make_dtb()
+    fit = build_fdt(("", {}, [
+        ("images", {}, [("kernel-1", {"data": b"kernel"}, []), ("fdt-1", {"data": dtb}, [])])
+    ]))
+
+    assert read_loki_metadata(BufferSource(fit))["application-name"] == DEFAULT_METADATA["application-name"]
+
+def test_metadata_at_top_level():
+    fit = build_fdt(("", {"timestamp": TIMESTAMP}, [("loki-metadata", dict(DEFAULT_METADATA), [])]))
+
+    assert read_loki_metadata(BufferSource(fit)) == dict(DEFAULT_METADATA, timestamp=str(TIMESTAMP))
+
+def test_no_dtb_image():
+    fit = build_fdt(("", {}, [("images", {}, [("kernel-1", {"type": "kernel", "data": b"kernel"}, [])])]))
+
+    with pytest.raises(FdtError, match="No device tree image"):
+        read_loki_metadata(BufferSource(fit))
+
+def test_dtb_without_data():
+    fit = build_fdt(("", {}, [("images", {}, [("fdt-1", {"type": "flat_dt"}, [])])]))
+
+    with pytest.raises(FdtError, match="has no data"):
+        find_embedded_dtb(FlatDeviceTree(BufferSource(fit)))
+
+def test_bad_magic():
+    blob = bytearray(make_dtb())
+    struct.pack_into(">I", blob, 0, 0x12345678)
+
+    with pytest.raises(FdtError, match="Bad device tree magic number: 0x12345678"):
+        FlatDeviceTree(BufferSource(bytes(blob)))
+
+def test_not_a_device_tree():
+    with pytest.raises(FdtError, match="Bad device tree magic"):
+        read_loki_metadata(BufferSource(b"#!/bin/sh\n" + bytes(FDT_HEADER_SIZE)))
+
+@pytest.mark.parametrize("length", [0, FDT_HEADER_SIZE // 2, FDT_HEADER_SIZE + 20, -8])
+def test_truncated_blob(length):
+    blob = make_dtb()
+
+    with pytest.raises(FdtError, match="outside the image"):
+        FlatDeviceTree(BufferSource(blob[:length]))
+
+def test_truncated_embedded_dtb():
+    fit = make_external_fit(make_dtb(), "data-offset")
+
+    with pytest.raises(FdtError, match="outside the image"):
+        read_loki_metadata(BufferSource(fit[:-16]))
+
+def test_unterminated_structure():
+    blob = bytearray(make_dtb())
+    struct_size, = struct.unpack_from(">I", blob, 36)
+    struct.pack_into(">I", blob, 36, struct_size - 4)
+
+    with pytest.raises(FdtError, match="not terminated"):
+        FlatDeviceTree(BufferSource(bytes(blob)))
+
+def test_unknown_token():
+    blob = bytearray(make_dtb())
+    struct_offset, = struct.unpack_from(">I", blob, 8)
+    struct.pack_into(">I", blob, struct_offset, 0x7)
+
+    with pytest.raises(FdtError, match="Unknown device tree token 0x7"):
+        FlatDeviceTree(BufferSource(bytes(blob)))
+
+def write_image(tmp_path, data):
+    path = str(tmp_path / "image.ub")
+    with open(path, "wb") as image_file:
+        image_file.write(data)
+    return path
+
+def test_file_source_matches_buffer(tmp_path):
+    data = os.urandom(3 * 4096 + 100)
+
+    with open(write_image(tmp_path, data), "rb") as image_file:
+        source = FileSource(image_file, block_size=4096)
+        for offset, size in [(0, 4), (4090, 12), (100, 2 * 4096), (len(data) - 8, 8), (5000, 0)]:
+            assert source.read(offset, size) == data[offset:offset + size]
+
+def test_file_source_reads_each_block_once(tmp_path):
+    with open(write_image(tmp_path, bytes(8 * 4096)), "rb") as image_file:
+        source = FileSource(image_file, block_size=4096)
+        source.read(4000, 200)
+        source.read(4090, 10)
+        source.read(8000, 100)
+
+        assert source.bytes_read == 2 * 4096
+
+def test_file_source_read_past_end(tmp_path):
+    with open(write_image(tmp_path, bytes(100)), "rb") as image_file:
+        source = FileSource(image_file)
+
+        with pytest.raises(FdtError, match="outside the image"):
+            source.read(96, 8)
+
+def test_device_read_bounded_on_large_image(tmp_path):
+    kernel_size = 32 * 1024 * 1024
+    path = write_image(tmp_path, make_fit_image(DEFAULT_METADATA, kernel_size, TIMESTAMP))
+
+    metadata, bytes_read = read_device_metadata(path)
+
+    assert metadata == dict(DEFAULT_METADATA, timestamp=str(TIMESTAMP))
+    assert bytes_read <= 8 * 4096
+    assert os.path.getsize(path) > kernel_size
+
+def test_device_read_external_dtb(tmp_path):
+    path = write_image(tmp_path, make_external_fit(make_dtb(), "data-offset"))
+
+    metadata, _ = read_device_metadata(path)
+
+    assert metadata == dict(DEFAULT_METADATA, timestamp=str(TIMESTAMP))
+
+def test_device_read_truncated(tmp_path):
+    fit = make_fit_image(DEFAULT_METADATA, 64 * 1024, TIMESTAMP)
+    path = write_image(tmp_path, fit[:len(fit) // 2])
+
+    with pytest.raises(FdtError, match="outside the image"):
+        read_device_metadata(path)
+
+@pytest.mark.parametrize("data, value", [
+    (b"", True),
+    (b"loki\0", "loki"),
+    (b"loki,board\0loki\0", ["loki,board", "loki"]),
+    (struct.pack(">I", 1700000000), 1700000000),
+    (struct.pack(">Q", 0x123456789abcdef0), 0x123456789abcdef0),
+    (struct.pack(">3I", 1, 2, 3), [1, 2, 3]),
+    (b"\x01\x02\x03", "010203"),
+    # Not a string, as it holds an empty string, or bytes which are not printable
+    (b"\0\0\0\0", 0),
+    (b"a\0\0\0", 0x61000000),
+    (b"\x01\x02\x03\0", 0x01020300),
+])
+def test_decode_property(data, value):
+    assert decode_property(data) == value
+
+def write_node(base_path, node, properties):
+    node_path = os.path.join(base_path, node.strip("/"))
+    os.makedirs(node_path, exist_ok=True)
+    for name, data in properties.items():
+        with open(os.path.join(node_path, name), "wb") as property_file:
+            property_file.write(data)
+
+def test_live_tree_reads_node(tmp_path):
+    write_node(str(tmp_path), "/loki-metadata", {"application-name": b"loki-sim\0", "timestamp": struct.pack(">I", TIMESTAMP),
+                                                 "wide": struct.pack(">Q", 1 << 40), "flag": b""})
+    os.makedirs(str(tmp_path / "loki-metadata" / "child"))
+
+    node = LiveDeviceTree(str(tmp_path)).read_node("/loki-metadata")
+
+    assert node == {"application-name": "loki-sim", "timestamp": TIMESTAMP, "wide": 1 << 40, "flag": True}
+
+def test_live_tree_reads_each_node_once(tmp_path):
+    write_node(str(tmp_path), "/loki-metadata", {"platform": b"simulated\0"})
+    tree = LiveDeviceTree(str(tmp_path))
+    tree.read_node("/loki-metadata")
+
+    write_node(str(tmp_path), "/loki-metadata", {"platform": b"changed\0"})
+    node = tree.read_node("/loki-metadata")
+    node["platform"] = "modified"
+
+    assert tree.read_node("/loki-metadata") == {"platform": "simulated"}
+
+def test_runtime_metadata(tmp_path):
+    write_node(str(tmp_path), "/", {"timestamp": struct.pack(">I", TIMESTAMP)})
+    write_node(str(tmp_path), "/loki-metadata", {
+        "application-name": b"loki-sim\0",
+        "application-version": b"1.0.0\0",
+        "loki-version": b"1.0.0\0",
+        "platform": b"zynqmp\0simulated\0"
+    })
+
+    metadata, node = read_runtime_metadata(LiveDeviceTree(str(tmp_path)))
+
+    # The timestamp falls back to the root node, and string lists are joined
+    assert metadata == {"application-name": "loki-sim", "application-version": "1.0.0", "loki-version": "1.0.0",
+                        "platform": "zynqmp, simulated", "timestamp": str(TIMESTAMP)}
+    assert node["platform"] == ["zynqmp", "simulated"]
+
+def test_runtime_metadata_timestamp_from_node(tmp_path):
+    write_node(str(tmp_path), "/", {"timestamp": struct.pack(">I", 1)})
+    write_node(str(tmp_path), "/loki-metadata", {"timestamp": struct.pack(">I", TIMESTAMP)})
+
+    metadata, _ = read_runtime_metadata(LiveDeviceTree(str(tmp_path)))
+
+    assert metadata["timestamp"] == str(TIMESTAMP)
+    assert metadata["application-name"] == ""
+
+def describe_tree(fdt):
+    """Give the length and SHA-256 of every property, as make_fixtures.py records them with libfdt."""
+    return {path: {name: {"length": len(fdt.get_property(path, name)),
+                          "sha256": hashlib.sha256(fdt.get_property(path, name)).hexdigest()} for name in properties}
+            for path, properties in fdt.nodes.items()}
+
+def read_reference(name):
+    path = os.path.join(FIXTURES_DIR, name)
+    with open(path + ".json") as expected_file:
+        return path, json.load(expected_file)
+
+@pytest.mark.parametrize("name", REFERENCE_IMAGES)
+def test_reference_image_tree(name):
+    path, expected = read_reference(name)
+    with open(path, "rb") as image_file:
+        blob = image_file.read()
+
+    fit = FlatDeviceTree(BufferSource(blob))
+    dtb = FlatDeviceTree(BufferSource(blob), find_embedded_dtb(fit))
+
+    assert describe_tree(fit) == expected["nodes"]
+    assert describe_tree(dtb) == expected["dtb_nodes"]
+
+@pytest.mark.parametrize("name", REFERENCE_IMAGES)
+def test_reference_image_metadata(name):
+    path, expected = read_reference(name)
+
+    assert read_image_metadata(path) == expected["metadata"]
+    assert read_device_metadata(path)[0] == expected["metadata"]
+
+def test_simulated_image_readable_by_libfdt():
+    libfdt = pytest.importorskip("libfdt")
+    fit = make_fit_image(DEFAULT_METADATA, 64 * 1024, TIMESTAMP)
+
+    reference = libfdt.Fdt(fit)
+    dtb = libfdt.Fdt(bytes(reference.getprop(reference.path_offset("/images/fdt-1"), "data")))
+    node = dtb.path_offset("/loki-metadata")
+
+    assert reference.getprop(0, "timestamp").as_uint32() == TIMESTAMP
+    assert {name: dtb.getprop(node, name).as_str() for name in DEFAULT_METADATA} == DEFAULT_METADATA
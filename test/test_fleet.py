@@ -0,0 +1,92 @@
+"""Tests of rolling updates across a fleet of simulated boards."""
+
+import asyncio
+
+from loki_update.fleet import FleetCoordinator
+from loki_update.simulation import make_release
+
+from conftest import KERNEL_SIZE
+
+def make_coordinator(boards, **options):
+    """Create a coordinator uploading release 1.2.0 to the SD card of each board."""
+    files = make_release("1.2.0", KERNEL_SIZE)
+    options = dict(dict(files=files, expected_version="1.2.0", poll_interval=0.05, timeout=30), **options)
+    return FleetCoordinator([served.url for served in boards], "sd", **options)
+
+def installed_version(served):
+    served.controller.load_installed_image("sd")
+    return served.controller.sd_installed_image["app_version"]
+
+def serve_failing_board(board_server):
+    """Serve a board which refuses the update, as it only allows updates to the eMMC."""
+    return board_server(allow_only_emmc_upload="True")
+
+def test_rolling_update_in_waves(board_server):
+    boards = [board_server() for _ in range(5)]
+    coordinator = make_coordinator(boards, canary=1, wave_size=2, concurrency=4)
+
+    assert asyncio.run(coordinator.run())
+
+    progress = coordinator.get_progress()
+    assert progress["succeeded"] == 5
+    assert progress["progress"] == 100
+    assert (progress["wave"], progress["waves"]) == (3, 3)
+    assert [installed_version(served) for served in boards] == ["1.2.0"] * 5
+
+    # Each wave only starts once every board in the wave before it has finished
+    waves = [[coordinator.status[served.url] for served in wave] for wave in [boards[:1], boards[1:3], boards[3:]]]
+    for wave, next_wave in zip(waves, waves[1:]):
+        assert max(status.finished for status in wave) <= min(status.started for status in next_wave)
+
+def test_release_update(board_server):
+    boards = [board_server() for _ in range(2)]
+    coordinator = make_coordinator(boards, files=None, release={"repo": "loki", "tag": "1.1.0"}, expected_version="1.1.0")
+
+    assert asyncio.run(coordinator.run())
+
+    assert [installed_version(served) for served in boards] == ["1.1.0"] * 2
+
+def test_canary_failure_halts_rollout(board_server):
+    boards = [serve_failing_board(board_server), board_server(), board_server()]
+    coordinator = make_coordinator(boards, canary=1)
+
+    assert not asyncio.run(coordinator.run())
+
+    progress = coordinator.get_progress()
+    assert progress["aborted"]
+    assert progress["abort_reason"] == "a canary board failed"
+    assert [status["state"] for status in progress["boards"].values()] == ["failed", "skipped", "skipped"]
+    assert "only allows updates to the eMMC" in progress["boards"][boards[0].url]["error_message"]
+    assert [installed_version(served) for served in boards[1:]] == ["1.0.0"] * 2
+
+def test_version_mismatch_fails_canary(board_server):
+    boards = [board_server(), board_server()]
+    coordinator = make_coordinator(boards, canary=1, expected_version="9.9.9")
+
+    assert not asyncio.run(coordinator.run())
+
+    progress = coordinator.get_progress()
+    assert "expected 9.9.9" in progress["boards"][boards[0].url]["error_message"]
+    assert progress["boards"][boards[1].url]["state"] == "skipped"
+
+def test_failure_threshold_stops_rollout(board_server):
+    boards = [board_server(), serve_failing_board(board_server), serve_failing_board(board_server), board_server(), board_server()]
+    coordinator = make_coordinator(boards, canary=1, wave_size=1, concurrency=1, max_failures=0.25)
+
+    assert not asyncio.run(coordinator.run())
+
+    progress = coordinator.get_progress()
+    assert progress["aborted"]
+    assert progress["abort_reason"] == "2 boards failed, more than the 1 allowed"
+    assert [status["state"] for status in progress["boards"].values()] == ["succeeded", "failed", "failed", "skipped", "skipped"]
+    assert progress["wave"] == 3
+
+def test_failures_within_threshold_continue(board_server):
+    boards = [board_server(), serve_failing_board(board_server), serve_failing_board(board_server), board_server(), board_server()]
+    coordinator = make_coordinator(boards, canary=1, wave_size=1, concurrency=1, max_failures=0.5)
+
+    assert not asyncio.run(coordinator.run())
+
+    progress = coordinator.get_progress()
+    assert not progress["aborted"]
+    assert [status["state"] for status in progress["boards"].values()] == ["succeeded", "failed", "failed", "succeeded", "succeeded"]
@@ -0,0 +1,99 @@
+"""Tests of the background job scheduler."""
+
+import time
+import threading
+
+import pytest
+
+from loki_update.jobs import JobScheduler
+
+def wait_until(condition, timeout=10):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "Condition was not met in time"
+        time.sleep(0.001)
+
+def wait_for_jobs(scheduler):
+    wait_until(lambda: all(job["status"] in ("complete", "failed") for job in scheduler.get_jobs().values()))
+    return scheduler.get_jobs()
+
+def blocked_job(release, order=None):
+    """Get a job function which records its name, then waits until released."""
+    def run(job):
+        if order is not None:
+            order.append(job.name)
+        assert release.wait(10)
+
+    return run
+
+@pytest.fixture
+def scheduler():
+    scheduler = JobScheduler(max_workers=2)
+    yield scheduler
+    scheduler.shutdown()
+
+def test_jobs_on_a_device_run_in_order(scheduler):
+    release = threading.Event()
+    order = []
+
+    for name in ["first", "second", "third"]:
+        scheduler.submit(name, ["emmc"], blocked_job(release, order))
+    wait_until(lambda: order == ["first"])
+    release.set()
+    jobs = wait_for_jobs(scheduler)
+
+    assert order == ["first", "second", "third"]
+    assert [job["status"] for job in jobs.values()] == ["complete"] * 3
+
+def test_waiting_jobs_do_not_hold_workers(scheduler):
+    release = threading.Event()
+    running = scheduler.submit("deploy_emmc", ["emmc"], blocked_job(release))
+    waiting = scheduler.submit("backup_emmc", ["emmc", "backup"], blocked_job(release))
+    independent = [scheduler.submit(f"deploy_sd_{index}", ["sd"], lambda job: "done") for index in range(3)]
+
+    # With two workers, one is held by the eMMC deploy and the other must stay free for the SD
+    wait_until(lambda: all(job.status == "complete" for job in independent))
+    assert (running.status, waiting.status) == ("running", "queued")
+
+    release.set()
+    wait_for_jobs(scheduler)
+    assert waiting.status == "complete"
+
+def test_single_worker_runs_independent_jobs():
+    scheduler = JobScheduler(max_workers=1)
+    release = threading.Event()
+    order = []
+
+    scheduler.submit("deploy_emmc", ["emmc"], blocked_job(release, order))
+    scheduler.submit("backup_emmc", ["emmc", "backup"], blocked_job(release, order))
+    scheduler.submit("deploy_sd", ["sd"], blocked_job(release, order))
+    wait_until(lambda: order == ["deploy_emmc"])
+    release.set()
+    wait_for_jobs(scheduler)
+
+    # The SD deploy is not held up behind the backup waiting for the eMMC
+    assert order == ["deploy_emmc", "deploy_sd", "backup_emmc"]
+    scheduler.shutdown()
+
+def test_read_jobs_are_not_writing(scheduler):
+    release = threading.Event()
+    scheduler.submit("probe_emmc", ["emmc"], blocked_job(release), writes=[])
+    scheduler.submit("backup_emmc", ["emmc", "backup"], blocked_job(release), writes=["backup"])
+
+    assert not scheduler.is_writing("emmc")
+    assert scheduler.is_writing("backup")
+
+    release.set()
+    wait_for_jobs(scheduler)
+    assert not scheduler.is_writing("backup")
+
+def test_job_result_and_failure(scheduler):
+    def fail(job):
+        raise OSError("No space left on device")
+
+    succeeded = scheduler.submit("copy_to_sd", ["sd"], lambda job, files: {"written": files}, ["image.ub"])
+    failed = scheduler.submit("copy_to_emmc", ["emmc"], fail)
+    jobs = wait_for_jobs(scheduler)
+
+    assert jobs[succeeded.job_id]["result"] == {"written": ["image.ub"]}
+    assert (jobs[failed.job_id]["status"], jobs[failed.job_id]["error_message"]) == ("failed", "No space left on device")
@@ -0,0 +1,70 @@
+"""Tests of the controller operation metrics and their Prometheus exposition."""
+
+import threading
+
+import requests
+
+from loki_update.metrics import Metrics
+
+from conftest import wait_for_jobs
+
+def test_to_prometheus():
+    metrics = Metrics(buckets=(0.1, 1))
+    metrics.observe("copy_file", 0.05)
+    metrics.observe("copy_file", 0.5)
+    metrics.increment("job_copy_to_sd_failed")
+    metrics.record_transfer("sd", 1000, 2)
+
+    assert metrics.to_prometheus().splitlines() == [
+        "# HELP loki_update_operation_seconds Duration of controller operations",
+        "# TYPE loki_update_operation_seconds histogram",
+        'loki_update_operation_seconds_bucket{operation="copy_file",le="0.1"} 1',
+        'loki_update_operation_seconds_bucket{operation="copy_file",le="1"} 2',
+        'loki_update_operation_seconds_bucket{operation="copy_file",le="+Inf"} 2',
+        'loki_update_operation_seconds_sum{operation="copy_file"} 0.55',
+        'loki_update_operation_seconds_count{operation="copy_file"} 2',
+        "# HELP loki_update_events_total Count of controller events",
+        "# TYPE loki_update_events_total counter",
+        'loki_update_events_total{event="job_copy_to_sd_failed"} 1',
+        "# HELP loki_update_device_bytes_total Bytes moved to or from each device",
+        "# TYPE loki_update_device_bytes_total counter",
+        'loki_update_device_bytes_total{device="sd"} 1000',
+        "# HELP loki_update_device_throughput_bytes Throughput of the most recent transfer to or from each device, in bytes per second",
+        "# TYPE loki_update_device_throughput_bytes gauge",
+        'loki_update_device_throughput_bytes{device="sd"} 500.0'
+    ]
+
+def test_concurrent_recording():
+    metrics = Metrics()
+
+    def record(thread):
+        for index in range(1000):
+            metrics.observe(f"operation_{thread}_{index % 50}", 0.01)
+            metrics.record_transfer(f"device_{index % 20}", 1, 0.01)
+            metrics.increment("events")
+
+    threads = [threading.Thread(target=record, args=(thread,)) for thread in range(4)]
+    for thread in threads:
+        thread.start()
+    while any(thread.is_alive() for thread in threads):
+        metrics.to_prometheus()
+        metrics.to_dict()
+    for thread in threads:
+        thread.join()
+
+    summary = metrics.to_dict()
+    assert sum(histogram["count"] for histogram in summary["operations"].values()) == 4000
+    assert sum(transfer["bytes"] for transfer in summary["devices"].values()) == 4000
+    assert summary["counters"]["events"] == 4000
+
+def test_metrics_served_by_adapter(board_server):
+    served = board_server()
+    wait_for_jobs(served.controller)
+
+    scraped = requests.get(served.api_url + "/metrics", headers={"Accept": "text/plain;version=0.0.4;q=0.5,*/*;q=0.1"})
+    summary = requests.get(served.api_url + "/metrics", headers={"Accept": "application/json"})
+
+    assert scraped.status_code == 200
+    assert scraped.headers["Content-Type"].startswith("text/plain")
+    assert 'loki_update_operation_seconds_count{operation="read_image_metadata"}' in scraped.text
+    assert summary.json()["metrics"]["operations"]["read_image_metadata"]["count"] > 0
@@ -0,0 +1,131 @@
+"""Tests of the MTD partition table and of writing images to partitions, using regular files standing in for the devices."""
+
+import os
+
+import pytest
+
+from loki_update.mtd import (MtdDevice, MtdError, MtdRegistry, MtdVerifyError, MtdWriteError, MtdWriter, STAGE_ERASE,
+                             STAGE_VERIFY, STAGE_WRITE)
+
+ERASE_SIZE = 4096
+
+DEVICE_SIZE = 16 * ERASE_SIZE
+
+def write_file(path, data):
+    with open(path, "wb") as out_file:
+        out_file.write(data)
+    return path
+
+def read_file(path):
+    with open(path, "rb") as in_file:
+        return in_file.read()
+
+@pytest.fixture
+def device_path(tmp_path):
+    """File standing in for an MTD partition, holding an old image in its first half."""
+    return write_file(str(tmp_path / "mtd2"), os.urandom(DEVICE_SIZE // 2) + b"\xff" * (DEVICE_SIZE // 2))
+
+def write_image(device_path, image_path):
+    progress = []
+    blocks = MtdWriter(lambda *report: progress.append(report), progress_interval=0).write_image(image_path, device_path, ERASE_SIZE)
+    return blocks, progress
+
+def test_write_image(device_path, tmp_path):
+    image = os.urandom(12 * ERASE_SIZE)
+
+    blocks, progress = write_image(device_path, write_file(str(tmp_path / "image.ub"), image))
+
+    # The blocks of the old image are erased, those already erased are only written
+    assert blocks == {"erased": 8, "written": 12, "unchanged": 0}
+    assert read_file(device_path)[:len(image)] == image
+    assert [report[0] for report in progress] == [STAGE_ERASE] * 8 + [STAGE_WRITE] * 12 + [STAGE_VERIFY] * 12
+    assert progress[-1][1:3] == (12 * ERASE_SIZE, 12 * ERASE_SIZE)
+
+def test_unchanged_blocks_skipped(device_path, tmp_path):
+    image = bytearray(read_file(device_path)[:8 * ERASE_SIZE])
+    image[3 * ERASE_SIZE + 10] ^= 0xff
+
+    blocks, _ = write_image(device_path, write_file(str(tmp_path / "image.ub"), bytes(image)))
+
+    assert blocks == {"erased": 1, "written": 1, "unchanged": 7}
+    assert read_file(device_path)[:len(image)] == image
+
+def test_partial_last_block(device_path, tmp_path):
+    image = os.urandom(10 * ERASE_SIZE + 100)
+    image_path = write_file(str(tmp_path / "image.ub"), image)
+
+    blocks, _ = write_image(device_path, image_path)
+
+    assert blocks == {"erased": 8, "written": 11, "unchanged": 0}
+    # The rest of the last block is left erased, so rewriting the same image changes nothing
+    assert read_file(device_path)[:11 * ERASE_SIZE] == image + b"\xff" * (ERASE_SIZE - 100)
+    assert write_image(device_path, image_path)[0] == {"erased": 0, "written": 0, "unchanged": 11}
+
+def test_partial_last_block_over_old_data(device_path, tmp_path):
+    # The old data after the end of the image in the last block must be erased
+    image = read_file(device_path)[:ERASE_SIZE - 100]
+
+    blocks, _ = write_image(device_path, write_file(str(tmp_path / "image.ub"), image))
+
+    assert blocks == {"erased": 1, "written": 1, "unchanged": 0}
+    assert read_file(device_path)[:ERASE_SIZE] == image + b"\xff" * 100
+
+def test_image_too_large(device_path, tmp_path):
+    with pytest.raises(MtdWriteError, match="larger than"):
+        write_image(device_path, write_file(str(tmp_path / "image.ub"), bytes(DEVICE_SIZE + 1)))
+
+def test_verify_failure(device_path, tmp_path, monkeypatch):
+    write = MtdDevice.write
+    monkeypatch.setattr(MtdDevice, "write", lambda device, offset, data: write(device, offset, bytes(len(data))))
+
+    with pytest.raises(MtdVerifyError, match="failed at 0x0"):
+        write_image(device_path, write_file(str(tmp_path / "image.ub"), os.urandom(2 * ERASE_SIZE)))
+
+PARTITIONS = [("mtd0", "boot", 0x1000000), ("mtd1", "kernel-backup", 0x2000000), ("mtd2", "kernel", 0x2000000), ("mtd3", "bootscr", 0x40000)]
+
+def write_proc_mtd(path, partitions):
+    lines = ["dev:    size   erasesize  name"] + [f'{device}: {size:08x} 00010000 "{label}"' for device, label, size in partitions]
+    return write_file(path, "\n".join(lines).encode() + b"\n")
+
+def add_sys_device(sys_path, device, label, size):
+    device_dir = os.path.join(sys_path, device)
+    os.makedirs(device_dir)
+    for name, value in [("name", label), ("size", size), ("erasesize", 0x10000)]:
+        write_file(os.path.join(device_dir, name), f"{value}\n".encode())
+
+@pytest.fixture
+def sys_path(tmp_path):
+    sys_path = str(tmp_path / "sys" / "class" / "mtd")
+    os.makedirs(sys_path)
+    for partition in PARTITIONS:
+        add_sys_device(sys_path, *partition)
+    return sys_path
+
+def test_registry_from_sysfs(sys_path, tmp_path):
+    registry = MtdRegistry(str(tmp_path / "missing"), sys_path, "/dev/")
+
+    assert registry.get_partitions()["bootscr"] == {"device": "/dev/mtd3", "size": 0x40000, "erase_size": 0x10000}
+
+def test_registry_from_proc(tmp_path):
+    registry = MtdRegistry(write_proc_mtd(str(tmp_path / "mtd"), PARTITIONS), str(tmp_path / "missing"), "/dev/")
+
+    assert registry.get_partitions() == {label: {"device": "/dev/" + device, "size": size, "erase_size": 0x10000}
+                                         for device, label, size in PARTITIONS}
+
+def test_label_lookup_is_exact(sys_path, tmp_path):
+    # A partition whose label contains another's, listed first, must not be matched in its place
+    for registry in [MtdRegistry(str(tmp_path / "missing"), sys_path, "/dev/"),
+                     MtdRegistry(write_proc_mtd(str(tmp_path / "mtd"), PARTITIONS), str(tmp_path / "missing"), "/dev/")]:
+        assert registry.label_to_device("kernel") == "/dev/mtd2"
+        assert registry.label_to_device("kernel-backup") == "/dev/mtd1"
+
+        with pytest.raises(MtdError, match="No MTD partition labelled kern"):
+            registry.label_to_device("kern")
+
+def test_registry_rescans_on_hotplug(sys_path, tmp_path):
+    registry = MtdRegistry(str(tmp_path / "missing"), sys_path, "/dev/")
+    assert "user" not in registry.get_partitions()
+
+    add_sys_device(sys_path, "mtd4", "user", 0x100000)
+
+    assert registry.label_to_device("user") == "/dev/mtd4"
@@ -0,0 +1,113 @@
+"""Tests of fetching release assets from peer boards seeding their artifact caches."""
+
+import hashlib
+
+import requests
+import tornado.web
+
+from loki_update.download import PeerDownloader, make_session
+
+from conftest import unused_port, wait_for_jobs
+
+CHUNK_SIZE = 64 * 1024
+
+class CorruptChunkHandler(tornado.web.RequestHandler):
+    """
+    Request handler serving every chunk of an asset with its bytes corrupted, as a faulty peer would
+    """
+
+    def initialize(self, data):
+        self.data = data
+
+    def get(self):
+        start, _, end = self.request.headers["Range"].partition("=")[2].partition("-")
+        self.set_status(206)
+        self.write(bytes(byte ^ 0xff for byte in self.data[int(start):int(end) + 1]))
+
+def retrieve_release(served, tag="1.1.0"):
+    """Retrieve a release to the SD card of a board, returning the result of the download job."""
+    served.controller.set_copy_target("sd")
+    served.controller.set_release_to_retrieve({"repo": "loki", "tag": tag})
+    jobs = wait_for_jobs(served.controller)
+    download = [job for job in jobs.values() if job["name"] == "download_release"][-1]
+    assert download["status"] == "complete", download["error_message"]
+    return download["result"]
+
+def serve_seed(board_server):
+    """Serve a board seeding its artifact cache to peers, with release 1.1.0 already retrieved."""
+    upload_port = unused_port()
+    seed = board_server(upload_port=upload_port)
+    retrieve_release(seed)
+    return seed, f"http://127.0.0.1:{upload_port}"
+
+def cached_release(served, releases, tag="1.1.0"):
+    """Check the assets a board has cached against the release, returning the names of those matching."""
+    matching = []
+    for name, data in releases[tag].items():
+        cached = served.controller.artifact_cache.get("stfc-aeg", "loki", tag, name)
+        if cached:
+            with open(cached[0], "rb") as cached_file:
+                if cached_file.read() == data:
+                    matching.append(name)
+
+    return sorted(matching)
+
+def test_fetch_from_peer(board_server, releases):
+    _, seed_url = serve_seed(board_server)
+    served = board_server(artifact_peers=[seed_url])
+
+    result = retrieve_release(served)
+
+    assert sorted(result["peers"]) == sorted(releases["1.1.0"])
+    assert result["downloaded"] == []
+    assert cached_release(served, releases) == sorted(releases["1.1.0"])
+
+def test_peer_not_matching_release_falls_back_to_upstream(board_server, releases, tmp_path):
+    seed, seed_url = serve_seed(board_server)
+    # The seed holds a copy of image.ub which is consistent with its own hashes, but not the release
+    bad_path = str(tmp_path / "image.ub")
+    with open(bad_path, "wb") as bad_file:
+        bad_file.write(b"not the release" * 1000)
+    seed.controller.artifact_cache.put("stfc-aeg", "loki", "1.1.0", "image.ub", bad_path)
+    served = board_server(artifact_peers=[seed_url])
+
+    result = retrieve_release(served)
+
+    assert result["downloaded"] == ["image.ub"]
+    assert "image.ub" not in result["peers"]
+    assert cached_release(served, releases) == sorted(releases["1.1.0"])
+
+def test_unreachable_peer_falls_back_to_upstream(board_server, releases):
+    served = board_server(artifact_peers=[f"http://127.0.0.1:{unused_port()}"])
+
+    result = retrieve_release(served)
+
+    assert result["peers"] == []
+    assert sorted(result["downloaded"]) == sorted(releases["1.1.0"])
+
+def test_board_not_seeding_refuses_peers(board_server):
+    upload_port = unused_port()
+    board_server(upload_port=upload_port, artifact_seed=False)
+
+    response = requests.get(f"http://127.0.0.1:{upload_port}/artifacts/stfc-aeg/loki/1.1.0")
+
+    assert response.status_code == 404
+
+def test_corrupt_chunks_fetched_from_another_peer(board_server, server_thread, releases, tmp_path):
+    _, seed_url = serve_seed(board_server)
+    data = releases["1.1.0"]["image.ub"]
+    bad_port = server_thread.listen(tornado.web.Application([(r"/image.ub", CorruptChunkHandler, dict(data=data))]))
+    asset = {
+        "name": "image.ub",
+        "size": len(data),
+        "sha256": hashlib.sha256(data).hexdigest(),
+        "chunks": [hashlib.sha256(data[start:start + CHUNK_SIZE]).hexdigest() for start in range(0, len(data), CHUNK_SIZE)],
+        "urls": [f"http://127.0.0.1:{bad_port}/image.ub", f"{seed_url}/artifacts/stfc-aeg/loki/1.1.0/image.ub"]
+    }
+    downloader = PeerDownloader(make_session(), [], chunk_size=CHUNK_SIZE)
+
+    digests = downloader.download_assets([asset], str(tmp_path))
+
+    assert digests == {"image.ub": asset["sha256"]}
+    with open(str(tmp_path / "image.ub"), "rb") as image_file:
+        assert image_file.read() == data
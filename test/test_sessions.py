@@ -0,0 +1,100 @@
+"""Tests of resumable upload sessions."""
+
+import os
+import hashlib
+
+import pytest
+import requests
+
+from loki_update.upload import MAX_CHUNK_SIZE, UploadSessionManager
+
+from conftest import unused_port, wait_for_jobs
+
+CHUNK_SIZE = 64 * 1024
+
+@pytest.fixture
+def upload(board_server):
+    """Board serving the upload endpoints, expecting an image.ub upload to its SD card."""
+    upload_port = unused_port()
+    served = board_server(upload_port=upload_port)
+    served.data = os.urandom(4 * CHUNK_SIZE + 100)
+    served.sessions_url = f"http://127.0.0.1:{upload_port}/sessions"
+    served.controller.set_copy_target("sd")
+    served.controller.set_checksums([{"fileName": "image.ub", "checksum": hashlib.sha256(served.data).hexdigest()}])
+    return served
+
+def open_session(served):
+    response = requests.post(served.sessions_url, json={"fileName": "image.ub", "size": len(served.data),
+                                                         "checksum": hashlib.sha256(served.data).hexdigest()})
+    response.raise_for_status()
+    return response.json()
+
+def put_chunk(served, session_id, offset, chunk, checksum=None):
+    return requests.put(f"{served.sessions_url}/{session_id}", params={"offset": offset}, data=chunk,
+                        headers={"X-Chunk-Checksum": checksum or hashlib.sha256(chunk).hexdigest()})
+
+def put_chunks(served, session_id, offsets):
+    for offset in offsets:
+        put_chunk(served, session_id, offset, served.data[offset:offset + CHUNK_SIZE]).raise_for_status()
+
+def test_upload_in_chunks(upload):
+    session = open_session(upload)
+    assert session["missing"] == [[0, len(upload.data)]]
+
+    # Chunks may arrive in any order
+    put_chunks(upload, session["session_id"], reversed(range(0, len(upload.data), CHUNK_SIZE)))
+    requests.post(f"{upload.sessions_url}/{session['session_id']}/finalise").raise_for_status()
+    wait_for_jobs(upload.controller)
+
+    with open(upload.board.sd_path + "image.ub", "rb") as image_file:
+        assert image_file.read() == upload.data
+
+def test_resume_after_restart(upload):
+    session = open_session(upload)
+    put_chunks(upload, session["session_id"], [0, 2 * CHUNK_SIZE])
+
+    # Opening the same file again resumes the session, as does reloading the sessions from disk
+    assert open_session(upload)["missing"] == [[CHUNK_SIZE, 2 * CHUNK_SIZE], [3 * CHUNK_SIZE, len(upload.data)]]
+    reloaded = UploadSessionManager(upload.controller).get(session["session_id"])
+    assert reloaded.missing_ranges() == [[CHUNK_SIZE, 2 * CHUNK_SIZE], [3 * CHUNK_SIZE, len(upload.data)]]
+
+def test_finalise_incomplete_session(upload):
+    session = open_session(upload)
+    put_chunks(upload, session["session_id"], [0])
+
+    response = requests.post(f"{upload.sessions_url}/{session['session_id']}/finalise")
+
+    assert response.status_code == 400
+    assert "incomplete" in response.json()["error"]
+
+def test_chunk_outside_file(upload):
+    session = open_session(upload)
+
+    response = put_chunk(upload, session["session_id"], len(upload.data) - 10, upload.data[:CHUNK_SIZE])
+
+    assert response.status_code == 400
+    assert "outside" in response.json()["error"]
+
+def test_chunk_checksum_failure(upload):
+    session = open_session(upload)
+
+    response = put_chunk(upload, session["session_id"], 0, upload.data[:CHUNK_SIZE], checksum="0" * 64)
+
+    assert response.status_code == 400
+    assert "Checksum failed" in response.json()["error"]
+    assert requests.get(f"{upload.sessions_url}/{session['session_id']}").json()["received"] == []
+
+def test_chunk_too_large(upload):
+    session = open_session(upload)
+
+    response = put_chunk(upload, session["session_id"], 0, bytes(MAX_CHUNK_SIZE + 1))
+
+    assert response.status_code == 413
+
+def test_abandon_session(upload):
+    session = open_session(upload)
+    put_chunks(upload, session["session_id"], [0])
+
+    requests.delete(f"{upload.sessions_url}/{session['session_id']}").raise_for_status()
+
+    assert requests.get(f"{upload.sessions_url}/{session['session_id']}").status_code == 404
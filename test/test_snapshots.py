@@ -0,0 +1,87 @@
+"""Tests of the pre-serialised parameter tree snapshots."""
+
+import json
+
+import requests
+from odin.adapters.parameter_tree import ParameterTree
+
+from loki_update.snapshots import TreeSnapshots
+
+class Counted():
+    """
+    Value read through a getter which counts how often it is called
+    """
+
+    def __init__(self, value):
+        self.value = value
+        self.reads = 0
+
+    def get(self):
+        self.reads += 1
+        return self.value
+
+def make_snapshots():
+    images = Counted("1.0.0")
+    progress = Counted(0)
+    tree = ParameterTree({
+        "installed_images": {"version": (images.get, None)},
+        "copy_progress": {"progress": (progress.get, None)}
+    })
+    return TreeSnapshots(tree, ["installed_images", "copy_progress"], {"installed_images": None}), images, progress
+
+def test_unchanged_subtree_reused():
+    snapshots, images, progress = make_snapshots()
+
+    assert json.loads(snapshots.serialise("installed_images")) == {"installed_images": {"version": "1.0.0"}}
+    reads = images.reads
+    images.value = "1.1.0"
+    assert json.loads(snapshots.serialise("installed_images")) == {"installed_images": {"version": "1.0.0"}}
+    assert images.reads == reads
+
+    snapshots.bump("installed_images")
+    assert json.loads(snapshots.serialise("installed_images")) == {"installed_images": {"version": "1.1.0"}}
+    assert images.reads > reads
+
+def test_volatile_subtree_read_every_time():
+    snapshots, images, progress = make_snapshots()
+
+    snapshots.serialise("copy_progress")
+    progress.value = 50
+    assert json.loads(snapshots.serialise("copy_progress/progress")) == {"progress": 50}
+
+def test_root_assembled_from_fragments():
+    snapshots, images, progress = make_snapshots()
+
+    assert json.loads(snapshots.serialise("")) == {"installed_images": {"version": "1.0.0"}, "copy_progress": {"progress": 0}}
+    images.value = "1.1.0"
+    snapshots.bump_path("")
+    assert json.loads(snapshots.serialise("/"))["installed_images"] == {"version": "1.1.0"}
+
+def test_listeners_told_of_every_bump():
+    snapshots, images, progress = make_snapshots()
+    bumped = []
+    snapshots.add_listener(bumped.append)
+
+    snapshots.bump("installed_images")
+    snapshots.bump("copy_progress")
+    snapshots.bump_path("")
+
+    assert bumped == ["installed_images", "copy_progress", "installed_images", "copy_progress"]
+
+def test_etag_changes_when_path_bumped(board_server):
+    served = board_server()
+    url = served.api_url + "/installed_images/sd/info"
+
+    first = requests.get(url)
+    etag = first.headers["ETag"]
+    assert requests.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    # A change which has not been bumped is not seen, as the snapshot is reused
+    served.controller.sd_installed_image = dict(served.controller.sd_installed_image, app_version="9.9.9")
+    assert requests.get(url, headers={"If-None-Match": etag}).status_code == 304
+
+    served.controller.snapshots.bump("installed_images")
+    changed = requests.get(url, headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["ETag"] != etag
+    assert changed.json()["info"]["app_version"] == "9.9.9"
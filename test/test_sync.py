@@ -0,0 +1,105 @@
+"""Tests of the MMC sync state sampler."""
+
+import os
+import time
+
+import pytest
+
+from loki_update.sync import SyncMonitor
+
+from conftest import wait_for_jobs
+
+DIRTY_BYTES = 64 * 1024 * 1024
+
+def write_meminfo(root, dirty=0, writeback=0):
+    with open(os.path.join(root, "proc", "meminfo"), "w") as meminfo_file:
+        meminfo_file.write(f"MemTotal:  2048000 kB\nDirty:  {dirty // 1024} kB\nWriteback:  {writeback // 1024} kB\n")
+
+def write_block_state(root, device, inflight_writes=0, sectors_written=0):
+    device_path = os.path.join(root, "sys", "block", device)
+    with open(os.path.join(device_path, "inflight"), "w") as inflight_file:
+        inflight_file.write(f"0 {inflight_writes}\n")
+    with open(os.path.join(device_path, "stat"), "w") as stat_file:
+        stat_file.write(f"0 0 0 0 0 0 {sectors_written} 0 0 0 0\n")
+
+@pytest.fixture
+def monitor(simulated_board):
+    monitor = SyncMonitor(sys_block_path=simulated_board.root + "/sys/block",
+                          meminfo_path=simulated_board.root + "/proc/meminfo")
+    monitor.root = simulated_board.root
+    return monitor
+
+def test_synced_when_idle(monitor):
+    monitor.sample()
+
+    assert monitor.is_synced()
+    assert monitor.get_status()["eta"] == 0
+
+def test_dirty_data_not_synced(monitor):
+    write_meminfo(monitor.root, dirty=DIRTY_BYTES)
+    monitor.sample()
+
+    status = monitor.get_status()
+    assert not status["synced"]
+    assert status["dirty_bytes"] == DIRTY_BYTES
+    assert status["eta"] is None
+
+def test_inflight_writes_not_synced(monitor):
+    write_block_state(monitor.root, "mmcblk1", inflight_writes=3)
+    monitor.sample()
+
+    assert not monitor.is_synced()
+    assert monitor.get_status()["inflight_writes"] == 3
+
+def test_eta_from_write_rate(monitor):
+    write_meminfo(monitor.root, dirty=DIRTY_BYTES)
+    monitor.sample()
+    write_block_state(monitor.root, "mmcblk0", sectors_written=100000)
+    monitor.sample()
+
+    status = monitor.get_status()
+    assert status["write_rate"] > 0
+    assert status["eta"] == round(DIRTY_BYTES / monitor.write_rate, 1)
+
+def test_change_reported_only_when_state_changes(monitor):
+    changes = []
+    monitor.on_change = lambda: changes.append(monitor.is_synced())
+
+    monitor.sample()
+    monitor.sample()
+    write_meminfo(monitor.root, dirty=DIRTY_BYTES)
+    monitor.sample()
+    monitor.sample()
+    write_meminfo(monitor.root)
+    monitor.sample()
+
+    assert changes == [False, True]
+
+def test_resampled_after_write_job(controller, simulated_board):
+    # Stop the background sampler, so only a forced sample can see the write
+    controller.sync_monitor.stop()
+    controller.sync_monitor.thread.join()
+    assert controller.get_mmc_synced()
+
+    # The backup leaves dirty data in the page cache, which is still being written back
+    write_meminfo(simulated_board.root, dirty=DIRTY_BYTES)
+    controller.set_emmc_backup(True)
+    wait_for_jobs(controller)
+
+    # The scheduler reports the job finished before it calls back to the controller
+    deadline = time.monotonic() + 5
+    while controller.get_mmc_synced() and time.monotonic() < deadline:
+        time.sleep(0.001)
+
+    assert not controller.get_mmc_synced()
+    assert controller.sync_monitor.get_status()["dirty_bytes"] == DIRTY_BYTES
+
+def test_not_resampled_after_read_only_job(controller, simulated_board):
+    controller.sync_monitor.stop()
+    controller.sync_monitor.thread.join()
+
+    write_meminfo(simulated_board.root, dirty=DIRTY_BYTES)
+    controller.set_refresh_flash_image_info(True)
+    wait_for_jobs(controller)
+
+    assert controller.get_mmc_synced()